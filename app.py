@@ -1,13 +1,23 @@
-from flask import Flask, render_template, request, jsonify, redirect, url_for, flash
+from flask import Flask, render_template, request, jsonify, redirect, url_for, flash, Response, stream_with_context
 from flask_migrate import Migrate
 from datetime import datetime, timedelta
 import os
+import click
 import json
 from config import Config
-from models import db, Account, Schedule, LoginLog, EmailConfig
+from models import db, Account, Schedule, DailyAccountStats, LoginAttempt, LoginLog, EmailConfig, day_range, ensure_columns, ensure_indexes
 from services.login_service import LoginService
 from services.email_service import EmailService
 from services.scheduler_service import SchedulerService
+from services.batch_login_service import BatchLoginService
+from services.daily_stats import rebuild_daily_stats
+from services.log_compaction import compact_logs
+from services.log_export import EXPORT_FORMATS, export_statement, iter_csv, iter_ndjson
+from services.log_purge import LogPurgeService
+from services.log_pagination import CountCache, InvalidCursor, log_list_query, paginate_logs
+from services.log_search import LogSearch
+from services.log_writer import get_log_writer
+from services.metrics import REGISTRY as metrics_registry
 
 app = Flask(__name__)
 app.config.from_object(Config)
@@ -17,13 +27,22 @@ db.init_app(app)
 migrate = Migrate(app, db)
 
 # 初始化服务
+log_search = LogSearch()
+log_writer = get_log_writer()
+log_writer.init_app(app, search_index=log_search)
 login_service = LoginService()
+log_count_cache = CountCache()
 email_service = EmailService()
 scheduler_service = SchedulerService(app)
+batch_login_service = BatchLoginService(scheduler_service)
+log_purge_service = LogPurgeService(scheduler_service, on_purged=log_count_cache.clear, search_index=log_search)
 
 # 创建数据库表
 with app.app_context():
     db.create_all()
+    ensure_columns()
+    ensure_indexes()
+    log_search.ensure_index()
     
     # 初始化默认账号
     if Account.query.count() == 0:
@@ -50,38 +69,82 @@ with app.app_context():
         db.session.add(default_email_config)
         db.session.commit()
 
+# 已有日志的全文索引在后台补建，不阻塞启动
+log_search.start_backfill(app)
+
 @app.route('/')
 def index():
-    """首页"""
-    accounts = Account.query.all()
-    from datetime import datetime
+    """首页（账号列表由前端分页加载）"""
     today = datetime.now().strftime('%Y-%m-%d')
-    return render_template('index.html', accounts=accounts, today=today)
+    return render_template('index.html', today=today)
 
 @app.route('/api/accounts', methods=['GET'])
 def get_accounts():
-    """获取所有账号"""
-    accounts = Account.query.all()
-    accounts_data = []
-    
-    for account in accounts:
-        account_dict = account.to_dict()
-        # 获取任务状态
-        job_status = scheduler_service.get_account_job_status(account.id)
-        account_dict['schedule_status'] = job_status
-        
-        # 获取今日登录次数
-        today = datetime.now().strftime('%Y-%m-%d')
-        today_logs = LoginLog.query.filter(
-            LoginLog.account_id == account.id,
-            LoginLog.created_at >= f"{today} 00:00:00",
-            LoginLog.created_at <= f"{today} 23:59:59"
-        ).count()
-        account_dict['today_logins'] = today_logs
-        
-        accounts_data.append(account_dict)
-    
-    return jsonify({'success': True, 'data': accounts_data})
+    """分页获取账号（支持 q 搜索名称/邮箱、active 筛选启用状态）"""
+    try:
+        q = (request.args.get('q') or '').strip()
+        active = request.args.get('active')
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = max(1, min(request.args.get('per_page', 20, type=int), 100))
+        
+        # 账号与今日统计（由日志写入器增量维护）在同一条查询中关联取出，
+        # 队列中尚未落库的记录（最多 LOG_WRITER_FLUSH_INTERVAL 秒）不等待
+        today = datetime.now().date()
+        query = db.session.query(Account, DailyAccountStats).outerjoin(
+            DailyAccountStats,
+            db.and_(DailyAccountStats.account_id == Account.id, DailyAccountStats.day == today)
+        )
+        
+        if q:
+            # 转义 LIKE 通配符，按字面匹配用户输入的 % 和 _
+            escaped = q.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+            pattern = f"%{escaped}%"
+            query = query.filter(db.or_(Account.name.ilike(pattern, escape='\\'),
+                                        Account.email.ilike(pattern, escape='\\')))
+        
+        if active in ['1', 'true']:
+            query = query.filter(Account.is_active == True)
+        elif active in ['0', 'false']:
+            query = query.filter(Account.is_active == False)
+        
+        total = query.order_by(None).count()
+        pages = (total + per_page - 1) // per_page
+        page = min(page, max(pages, 1))
+        rows = query.order_by(Account.id).offset((page - 1) * per_page).limit(per_page).all()
+        
+        # 调度器任务状态一次性取出
+        job_statuses = scheduler_service.get_account_job_statuses([account.id for account, _ in rows])
+        
+        accounts_data = []
+        for account, stats in rows:
+            account_dict = account.to_dict()
+            account_dict['schedule_status'] = job_statuses[account.id]
+            account_dict['today_logins'] = stats.attempts if stats else 0
+            account_dict['today_stats'] = stats.to_dict() if stats else None
+            accounts_data.append(account_dict)
+        
+        return jsonify({
+            'success': True,
+            'data': accounts_data,
+            'pagination': {
+                'page': page,
+                'per_page': per_page,
+                'total': total,
+                'pages': pages
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取账号失败: {str(e)}'}), 500
+
+@app.route('/api/accounts/names', methods=['GET'])
+def get_account_names():
+    """获取全部账号的ID和名称（用于下拉筛选）"""
+    try:
+        rows = db.session.query(Account.id, Account.name).order_by(Account.id).all()
+        return jsonify({'success': True, 'data': [{'id': row.id, 'name': row.name} for row in rows]})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取账号失败: {str(e)}'}), 500
 
 @app.route('/api/accounts', methods=['POST'])
 def add_account():
@@ -202,6 +265,46 @@ def login_account(account_id):
     except Exception as e:
         return jsonify({'success': False, 'message': f'登录失败: {str(e)}'}), 500
 
+@app.route('/api/accounts/login-all', methods=['POST'])
+def login_all_accounts():
+    """批量登录所有启用的账号"""
+    try:
+        data = request.get_json(silent=True) or {}
+        batch_id, message = batch_login_service.start_batch(data.get('account_ids'))
+        
+        if not batch_id:
+            return jsonify({'success': False, 'message': message}), 400
+        
+        return jsonify({
+            'success': True,
+            'message': message,
+            'data': batch_login_service.get_batch_status(batch_id)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'批量登录失败: {str(e)}'}), 500
+
+@app.route('/api/accounts/login-all/<batch_id>', methods=['GET'])
+def get_login_all_status(batch_id):
+    """获取批量登录进度"""
+    status = batch_login_service.get_batch_status(batch_id)
+    if not status:
+        return jsonify({'success': False, 'message': '批次不存在'}), 404
+    return jsonify({'success': True, 'data': status})
+
+@app.route('/api/accounts/<int:account_id>/club', methods=['GET'])
+def get_account_club(account_id):
+    """获取账号的俱乐部信息（refresh=1 时强制重新获取）"""
+    try:
+        refresh = request.args.get('refresh', '0').lower() in ['1', 'true']
+        club, message = login_service.get_club_info(account_id, refresh=refresh)
+        if club is None:
+            return jsonify({'success': False, 'message': message}), 404
+        
+        return jsonify({'success': True, 'message': message, 'data': club.to_dict()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取俱乐部信息失败: {str(e)}'}), 500
+
 @app.route('/api/accounts/<int:account_id>/schedule', methods=['POST'])
 def add_schedule(account_id):
     """添加定时任务"""
@@ -263,81 +366,244 @@ def get_logs():
         account_id = request.args.get('account_id', type=int)
         date = request.args.get('date')
         level = request.args.get('level')
-        page = request.args.get('page', 1, type=int)
-        per_page = request.args.get('per_page', 50, type=int)
+        cursor = request.args.get('cursor')
+        per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+        include_total = request.args.get('include_total', '0').lower() in ['1', 'true']
+        include_details = request.args.get('include_details', '0').lower() in ['1', 'true']
+
+        if date:
+            try:
+                day_range(date)
+            except ValueError:
+                return jsonify({'success': False, 'message': '日期格式应为 YYYY-MM-DD'}), 400
         
-        # 构建查询
-        query = LoginLog.query
+        # 构建查询（账号名称随日志一并加载）
+        query = log_list_query()
         
         if account_id:
             query = query.filter(LoginLog.account_id == account_id)
         
         if date:
-            start_date = f"{date} 00:00:00"
-            end_date = f"{date} 23:59:59"
-            query = query.filter(LoginLog.created_at >= start_date, LoginLog.created_at <= end_date)
+            query = query.filter(LoginLog.created_on(date))
         
         if level:
             query = query.filter(LoginLog.level == level.upper())
         
-        # 排序和分页
-        query = query.order_by(LoginLog.created_at.desc())
-        pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+        # 按 (created_at, id) 游标分页
+        logs, next_cursor = paginate_logs(query, per_page, cursor)
         
         # 构建返回数据
         logs_data = []
-        for log in pagination.items:
-            logs_data.append(log.to_dict())
+        for log in logs:
+            logs_data.append(log.to_dict(include_details=include_details))
+        
+        pagination = {
+            'per_page': per_page,
+            'next_cursor': next_cursor,
+            'has_more': next_cursor is not None
+        }
+        if include_total:
+            # 总数按筛选条件缓存，避免每次翻页都执行 COUNT
+            pagination['total'], pagination['total_cached'] = log_count_cache.get((account_id, date, level), query)
         
         return jsonify({
             'success': True,
             'data': {
                 'logs': logs_data,
+                'pagination': pagination
+            }
+        })
+        
+    except InvalidCursor as e:
+        return jsonify({'success': False, 'message': str(e)}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取日志失败: {str(e)}'}), 500
+
+@app.route('/api/logs/search', methods=['GET'])
+def search_logs():
+    """全文检索日志（按相关度排序，可与账号、日期、级别筛选组合）"""
+    try:
+        q = (request.args.get('q') or '').strip()
+        if not q:
+            return jsonify({'success': False, 'message': '搜索关键词不能为空'}), 400
+        
+        account_id = request.args.get('account_id', type=int)
+        date = request.args.get('date')
+        level = request.args.get('level')
+        page = max(1, request.args.get('page', 1, type=int))
+        per_page = max(1, min(request.args.get('per_page', 50, type=int), 200))
+        include_details = request.args.get('include_details', '0').lower() in ['1', 'true']
+
+        if date:
+            try:
+                day_range(date)
+            except ValueError:
+                return jsonify({'success': False, 'message': '日期格式应为 YYYY-MM-DD'}), 400
+        
+        logs, has_more = log_search.search(q, account_id, date, level, page, per_page)
+        # 默认配置下登录接口返回的错误信息只保存在登录尝试记录中
+        attempts, attempts_has_more = log_search.search_attempts(q, account_id, date, level, page, per_page)
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'logs': [log.to_dict(include_details=include_details) for log in logs],
+                'attempts': [attempt.to_dict() for attempt in attempts],
                 'pagination': {
                     'page': page,
                     'per_page': per_page,
-                    'total': pagination.total,
-                    'pages': pagination.pages
+                    'has_more': has_more,
+                    'attempts_has_more': attempts_has_more
+                },
+                'engine': log_search.search_mode
+            }
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'搜索日志失败: {str(e)}'}), 500
+
+@app.route('/api/logs/export', methods=['GET'])
+def export_logs():
+    """流式导出日志（NDJSON 或 CSV）"""
+    try:
+        export_format = request.args.get('format', 'ndjson').lower()
+        account_id = request.args.get('account_id', type=int)
+        date = request.args.get('date')
+        start_date = request.args.get('start_date') or date
+        end_date = request.args.get('end_date') or date
+        level = request.args.get('level')
+        include_details = request.args.get('include_details', '0').lower() in ['1', 'true']
+
+        if export_format not in EXPORT_FORMATS:
+            return jsonify({'success': False, 'message': '导出格式只支持 ndjson 或 csv'}), 400
+
+        # 日期区间按天闭区间处理：[start_date 00:00, end_date 次日 00:00)
+        try:
+            start = day_range(start_date)[0] if start_date else None
+            end = day_range(end_date)[1] if end_date else None
+        except ValueError:
+            return jsonify({'success': False, 'message': '日期格式应为 YYYY-MM-DD'}), 400
+
+        stmt = export_statement(account_id, start, end, level)
+        generate = iter_csv if export_format == 'csv' else iter_ndjson
+        filename = f"login_logs_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{export_format}"
+
+        # 生成器逐批读取、逐批输出，整个导出过程不在内存中累积结果
+        return Response(
+            stream_with_context(generate(stmt, include_details)),
+            content_type=EXPORT_FORMATS[export_format],
+            headers={'Content-Disposition': f'attachment; filename="{filename}"'}
+        )
+
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'导出日志失败: {str(e)}'}), 500
+
+@app.route('/api/attempts', methods=['GET'])
+def get_attempts():
+    """获取登录尝试记录及按结果代码的统计"""
+    try:
+        account_id = request.args.get('account_id', type=int)
+        date = request.args.get('date')
+        outcome = request.args.get('outcome')
+        limit = max(1, min(request.args.get('limit', 50, type=int), 500))
+
+        if date:
+            try:
+                day_range(date)
+            except ValueError:
+                return jsonify({'success': False, 'message': '日期格式应为 YYYY-MM-DD'}), 400
+        
+        filters = []
+        if account_id:
+            filters.append(LoginAttempt.account_id == account_id)
+        if date:
+            filters.append(LoginAttempt.created_on(date))
+        
+        summary = dict(
+            db.session.query(LoginAttempt.outcome, db.func.count(LoginAttempt.id))
+            .filter(*filters).group_by(LoginAttempt.outcome).all()
+        )
+        
+        query = LoginAttempt.query.filter(*filters)
+        if outcome:
+            query = query.filter(LoginAttempt.outcome == outcome)
+        attempts = query.order_by(LoginAttempt.created_at.desc(), LoginAttempt.id.desc()).limit(limit).all()
+        
+        return jsonify({
+            'success': True,
+            'data': {
+                'attempts': [attempt.to_dict() for attempt in attempts],
+                'summary': {
+                    'total': sum(summary.values()),
+                    'success': sum(count for key, count in summary.items() if key in ('success', 'reused')),
+                    'outcomes': summary
                 }
             }
         })
         
     except Exception as e:
-        return jsonify({'success': False, 'message': f'获取日志失败: {str(e)}'}), 500
+        return jsonify({'success': False, 'message': f'获取登录尝试记录失败: {str(e)}'}), 500
 
 @app.route('/api/logs/clear', methods=['POST'])
 def clear_logs():
-    """清空日志"""
+    """清空日志：在后台分批删除，返回任务ID供查询进度"""
     try:
-        data = request.get_json()
+        data = request.get_json(silent=True) or {}
         account_id = data.get('account_id')
         date = data.get('date')
         
-        # 构建删除查询
-        query = LoginLog.query
-        
-        if account_id:
-            query = query.filter(LoginLog.account_id == account_id)
-        
         if date:
-            start_date = f"{date} 00:00:00"
-            end_date = f"{date} 23:59:59"
-            query = query.filter(LoginLog.created_at >= start_date, LoginLog.created_at <= end_date)
+            try:
+                day_range(date)
+            except ValueError:
+                return jsonify({'success': False, 'message': '日期格式应为 YYYY-MM-DD'}), 400
         
-        # 执行删除
-        deleted_count = query.count()
-        query.delete()
-        db.session.commit()
+        # 先写完队列中尚未落库的日志，使其也能被清理（写入器退避重试时不长时间阻塞请求）
+        log_writer.flush(Config.LOG_WRITER_FLUSH_TIMEOUT)
+        job_id, message = log_purge_service.start_clear(account_id=account_id, date=date)
         
         return jsonify({
-            'success': True, 
-            'message': f'已删除 {deleted_count} 条日志'
+            'success': True,
+            'message': message,
+            'data': log_purge_service.get_job_status(job_id)
         })
         
     except Exception as e:
-        db.session.rollback()
         return jsonify({'success': False, 'message': f'清空日志失败: {str(e)}'}), 500
 
+@app.route('/api/logs/clear/<job_id>', methods=['GET'])
+def get_clear_logs_status(job_id):
+    """获取日志清理任务进度"""
+    status = log_purge_service.get_job_status(job_id)
+    if not status:
+        return jsonify({'success': False, 'message': '清理任务不存在'}), 404
+    return jsonify({'success': True, 'data': status})
+
+@app.route('/api/logs/retention', methods=['GET'])
+def get_log_retention():
+    """获取日志保留策略和最近的清理任务"""
+    try:
+        return jsonify({'success': True, 'data': log_purge_service.get_retention_status()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取日志保留策略失败: {str(e)}'}), 500
+
+@app.route('/api/logs/retention/run', methods=['POST'])
+def run_log_retention():
+    """立即执行一次日志保留策略清理"""
+    try:
+        job_id, message = log_purge_service.start_retention()
+        if not job_id:
+            return jsonify({'success': False, 'message': message}), 400
+        
+        return jsonify({
+            'success': True,
+            'message': message,
+            'data': log_purge_service.get_job_status(job_id)
+        })
+        
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'执行日志保留策略清理失败: {str(e)}'}), 500
+
 @app.route('/api/email/config', methods=['GET'])
 def get_email_config():
     """获取邮件配置"""
@@ -419,5 +685,89 @@ def get_scheduler_status():
     except Exception as e:
         return jsonify({'success': False, 'message': f'获取调度器状态失败: {str(e)}'}), 500
 
+@app.route('/api/http/pool/status', methods=['GET'])
+def get_http_pool_status():
+    """获取HTTP会话池状态"""
+    try:
+        stats = login_service.engine.session_pool.get_stats()
+        return jsonify({'success': True, 'data': stats})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取HTTP会话池状态失败: {str(e)}'}), 500
+
+@app.route('/api/ocr/status', methods=['GET'])
+def get_ocr_status():
+    """获取OCR引擎状态"""
+    try:
+        stats = login_service.engine.ocr.get_stats()
+        stats['mode'] = 'process' if login_service.engine.ocr_pool else 'inline'
+        stats['candidates'] = login_service.engine.candidate_stats.get_stats()
+        if login_service.engine.ocr_pool:
+            stats['worker_pool'] = login_service.engine.ocr_pool.get_stats()
+        return jsonify({'success': True, 'data': stats})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取OCR状态失败: {str(e)}'}), 500
+
+@app.route('/api/captcha/prefetch/status', methods=['GET'])
+def get_captcha_prefetch_status():
+    """获取验证码预取队列状态"""
+    try:
+        stats = login_service.engine.prefetcher.get_stats()
+        return jsonify({'success': True, 'data': stats})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取验证码预取状态失败: {str(e)}'}), 500
+
+@app.route('/api/cms/limiter/status', methods=['GET'])
+def get_cms_limiter_status():
+    """获取上游接口限流器和熔断器状态"""
+    try:
+        data = {
+            'rate_limiter': login_service.engine.rate_limiter.get_stats(),
+            'circuit_breaker': login_service.engine.circuit_breaker.get_stats()
+        }
+        return jsonify({'success': True, 'data': data})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取限流器状态失败: {str(e)}'}), 500
+
+@app.route('/api/logs/writer/status', methods=['GET'])
+def get_log_writer_status():
+    """获取日志批量写入器状态"""
+    try:
+        return jsonify({'success': True, 'data': log_writer.get_stats()})
+    except Exception as e:
+        return jsonify({'success': False, 'message': f'获取日志写入器状态失败: {str(e)}'}), 500
+
+@app.route('/api/metrics', methods=['GET'])
+def get_metrics():
+    """以 Prometheus 文本格式输出登录流程指标"""
+    return Response(metrics_registry.render(), content_type='text/plain; version=0.0.4; charset=utf-8')
+
+@app.cli.command('backfill-daily-stats')
+@click.option('--since', default=None, help='只重建该日期（YYYY-MM-DD）及之后的统计，默认重建全部')
+def backfill_daily_stats(since):
+    """根据已有的登录尝试记录和日志重建账号每日统计"""
+    since_day = datetime.strptime(since, '%Y-%m-%d').date() if since else None
+    log_writer.flush()
+    count = rebuild_daily_stats(since_day)
+    click.echo(f"已重建 {count} 条账号每日统计")
+
+@app.cli.command('replay-failed-logs')
+def replay_failed_logs():
+    """重新写入日志写入器多次重试仍失败而保存到文件的日志和登录尝试记录"""
+    count = log_writer.replay_failed()
+    click.echo(f"已重新写入 {count} 条记录" if count else f"没有需要重新写入的记录（{log_writer.failed_file}）")
+
+@app.cli.command('compact-logs')
+@click.option('--vacuum', is_flag=True, help='转换完成后执行 VACUUM 回收空间（SQLite，需要独占数据库）')
+def compact_logs_command(vacuum):
+    """把升级前的日志转换为消息模板 + 参数，并压缩 details"""
+    log_writer.flush()
+    scanned, converted = compact_logs(search_index=log_search)
+    click.echo(f"已检查 {scanned} 条日志，其中 {converted} 条转换为消息模板")
+    if vacuum and db.engine.dialect.name == 'sqlite':
+        db.session.remove()
+        with db.engine.connect().execution_options(isolation_level='AUTOCOMMIT') as connection:
+            connection.exec_driver_sql('VACUUM')
+        click.echo("已执行 VACUUM")
+
 if __name__ == '__main__':
     app.run(debug=True)
@@ -22,7 +22,78 @@ class Config:
     # 日志配置
     LOG_DIR = os.environ.get('LOG_DIR') or 'logs'
     LOG_LEVEL = os.environ.get('LOG_LEVEL') or 'INFO'
+    # 是否记录登录流程的逐步日志（获取token、识别结果、登录接口返回等）；关闭时只记录登录结果，
+    # 每次尝试的明细保存在 LoginAttempt 表中
+    VERBOSE_LOGIN_LOGS = (os.environ.get('VERBOSE_LOGIN_LOGS') or 'False').lower() in ['true', 'on', '1']
     
     # 定时任务配置
     SCHEDULER_API_ENABLED = True
-    SCHEDULER_TIMEZONE = 'Asia/Shanghai'
\ No newline at end of file
+    SCHEDULER_TIMEZONE = 'Asia/Shanghai'
+    
+    # 登录引擎配置
+    CMS_API_BASE_URL = os.environ.get('CMS_API_BASE_URL') or 'https://cmsapi3.qiucheng-wangluo.com/cms-api'
+    CMS_HOST_CONCURRENCY = int(os.environ.get('CMS_HOST_CONCURRENCY') or 20)
+    CMS_REQUEST_TIMEOUT = int(os.environ.get('CMS_REQUEST_TIMEOUT') or 30)
+    LOGIN_MAX_ATTEMPTS = int(os.environ.get('LOGIN_MAX_ATTEMPTS') or 5)
+    LOGIN_RETRY_JITTER_SECONDS = float(os.environ.get('LOGIN_RETRY_JITTER_SECONDS') or 2)  # 定时任务重试的随机抖动上限
+    RSA_KEY_CACHE_SIZE = int(os.environ.get('RSA_KEY_CACHE_SIZE') or 256)  # 已解析公钥的LRU缓存大小
+    
+    # 登录会话复用配置
+    SESSION_REUSE_ENABLED = os.environ.get('SESSION_REUSE_ENABLED', 'True').lower() in ['true', 'on', '1']
+    SESSION_TOKEN_TTL_MINUTES = int(os.environ.get('SESSION_TOKEN_TTL_MINUTES') or 120)  # 尚未观测到真实有效期时使用的默认值
+    # 俱乐部列表接口返回这些错误码时认为 token 已失效（逗号分隔）；其他失败视为无法判断，保留 token
+    SESSION_EXPIRED_ERROR_CODES = [int(code) for code in (os.environ.get('SESSION_EXPIRED_ERROR_CODES') or '401').split(',') if code.strip()]
+    
+    # 俱乐部信息缓存配置
+    CLUB_INFO_TTL_MINUTES = int(os.environ.get('CLUB_INFO_TTL_MINUTES') or 360)
+    
+    # 上游限流与熔断配置（CMS_RATE_LIMIT 为每秒请求数，0 表示不限流；配置状态文件后多进程共享限流）
+    CMS_RATE_LIMIT = float(os.environ.get('CMS_RATE_LIMIT') or 10)
+    CMS_RATE_BURST = int(os.environ.get('CMS_RATE_BURST') or 20)
+    CMS_RATE_LIMIT_STATE_FILE = os.environ.get('CMS_RATE_LIMIT_STATE_FILE') or None
+    CIRCUIT_FAILURE_THRESHOLD = int(os.environ.get('CIRCUIT_FAILURE_THRESHOLD') or 10)  # 连续失败多少次后熔断
+    CIRCUIT_RECOVERY_SECONDS = int(os.environ.get('CIRCUIT_RECOVERY_SECONDS') or 30)
+    
+    # 日志批量写入配置
+    LOG_WRITER_BATCH_SIZE = int(os.environ.get('LOG_WRITER_BATCH_SIZE') or 200)
+    LOG_WRITER_FLUSH_INTERVAL = float(os.environ.get('LOG_WRITER_FLUSH_INTERVAL') or 1.0)  # 秒
+    LOG_WRITER_QUEUE_SIZE = int(os.environ.get('LOG_WRITER_QUEUE_SIZE') or 10000)  # 队列满时写入方阻塞等待
+    LOG_WRITER_MAX_RETRIES = int(os.environ.get('LOG_WRITER_MAX_RETRIES') or 5)  # 数据库被锁等错误时整批最多尝试的次数
+    LOG_WRITER_RETRY_BACKOFF = float(os.environ.get('LOG_WRITER_RETRY_BACKOFF') or 0.5)  # 首次重试等待秒数，之后每次翻倍
+    LOG_WRITER_FLUSH_TIMEOUT = float(os.environ.get('LOG_WRITER_FLUSH_TIMEOUT') or 2.0)  # 发送邮件、清理日志前等待队列写完的最长秒数
+    LOG_WRITER_FAILED_FILE = os.environ.get('LOG_WRITER_FAILED_FILE') or os.path.join(LOG_DIR, 'failed_log_rows.ndjson')
+    LOG_COUNT_CACHE_SECONDS = int(os.environ.get('LOG_COUNT_CACHE_SECONDS') or 30)  # /api/logs 总数缓存时间
+
+    # 日志保留与清理配置
+    LOG_RETENTION_DAYS = int(os.environ.get('LOG_RETENTION_DAYS') or 0)  # 保留最近 N 天的日志和登录尝试记录，0（默认）表示不按天数清理
+    LOG_RETENTION_MAX_ROWS_PER_ACCOUNT = int(os.environ.get('LOG_RETENTION_MAX_ROWS_PER_ACCOUNT') or 0)  # 每个账号最多保留的行数，0 表示不限制
+    LOG_RETENTION_HOUR = int(os.environ.get('LOG_RETENTION_HOUR') or 3)  # 每天几点执行保留策略清理
+    LOG_PURGE_CHUNK_SIZE = int(os.environ.get('LOG_PURGE_CHUNK_SIZE') or 2000)  # 每个删除事务最多删除的行数
+    LOG_PURGE_PAUSE_SECONDS = float(os.environ.get('LOG_PURGE_PAUSE_SECONDS') or 0.05)  # 两次删除之间让出数据库写锁的时间
+
+    # HTTP连接池配置
+    HTTP_POOL_MAX_SESSIONS = int(os.environ.get('HTTP_POOL_MAX_SESSIONS') or 1000)
+    HTTP_POOL_CONNECTIONS = int(os.environ.get('HTTP_POOL_CONNECTIONS') or 100)
+    HTTP_POOL_CONNECTIONS_PER_HOST = int(os.environ.get('HTTP_POOL_CONNECTIONS_PER_HOST') or 20)
+    HTTP_KEEPALIVE_TIMEOUT = int(os.environ.get('HTTP_KEEPALIVE_TIMEOUT') or 30)
+    
+    # OCR配置
+    OCR_POOL_SIZE = int(os.environ.get('OCR_POOL_SIZE') or 1)
+    OCR_MODE = os.environ.get('OCR_MODE') or 'inline'  # inline: 进程内线程池识别; process: 独立进程池识别
+    OCR_WORKERS = int(os.environ.get('OCR_WORKERS') or 0)  # 0 表示使用全部CPU核心
+    OCR_BATCH_SIZE = int(os.environ.get('OCR_BATCH_SIZE') or 8)
+    OCR_BATCH_WAIT_MS = int(os.environ.get('OCR_BATCH_WAIT_MS') or 5)
+    OCR_TIMEOUT_SECONDS = float(os.environ.get('OCR_TIMEOUT_SECONDS') or 10)  # 进程池识别超时后改用进程内识别
+    
+    # 验证码候选配置
+    CAPTCHA_CANDIDATES = int(os.environ.get('CAPTCHA_CANDIDATES') or 1)  # 每个验证码最多尝试的候选数（仅当接口允许同一验证码多次提交时大于 1 才有意义）
+    CAPTCHA_MIN_CONFIDENCE = float(os.environ.get('CAPTCHA_MIN_CONFIDENCE') or 0.3)  # 低于该置信度的验证码直接丢弃
+    CAPTCHA_MAX_REFETCH = int(os.environ.get('CAPTCHA_MAX_REFETCH') or 2)  # 每次尝试内因低置信度重新获取验证码的次数
+    
+    # 验证码预取配置（队列大小为0时关闭预取）
+    CAPTCHA_PREFETCH_SIZE = int(os.environ.get('CAPTCHA_PREFETCH_SIZE') or 2)
+    CAPTCHA_PREFETCH_TTL = int(os.environ.get('CAPTCHA_PREFETCH_TTL') or 60)
+    CAPTCHA_PREFETCH_IDLE_TIMEOUT = int(os.environ.get('CAPTCHA_PREFETCH_IDLE_TIMEOUT') or 60)
+    
+    # 批量登录配置
+    BATCH_LOGIN_CONCURRENCY = int(os.environ.get('BATCH_LOGIN_CONCURRENCY') or 100)  # 同时登录的账号数（事件循环上的协程，HTTP 请求另受 CMS_HOST_CONCURRENCY 和限流约束）
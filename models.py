@@ -1,9 +1,20 @@
 from flask_sqlalchemy import SQLAlchemy
-from datetime import datetime
+from sqlalchemy import and_, inspect
+from datetime import datetime, timedelta
 import json
+import zlib
 
 db = SQLAlchemy()
 
+def day_range(day):
+    """返回某一天的半开时间区间 [当天 00:00, 次日 00:00)；day 可以是 date 或 'YYYY-MM-DD' 字符串"""
+    if isinstance(day, str):
+        day = datetime.strptime(day, '%Y-%m-%d').date()
+    elif isinstance(day, datetime):
+        day = day.date()
+    start = datetime.combine(day, datetime.min.time())
+    return start, start + timedelta(days=1)
+
 class Account(db.Model):
     """账号模型"""
     id = db.Column(db.Integer, primary_key=True)
@@ -55,30 +66,338 @@ class Schedule(db.Model):
             'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S')
         }
 
+def encode_details(text):
+    """编码 details 的 JSON 文本，返回 (details, compressed_details)
+
+    zlib 压缩后更短时保存到 compressed_details，很短的 JSON 压缩后反而更长，原样保存到 details。
+    """
+    if not text:
+        return None, None
+    raw = text.encode('utf-8')
+    compressed = zlib.compress(raw)
+    if len(compressed) < len(raw):
+        return None, compressed
+    return text, None
+
+def details_text(compressed, legacy=None):
+    """返回 details 的 JSON 文本：优先解压 compressed_details，否则返回未压缩的 details"""
+    if compressed is not None:
+        return zlib.decompress(compressed).decode('utf-8')
+    return legacy
+
 class LoginLog(db.Model):
-    """登录日志模型"""
+    """登录日志模型
+
+    固定格式的消息只保存模板编号和参数（message 为空），读取时再渲染为文本；details 的 JSON 压缩后更短时以 zlib 压缩保存。
+    """
+    __table_args__ = (
+        db.Index('ix_login_log_account_created', 'account_id', 'created_at'),
+        db.Index('ix_login_log_level_created', 'level', 'created_at'),
+        db.Index('ix_login_log_success_created', 'is_success', 'created_at'),
+        db.Index('ix_login_log_created', 'created_at'),
+    )
+    
+    # 消息模板：{模板名: (编号, 文本)}。编号写入数据库后不能修改或复用，新增模板使用新的编号
+    TEMPLATES = {
+        'login_started': (1, '开始为账号 [{name}] 执行自动登录流程...'),
+        'attempt_started': (2, '尝试第 {attempt} 次登录 [{name}]...'),
+        'prefetched_captcha': (3, '使用预取的验证码: {captcha}'),
+        'token_failed': (4, '获取token失败，等待重试...'),
+        'token_fetched': (5, '获取token成功: {token}...'),
+        'captcha_fetched': (6, '获取验证码成功'),
+        'captcha_low_confidence': (7, '验证码置信度过低 ({captcha}, {confidence:.2f})，重新获取验证码'),
+        'captcha_fetch_failed': (8, '获取验证码失败，等待重试...'),
+        'ocr_failed': (9, '验证码识别失败或格式不正确: {captcha}，等待重试...'),
+        'ocr_result': (10, '识别验证码结果: {candidates}'),
+        'captcha_next_candidate': (11, '验证码错误，尝试第 {rank} 个候选: {captcha}'),
+        'request_failed': (12, '登录请求失败'),
+        'login_result': (13, '登录结果: 错误码 {code}'),
+        'login_succeeded': (14, '登录成功!'),
+        'club_list_fetched': (15, '获取俱乐部列表成功'),
+        'club_list_failed': (16, '获取俱乐部列表失败'),
+        'login_failed': (17, '登录失败: {error}'),
+        'captcha_rejected': (18, '验证码错误，立即重试...'),
+        'session_reused': (19, '检测到有效的登录会话，跳过验证码登录'),
+        'circuit_open': (20, '上游接口熔断中，跳过第 {attempt} 次登录尝试'),
+        'max_attempts_reached': (21, '已达到最大尝试次数 {max_attempts}，登录失败'),
+        'retry_wait': (22, '等待 {seconds} 秒后重试...'),
+        'retry_scheduled': (23, '将在 {delay:.1f} 秒后进行第 {attempt} 次尝试'),
+        'success_email_sent': (24, '登录成功邮件已发送到 {email}'),
+        'daily_email_sent': (25, '每日日志邮件已发送到 {email}'),
+        'captcha_expired': (26, '验证码提交后已失效，重新获取验证码...')
+    }
+    TEMPLATE_TEXTS = {template_id: text for template_id, text in TEMPLATES.values()}
+    
     id = db.Column(db.Integer, primary_key=True)
     account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
     level = db.Column(db.String(20), nullable=False, comment='日志级别')
-    message = db.Column(db.Text, nullable=False, comment='日志消息')
-    details = db.Column(db.Text, nullable=True, comment='详细信息JSON')
+    template_id = db.Column(db.SmallInteger, nullable=True, comment='消息模板编号')
+    params = db.Column(db.Text, nullable=True, comment='消息模板参数JSON')
+    message = db.Column(db.Text, nullable=False, default='', comment='日志消息（使用模板时为空）')
+    details = db.Column(db.Text, nullable=True, comment='详细信息JSON（未压缩）')
+    compressed_details = db.Column(db.LargeBinary, nullable=True, comment='zlib压缩的详细信息JSON')
     is_success = db.Column(db.Boolean, default=False, comment='是否成功')
     created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='创建时间')
     
     # 关联账号
     account = db.relationship('Account', backref=db.backref('login_logs', lazy=True))
     
-    def to_dict(self):
-        return {
+    @classmethod
+    def created_on(cls, day):
+        """created_at 落在指定日期内的过滤条件（半开区间，可以使用 created_at 相关索引）"""
+        start, end = day_range(day)
+        return and_(cls.created_at >= start, cls.created_at < end)
+    
+    @classmethod
+    def render_message(cls, template_id, params, message):
+        """根据模板编号和参数（JSON 文本）渲染日志消息；没有模板时返回原消息"""
+        template = cls.TEMPLATE_TEXTS.get(template_id)
+        if template is None:
+            return message
+        try:
+            return template.format(**(json.loads(params) if params else {}))
+        except (KeyError, IndexError, ValueError):
+            return f"{template} {params}"
+    
+    @property
+    def text(self):
+        """渲染后的日志消息"""
+        return self.render_message(self.template_id, self.params, self.message)
+    
+    def to_dict(self, include_details=True):
+        data = {
             'id': self.id,
             'account_id': self.account_id,
             'account_name': self.account.name if self.account else '未知账号',
             'level': self.level,
-            'message': self.message,
-            'details': json.loads(self.details) if self.details else None,
+            'message': self.text,
             'is_success': self.is_success,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
         }
+        if include_details:
+            text = details_text(self.compressed_details, self.details)
+            data['details'] = json.loads(text) if text else None
+        return data
+
+class LoginAttempt(db.Model):
+    """登录尝试模型：每次登录尝试一行，记录结果代码、验证码识别结果和各阶段耗时"""
+    __table_args__ = (
+        db.Index('ix_login_attempt_account_created', 'account_id', 'created_at'),
+        db.Index('ix_login_attempt_success_created', 'is_success', 'created_at'),
+        db.Index('ix_login_attempt_created', 'created_at'),
+    )
+    
+    # 结果代码及其说明
+    OUTCOMES = {
+        'success': '登录成功',
+        'reused': '复用登录会话',
+        'token_failed': '获取token失败',
+        'captcha_failed': '获取验证码失败',
+        'ocr_failed': '验证码识别失败',
+        'request_failed': '登录请求失败',
+        'captcha_rejected': '验证码错误',
+        'login_failed': '登录失败',
+        'circuit_open': '上游接口熔断中'
+    }
+    
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    attempt = db.Column(db.Integer, nullable=False, comment='第几次尝试')
+    outcome = db.Column(db.String(20), nullable=False, comment='结果代码')
+    is_success = db.Column(db.Boolean, default=False, comment='是否成功')
+    error_code = db.Column(db.Integer, nullable=True, comment='登录接口返回的iErrCode')
+    error_message = db.Column(db.String(255), nullable=True, comment='登录接口返回的错误信息')
+    ocr_text = db.Column(db.String(20), nullable=True, comment='最后提交的验证码')
+    ocr_confidence = db.Column(db.Float, nullable=True, comment='验证码识别置信度')
+    candidates_tried = db.Column(db.Integer, default=0, comment='提交过的验证码候选数')
+    prefetched = db.Column(db.Boolean, default=False, comment='是否使用预取的验证码')
+    token_ms = db.Column(db.Integer, nullable=True, comment='获取token耗时（毫秒）')
+    captcha_ms = db.Column(db.Integer, nullable=True, comment='获取验证码耗时（毫秒）')
+    ocr_ms = db.Column(db.Integer, nullable=True, comment='验证码识别耗时（毫秒）')
+    encrypt_ms = db.Column(db.Integer, nullable=True, comment='RSA加密耗时（毫秒）')
+    login_ms = db.Column(db.Integer, nullable=True, comment='登录请求耗时（毫秒）')
+    club_list_ms = db.Column(db.Integer, nullable=True, comment='获取俱乐部列表耗时（毫秒）')
+    duration_ms = db.Column(db.Integer, nullable=True, comment='本次尝试总耗时（毫秒）')
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, comment='尝试开始时间')
+    
+    # 关联账号
+    account = db.relationship('Account', backref=db.backref('login_attempts', lazy=True))
+    
+    @classmethod
+    def created_on(cls, day):
+        """created_at 落在指定日期内的过滤条件（半开区间）"""
+        start, end = day_range(day)
+        return and_(cls.created_at >= start, cls.created_at < end)
+    
+    def describe(self):
+        """一行文字描述本次尝试"""
+        label = self.OUTCOMES.get(self.outcome, self.outcome)
+        text = f"第 {self.attempt} 次尝试: {label}"
+        if self.error_message and not self.is_success and self.error_message != label:
+            text += f" ({self.error_message})"
+        if self.duration_ms is not None:
+            text += f"，耗时 {self.duration_ms} ms"
+        return text
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'account_id': self.account_id,
+            'attempt': self.attempt,
+            'outcome': self.outcome,
+            'is_success': self.is_success,
+            'error_code': self.error_code,
+            'error_message': self.error_message,
+            'ocr_text': self.ocr_text,
+            'ocr_confidence': self.ocr_confidence,
+            'candidates_tried': self.candidates_tried,
+            'prefetched': self.prefetched,
+            'timings_ms': {
+                'token': self.token_ms,
+                'captcha': self.captcha_ms,
+                'ocr': self.ocr_ms,
+                'encrypt': self.encrypt_ms,
+                'login': self.login_ms,
+                'club_list': self.club_list_ms
+            },
+            'duration_ms': self.duration_ms,
+            'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S')
+        }
+
+class DailyAccountStats(db.Model):
+    """账号每日登录统计模型：随登录尝试记录的批量写入增量更新"""
+    __table_args__ = (
+        db.UniqueConstraint('account_id', 'day', name='uq_daily_account_stats_account_day'),
+        db.Index('ix_daily_account_stats_day', 'day'),
+    )
+    
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False)
+    day = db.Column(db.Date, nullable=False, comment='统计日期')
+    attempts = db.Column(db.Integer, nullable=False, default=0, comment='登录尝试次数')
+    successes = db.Column(db.Integer, nullable=False, default=0, comment='成功次数')
+    failures = db.Column(db.Integer, nullable=False, default=0, comment='失败次数')
+    last_success_at = db.Column(db.DateTime, nullable=True, comment='最近一次成功时间')
+    total_duration_ms = db.Column(db.BigInteger, nullable=False, default=0, comment='有耗时记录的尝试总耗时（毫秒）')
+    timed_attempts = db.Column(db.Integer, nullable=False, default=0, comment='有耗时记录的尝试次数')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment='更新时间')
+    
+    # 关联账号
+    account = db.relationship('Account', backref=db.backref('daily_stats', lazy=True))
+    
+    @property
+    def average_latency_ms(self):
+        """平均每次尝试耗时（毫秒），没有耗时记录时为 None"""
+        if not self.timed_attempts:
+            return None
+        return round(self.total_duration_ms / self.timed_attempts)
+    
+    def to_dict(self):
+        return {
+            'account_id': self.account_id,
+            'day': self.day.strftime('%Y-%m-%d'),
+            'attempts': self.attempts,
+            'successes': self.successes,
+            'failures': self.failures,
+            'last_success_at': self.last_success_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_success_at else None,
+            'average_latency_ms': self.average_latency_ms
+        }
+
+class AccountSession(db.Model):
+    """账号登录会话模型：保存最近一次登录成功的 token 及其观测到的有效期"""
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, unique=True)
+    token = db.Column(db.Text, nullable=True, comment='登录token')
+    obtained_at = db.Column(db.DateTime, nullable=True, comment='token获取时间')
+    expires_at = db.Column(db.DateTime, nullable=True, comment='预计过期时间')
+    last_validated_at = db.Column(db.DateTime, nullable=True, comment='最近一次验证有效的时间')
+    observed_lifetime_seconds = db.Column(db.Integer, nullable=True, comment='已确认的最长token有效时长（秒）')
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow, comment='更新时间')
+    
+    # 关联账号（删除账号时一并删除会话）
+    account = db.relationship('Account', backref=db.backref('login_session', uselist=False, cascade='all, delete-orphan'))
+    
+    def is_usable(self, now=None):
+        """token 存在且未超过预计过期时间"""
+        now = now or datetime.utcnow()
+        return bool(self.token) and (self.expires_at is None or self.expires_at > now)
+    
+    def is_worth_probing(self, now=None):
+        """token 存在且未超过探测截止时间
+        
+        预计过期时间只是已确认的最长有效期，超过后再过同样长的时间之内仍会探测一次：
+        探测成功时有效期估计随之增长，明确失效时 token 被清除，之后不再探测。
+        """
+        now = now or datetime.utcnow()
+        if not self.token:
+            return False
+        if self.expires_at is None or self.obtained_at is None:
+            return self.is_usable(now)
+        return self.expires_at + (self.expires_at - self.obtained_at) > now
+    
+    def mark_validated(self, now=None):
+        """记录 token 在 now 时仍然有效，已确认的有效期只增不减"""
+        now = now or datetime.utcnow()
+        self.last_validated_at = now
+        if self.obtained_at is None:
+            return
+        lifetime = int((now - self.obtained_at).total_seconds())
+        if lifetime > (self.observed_lifetime_seconds or 0):
+            self.observed_lifetime_seconds = lifetime
+        confirmed_until = self.obtained_at + timedelta(seconds=self.observed_lifetime_seconds or 0)
+        if self.expires_at is None or confirmed_until > self.expires_at:
+            self.expires_at = confirmed_until
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'account_id': self.account_id,
+            'has_token': bool(self.token),
+            'obtained_at': self.obtained_at.strftime('%Y-%m-%d %H:%M:%S') if self.obtained_at else None,
+            'expires_at': self.expires_at.strftime('%Y-%m-%d %H:%M:%S') if self.expires_at else None,
+            'last_validated_at': self.last_validated_at.strftime('%Y-%m-%d %H:%M:%S') if self.last_validated_at else None,
+            'observed_lifetime_seconds': self.observed_lifetime_seconds
+        }
+
+class ClubInfo(db.Model):
+    """俱乐部信息缓存模型：每个账号保存一份最近获取的俱乐部信息"""
+    id = db.Column(db.Integer, primary_key=True)
+    account_id = db.Column(db.Integer, db.ForeignKey('account.id'), nullable=False, unique=True)
+    club_id = db.Column(db.BigInteger, nullable=True, comment='俱乐部ID(lClubID)')
+    club_name = db.Column(db.String(200), nullable=True, comment='俱乐部名称(sClubName)')
+    create_user = db.Column(db.BigInteger, nullable=True, comment='创建者(lCreateUser)')
+    credit_league_id = db.Column(db.BigInteger, nullable=True, comment='联盟ID(iCreditLeagueId)')
+    raw = db.Column(db.Text, nullable=True, comment='原始俱乐部信息JSON')
+    fetched_at = db.Column(db.DateTime, default=datetime.utcnow, comment='获取时间')
+    
+    # 关联账号（删除账号时一并删除缓存）
+    account = db.relationship('Account', backref=db.backref('club_info', uselist=False, cascade='all, delete-orphan'))
+    
+    def is_fresh(self, ttl_minutes, now=None):
+        """缓存是否仍在有效期内"""
+        now = now or datetime.utcnow()
+        return self.fetched_at is not None and now - self.fetched_at < timedelta(minutes=ttl_minutes)
+    
+    def update_from(self, club_data):
+        """使用接口返回的俱乐部信息更新缓存"""
+        self.club_id = club_data.get('lClubID')
+        self.club_name = club_data.get('sClubName')
+        self.create_user = club_data.get('lCreateUser')
+        self.credit_league_id = club_data.get('iCreditLeagueId')
+        self.raw = json.dumps(club_data, ensure_ascii=False)
+        self.fetched_at = datetime.utcnow()
+    
+    def to_dict(self):
+        return {
+            'id': self.id,
+            'account_id': self.account_id,
+            'club_id': self.club_id,
+            'club_name': self.club_name,
+            'create_user': self.create_user,
+            'credit_league_id': self.credit_league_id,
+            'raw': json.loads(self.raw) if self.raw else None,
+            'fetched_at': self.fetched_at.strftime('%Y-%m-%d %H:%M:%S') if self.fetched_at else None
+        }
 
 class EmailConfig(db.Model):
     """邮件配置模型"""
@@ -103,4 +422,24 @@ class EmailConfig(db.Model):
             'is_active': self.is_active,
             'created_at': self.created_at.strftime('%Y-%m-%d %H:%M:%S'),
             'updated_at': self.updated_at.strftime('%Y-%m-%d %H:%M:%S')
-        }
\ No newline at end of file
+        }
+
+def ensure_columns():
+    """为已存在的表补建模型中新增的可空列（create_all 不会修改已存在的表）"""
+    inspector = inspect(db.engine)
+    with db.engine.begin() as connection:
+        for table in db.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing or not column.nullable:
+                    continue
+                column_type = column.type.compile(dialect=db.engine.dialect)
+                connection.exec_driver_sql(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}')
+
+def ensure_indexes():
+    """为已存在的表补建模型中声明的索引（create_all 不会修改已存在的表）"""
+    for table in db.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=db.engine, checkfirst=True)
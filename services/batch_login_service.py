@@ -0,0 +1,143 @@
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from config import Config
+from models import Account
+from .email_service import EmailService
+from .metrics import SCHEDULER_JOBS_IN_FLIGHT
+
+class BatchLoginService:
+    """批量登录服务：在登录引擎的事件循环上并发登录一批账号（有并发上限），并记录进度
+
+    每个批次占用一个线程，用于保存登录结果和发送邮件；账号登录本身不占用线程。
+    """
+
+    def __init__(self, scheduler_service, concurrency=None, max_batches=20):
+        self.scheduler_service = scheduler_service
+        self.concurrency = concurrency or Config.BATCH_LOGIN_CONCURRENCY
+        self.max_batches = max_batches
+        self.executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix='batch-login')
+        self.batches = OrderedDict()
+        self.lock = threading.Lock()
+
+    def start_batch(self, account_ids=None):
+        """启动批量登录，立即返回批次ID；未指定账号时登录所有启用的账号"""
+        query = Account.query.filter_by(is_active=True)
+        if account_ids:
+            query = query.filter(Account.id.in_(account_ids))
+        accounts = query.order_by(Account.id).all()
+
+        if not accounts:
+            return None, "没有可登录的账号"
+
+        batch_id = uuid.uuid4().hex[:12]
+        batch = {
+            'batch_id': batch_id,
+            'status': 'running',
+            'total': len(accounts),
+            'started_at': datetime.now(),
+            'started_clock': time.monotonic(),
+            'finished_at': None,
+            'finished_clock': None,
+            'notify': {account.id for account in accounts if account.email_notification},
+            'accounts': OrderedDict(
+                (account.id, {
+                    'account_id': account.id,
+                    'name': account.name,
+                    'status': 'pending',
+                    'message': None,
+                    'duration': None
+                })
+                for account in accounts
+            )
+        }
+
+        with self.lock:
+            self.batches[batch_id] = batch
+            # 只保留最近的批次记录
+            while len(self.batches) > self.max_batches:
+                self.batches.popitem(last=False)
+
+        self.executor.submit(self._run_batch, batch)
+
+        return batch_id, f"已启动 {len(accounts)} 个账号的批量登录"
+
+    def _run_batch(self, batch):
+        """在批次线程中通过登录引擎并发登录批次内的账号，逐个保存结果"""
+        app = self.scheduler_service.app
+        with SCHEDULER_JOBS_IN_FLIGHT.track_inprogress(job='batch_login'), app.app_context():
+            try:
+                summary = self.scheduler_service.login_service.login_accounts(
+                    list(batch['accounts']),
+                    concurrency=self.concurrency,
+                    on_start=lambda account_id: self._account_started(batch, account_id),
+                    on_result=lambda account_id, success, message: self._account_finished(
+                        batch, account_id, success, message)
+                )
+            except Exception as e:
+                # 异常不能传出应用上下文，否则会触发调度器的 teardown 钩子
+                summary = {account_id: (False, f"执行登录任务失败: {str(e)}") for account_id in batch['accounts']}
+
+            # 启动批次后被删除的账号没有登录结果
+            for account_id, entry in batch['accounts'].items():
+                if entry['status'] in ('pending', 'running'):
+                    self._account_finished(batch, account_id, False, summary[account_id][1])
+
+    def _account_started(self, batch, account_id):
+        with self.lock:
+            entry = batch['accounts'][account_id]
+            entry['status'] = 'running'
+            entry['started_clock'] = time.monotonic()
+
+    def _account_finished(self, batch, account_id, success, message):
+        with self.lock:
+            entry = batch['accounts'][account_id]
+            entry['status'] = 'success' if success else 'failed'
+            entry['message'] = message
+            entry['duration'] = round(time.monotonic() - entry.pop('started_clock', batch['started_clock']), 2)
+
+            if all(item['status'] in ('success', 'failed') for item in batch['accounts'].values()):
+                batch['status'] = 'completed'
+                batch['finished_at'] = datetime.now()
+                batch['finished_clock'] = time.monotonic()
+
+        # 如果登录成功且启用了邮件通知，发送邮件
+        if success and account_id in batch['notify']:
+            EmailService().send_login_success_email(account_id)
+
+    def get_batch_status(self, batch_id):
+        """获取批次进度"""
+        with self.lock:
+            batch = self.batches.get(batch_id)
+            if not batch:
+                return None
+
+            accounts = [{key: value for key, value in entry.items() if key != 'started_clock'}
+                        for entry in batch['accounts'].values()]
+            end_clock = batch['finished_clock'] or time.monotonic()
+            elapsed = end_clock - batch['started_clock']
+
+            succeeded = len([a for a in accounts if a['status'] == 'success'])
+            failed = len([a for a in accounts if a['status'] == 'failed'])
+            running = len([a for a in accounts if a['status'] == 'running'])
+            completed = succeeded + failed
+
+            return {
+                'batch_id': batch_id,
+                'status': batch['status'],
+                'total': batch['total'],
+                'completed': completed,
+                'succeeded': succeeded,
+                'failed': failed,
+                'running': running,
+                'pending': batch['total'] - completed - running,
+                'concurrency': self.concurrency,
+                'started_at': batch['started_at'].strftime('%Y-%m-%d %H:%M:%S'),
+                'finished_at': batch['finished_at'].strftime('%Y-%m-%d %H:%M:%S') if batch['finished_at'] else None,
+                'wall_time_seconds': round(elapsed, 2),
+                'throughput_per_minute': round(completed / elapsed * 60, 2) if elapsed > 0 else 0,
+                'accounts': accounts
+            }
@@ -0,0 +1,128 @@
+import asyncio
+import itertools
+import threading
+import time
+from collections import deque
+from config import Config
+
+class CaptchaPrefetcher:
+    """验证码预取队列
+
+    在登录引擎的事件循环上后台预先获取 token 和验证码并完成识别，维护一个小的
+    (token, 验证码候选) 队列。登录尝试（尤其是验证码错误后的重试）可直接取用，
+    省去两次网络往返和一次OCR。队列中的条目超过 TTL 即丢弃；最近一段时间没有
+    取用时停止补充，避免空闲时持续请求上游。
+
+    每个条目在会话池中使用自己的会话获取，取用时该会话（连同获取验证码时得到的Cookie）
+    转给取用的账号，因此不同账号之间不会共用Cookie。
+    """
+
+    def __init__(self, engine, size=None, ttl=None, idle_timeout=None):
+        self.engine = engine
+        self.size = size if size is not None else Config.CAPTCHA_PREFETCH_SIZE
+        self.ttl = ttl or Config.CAPTCHA_PREFETCH_TTL
+        self.idle_timeout = idle_timeout or Config.CAPTCHA_PREFETCH_IDLE_TIMEOUT
+
+        self._pairs = deque()
+        self._session_keys = itertools.count(1)
+        self._refill_task = None
+        self._last_demand = 0.0
+
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.expired = 0
+        self.fetched = 0
+        self.failed = 0
+
+    @property
+    def enabled(self):
+        return self.size > 0
+
+    async def _evict_expired(self):
+        now = time.monotonic()
+        while self._pairs and now - self._pairs[0][2] > self.ttl:
+            _, _, _, session_key = self._pairs.popleft()
+            await self.engine.session_pool.discard(session_key)
+            with self._stats_lock:
+                self.expired += 1
+
+    async def acquire(self, session_key=None):
+        """取出一个未过期的 (token, 验证码候选列表)，队列为空时返回 None 并触发补充
+
+        获取该验证码所用的会话转给 session_key（取用的账号）使用，之后的登录请求与获取验证码时在同一会话中。
+        """
+        if not self.enabled:
+            return None
+
+        self._last_demand = time.monotonic()
+        await self._evict_expired()
+
+        pair = None
+        while self._pairs and pair is None:
+            token, candidates, _, fetch_key = self._pairs.popleft()
+            # 会话已被会话池淘汰时，验证码对应的Cookie随之丢失，跳过该条目
+            if await self.engine.session_pool.transfer(fetch_key, session_key):
+                pair = (token, candidates)
+
+        with self._stats_lock:
+            if pair:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self._refill())
+        return pair
+
+    async def _fetch_one(self):
+        """使用一个新的会话获取并识别一个验证码，失败返回 None"""
+        session_key = f"prefetch-{next(self._session_keys)}"
+        try:
+            token = await self.engine.get_token(session_key=session_key)
+            if token:
+                status, candidates = await self.engine.solve_captcha(token, session_key=session_key)
+                if status == 'ok':
+                    return token, candidates, time.monotonic(), session_key
+        except Exception:
+            await self.engine.session_pool.discard(session_key)
+            raise
+        await self.engine.session_pool.discard(session_key)
+        return None
+
+    async def _refill(self):
+        """在有取用需求期间保持队列充满"""
+        while time.monotonic() - self._last_demand < self.idle_timeout:
+            await self._evict_expired()
+            missing = self.size - len(self._pairs)
+            if missing <= 0:
+                await asyncio.sleep(min(1.0, self.ttl / 4))
+                continue
+
+            results = await asyncio.gather(*(self._fetch_one() for _ in range(missing)), return_exceptions=True)
+            pairs = [result for result in results if isinstance(result, tuple)]
+            self._pairs.extend(pairs)
+            with self._stats_lock:
+                self.fetched += len(pairs)
+                self.failed += len(results) - len(pairs)
+
+            if len(pairs) < missing:
+                # 上游获取失败时稍作等待，避免紧密重试
+                await asyncio.sleep(1.0)
+
+    def get_stats(self):
+        """获取预取队列统计信息"""
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                'enabled': self.enabled,
+                'size': self.size,
+                'ttl_seconds': self.ttl,
+                'queued': len(self._pairs),
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': round(self.hits / total, 4) if total else 0,
+                'expired': self.expired,
+                'fetched': self.fetched,
+                'failed': self.failed
+            }
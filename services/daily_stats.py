@@ -0,0 +1,166 @@
+from datetime import datetime, time
+from sqlalchemy import DateTime, case, func
+from models import db, DailyAccountStats, LoginAttempt, LoginLog
+
+# 由旧版逐步日志推断登录尝试和成功时使用的消息（日志压缩迁移后为对应的消息模板）
+LEGACY_ATTEMPT_PATTERN = '尝试第 % 次登录%'
+LEGACY_REUSED_MESSAGE = '检测到有效的登录会话，跳过验证码登录'
+LEGACY_SUCCESS_MESSAGES = ('登录成功!', LEGACY_REUSED_MESSAGE)
+ATTEMPT_TEMPLATE_IDS = (LoginLog.TEMPLATES['attempt_started'][0], LoginLog.TEMPLATES['session_reused'][0])
+SUCCESS_TEMPLATE_IDS = (LoginLog.TEMPLATES['login_succeeded'][0], LoginLog.TEMPLATES['session_reused'][0])
+
+
+def _empty_totals():
+    return {'attempts': 0, 'successes': 0, 'failures': 0, 'last_success_at': None,
+            'total_duration_ms': 0, 'timed_attempts': 0}
+
+
+def aggregate_attempts(records):
+    """按 (账号, 日期) 汇总一批登录尝试记录（LoginAttempt 列名到值的字典）"""
+    totals = {}
+    for record in records:
+        key = (record['account_id'], record['created_at'].date())
+        entry = totals.setdefault(key, _empty_totals())
+        entry['attempts'] += 1
+        if record['is_success']:
+            entry['successes'] += 1
+            if entry['last_success_at'] is None or record['created_at'] > entry['last_success_at']:
+                entry['last_success_at'] = record['created_at']
+        else:
+            entry['failures'] += 1
+        if record.get('duration_ms') is not None:
+            entry['total_duration_ms'] += record['duration_ms']
+            entry['timed_attempts'] += 1
+    return totals
+
+
+def apply_attempts(records):
+    """在当前事务中把一批登录尝试记录累加到每日统计（不提交）
+
+    每个 (账号, 日期) 先执行一次原子的累加 UPDATE，没有对应行时再 INSERT。
+    """
+    table = DailyAccountStats.__table__
+    columns = table.c
+    now = datetime.utcnow()
+    for (account_id, day), entry in aggregate_attempts(records).items():
+        values = {
+            'attempts': columns.attempts + entry['attempts'],
+            'successes': columns.successes + entry['successes'],
+            'failures': columns.failures + entry['failures'],
+            'total_duration_ms': columns.total_duration_ms + entry['total_duration_ms'],
+            'timed_attempts': columns.timed_attempts + entry['timed_attempts'],
+            'updated_at': now
+        }
+        if entry['last_success_at'] is not None:
+            values['last_success_at'] = entry['last_success_at']
+
+        result = db.session.execute(
+            table.update().where(columns.account_id == account_id, columns.day == day).values(**values)
+        )
+        if result.rowcount == 0:
+            db.session.execute(table.insert().values(account_id=account_id, day=day, updated_at=now, **entry))
+
+
+def _as_date(value):
+    """func.date 在 SQLite 中返回字符串，在 PostgreSQL 中返回 date"""
+    if isinstance(value, str):
+        return datetime.strptime(value, '%Y-%m-%d').date()
+    return value
+
+
+def _attempt_totals(start=None):
+    """从 LoginAttempt 表按 (账号, 日期) 汇总"""
+    day = func.date(LoginAttempt.created_at)
+    query = db.session.query(
+        LoginAttempt.account_id,
+        day,
+        func.count(LoginAttempt.id),
+        func.sum(case((LoginAttempt.is_success == True, 1), else_=0)),
+        func.max(case((LoginAttempt.is_success == True, LoginAttempt.created_at)), type_=DateTime),
+        func.coalesce(func.sum(LoginAttempt.duration_ms), 0),
+        func.count(LoginAttempt.duration_ms)
+    )
+    if start is not None:
+        query = query.filter(LoginAttempt.created_at >= start)
+
+    totals = {}
+    for account_id, row_day, attempts, successes, last_success_at, total_duration_ms, timed_attempts \
+            in query.group_by(LoginAttempt.account_id, day):
+        totals[(account_id, _as_date(row_day))] = {
+            'attempts': attempts,
+            'successes': successes or 0,
+            'failures': attempts - (successes or 0),
+            'last_success_at': last_success_at,
+            'total_duration_ms': total_duration_ms,
+            'timed_attempts': timed_attempts
+        }
+    return totals
+
+
+def _legacy_log_totals(start=None, end=None):
+    """从旧版逐步日志推断 (账号, 日期) 的尝试和成功次数（没有耗时信息）"""
+    day = func.date(LoginLog.created_at)
+    is_attempt = LoginLog.message.like(LEGACY_ATTEMPT_PATTERN) | (LoginLog.message == LEGACY_REUSED_MESSAGE) \
+        | LoginLog.template_id.in_(ATTEMPT_TEMPLATE_IDS)
+    is_success = (LoginLog.level == 'INFO') & (LoginLog.is_success == True) \
+        & (LoginLog.message.in_(LEGACY_SUCCESS_MESSAGES) | LoginLog.template_id.in_(SUCCESS_TEMPLATE_IDS))
+    query = db.session.query(
+        LoginLog.account_id,
+        day,
+        func.sum(case((is_attempt, 1), else_=0)),
+        func.sum(case((is_success, 1), else_=0)),
+        func.max(case((is_success, LoginLog.created_at)), type_=DateTime)
+    ).filter(is_attempt | is_success)
+    if start is not None:
+        query = query.filter(LoginLog.created_at >= start)
+    if end is not None:
+        query = query.filter(LoginLog.created_at < end)
+
+    totals = {}
+    for account_id, row_day, attempts, successes, last_success_at in query.group_by(LoginLog.account_id, day):
+        attempts = max(attempts or 0, successes or 0)
+        totals[(account_id, _as_date(row_day))] = {
+            'attempts': attempts,
+            'successes': successes or 0,
+            'failures': attempts - (successes or 0),
+            'last_success_at': last_success_at,
+            'total_duration_ms': 0,
+            'timed_attempts': 0
+        }
+    return totals
+
+
+def rebuild_daily_stats(since=None):
+    """重建 since（date，含）当天及之后的每日统计，返回写入的行数
+
+    有 LoginAttempt 记录的时间段以登录尝试记录为准；更早的时间段（升级前）根据逐步日志推断。
+    since 为 None 时重建全部统计。重建期间写入的新记录可能重复计数，应在登录任务空闲时执行。
+    """
+    start = datetime.combine(since, time.min) if since else None
+    first_attempt_at = db.session.query(func.min(LoginAttempt.created_at)).scalar()
+    totals = _legacy_log_totals(start, first_attempt_at)
+    for key, entry in _attempt_totals(start).items():
+        legacy = totals.get(key)
+        if legacy:
+            # 升级当天：升级前的日志推断与升级后的尝试记录相加
+            entry = dict(entry, attempts=entry['attempts'] + legacy['attempts'],
+                         successes=entry['successes'] + legacy['successes'],
+                         failures=entry['failures'] + legacy['failures'],
+                         last_success_at=entry['last_success_at'] or legacy['last_success_at'])
+        totals[key] = entry
+
+    query = DailyAccountStats.query
+    if since is not None:
+        query = query.filter(DailyAccountStats.day >= since)
+    try:
+        query.delete(synchronize_session=False)
+        now = datetime.utcnow()
+        rows = [dict(account_id=account_id, day=day, updated_at=now, **entry)
+                for (account_id, day), entry in totals.items()]
+        if rows:
+            db.session.execute(DailyAccountStats.__table__.insert(), rows)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
@@ -4,9 +4,15 @@ from email.header import Header
 from datetime import datetime
 import json
 import os
-from models import db, Account, LoginLog, EmailConfig
+from config import Config
+from models import db, Account, DailyAccountStats, EmailConfig, LoginAttempt
+from .log_writer import get_log_writer
+from .login_service import save_log
 
 class EmailService:
+    # 每日日志邮件中列出的最近登录尝试数
+    RECENT_ATTEMPTS_IN_EMAIL = 20
+    
     def __init__(self):
         self.default_config = {
             "smtp_server": "smtp.email.cn",
@@ -68,14 +74,14 @@ class EmailService:
             # 获取接收邮箱
             receiver_email = account.custom_email if account.custom_email else self.get_email_config()['default_receiver']
             
-            # 获取今天的登录日志
+            # 获取今天成功的登录尝试（先写完队列中尚未落库的记录，最多等待 LOG_WRITER_FLUSH_TIMEOUT 秒）
+            get_log_writer().flush(Config.LOG_WRITER_FLUSH_TIMEOUT)
             today = datetime.now().strftime('%Y-%m-%d')
-            today_logs = LoginLog.query.filter(
-                LoginLog.account_id == account_id,
-                LoginLog.created_at >= f"{today} 00:00:00",
-                LoginLog.created_at <= f"{today} 23:59:59",
-                LoginLog.is_success == True
-            ).order_by(LoginLog.created_at.desc()).all()
+            today_attempts = LoginAttempt.query.filter(
+                LoginAttempt.account_id == account_id,
+                LoginAttempt.created_on(today),
+                LoginAttempt.is_success == True
+            ).order_by(LoginAttempt.created_at.desc()).all()
             
             # 构建邮件内容
             subject = f"自动登录成功通知 - {account.name} - {today}"
@@ -89,8 +95,8 @@ class EmailService:
 今日登录详情:
 """
             
-            for log in today_logs:
-                content += f"[{log.created_at.strftime('%H:%M:%S')}] {log.message}\n"
+            for attempt in today_attempts:
+                content += f"[{attempt.created_at.strftime('%H:%M:%S')}] {attempt.describe()}\n"
             
             content += f"""
 ---
@@ -102,12 +108,7 @@ class EmailService:
             
             if success:
                 # 记录邮件发送日志
-                login_service = LoginService()
-                login_service.save_log(
-                    account_id, 
-                    "INFO", 
-                    f"登录成功邮件已发送到 {receiver_email}"
-                )
+                save_log(account_id, "INFO", 'success_email_sent', params={'email': receiver_email})
             
             return success, message
             
@@ -117,6 +118,7 @@ class EmailService:
     def send_daily_log_email(self, account_id=None):
         """发送每日日志邮件"""
         try:
+            get_log_writer().flush(Config.LOG_WRITER_FLUSH_TIMEOUT)
             today = datetime.now().strftime('%Y-%m-%d')
             
             if account_id:
@@ -131,20 +133,29 @@ class EmailService:
             config = self.get_email_config()
             sent_count = 0
             
+            # 今日统计一次查询取出，不再逐行读取日志计数
+            today_stats = {
+                stats.account_id: stats
+                for stats in DailyAccountStats.query.filter(
+                    DailyAccountStats.day == datetime.now().date(),
+                    DailyAccountStats.account_id.in_([account.id for account in accounts])
+                ).all()
+            }
+            
             for account in accounts:
                 if not account.email_notification:
                     continue
                 
-                # 获取今天的所有日志
-                today_logs = LoginLog.query.filter(
-                    LoginLog.account_id == account.id,
-                    LoginLog.created_at >= f"{today} 00:00:00",
-                    LoginLog.created_at <= f"{today} 23:59:59"
-                ).order_by(LoginLog.created_at.desc()).all()
-                
-                if not today_logs:
+                stats = today_stats.get(account.id)
+                if not stats or not stats.attempts:
                     continue
                 
+                # 只列出最近的若干次登录尝试
+                recent_attempts = LoginAttempt.query.filter(
+                    LoginAttempt.account_id == account.id,
+                    LoginAttempt.created_on(today)
+                ).order_by(LoginAttempt.created_at.desc()).limit(self.RECENT_ATTEMPTS_IN_EMAIL).all()
+                
                 # 获取接收邮箱
                 receiver_email = account.custom_email if account.custom_email else config['default_receiver']
                 
@@ -156,22 +167,24 @@ class EmailService:
 邮箱: {account.email}
 日期: {today}
 
-今日登录日志:
+最近 {len(recent_attempts)} 次登录尝试:
 """
                 
-                for log in today_logs:
-                    level_icon = "✅" if log.is_success else "❌"
-                    content += f"{level_icon} [{log.created_at.strftime('%H:%M:%S')}] [{log.level}] {log.message}\n"
+                for attempt in recent_attempts:
+                    level_icon = "✅" if attempt.is_success else "❌"
+                    content += f"{level_icon} [{attempt.created_at.strftime('%H:%M:%S')}] {attempt.describe()}\n"
                 
                 # 统计信息
-                total_logs = len(today_logs)
-                success_logs = len([log for log in today_logs if log.is_success])
+                last_success = stats.last_success_at.strftime('%H:%M:%S') if stats.last_success_at else '无'
+                average_latency = f"{stats.average_latency_ms} ms" if stats.average_latency_ms is not None else '无'
                 content += f"""
 ---
 统计信息:
-总日志数: {total_logs}
-成功次数: {success_logs}
-失败次数: {total_logs - success_logs}
+总尝试次数: {stats.attempts}
+成功次数: {stats.successes}
+失败次数: {stats.failures}
+最近成功时间: {last_success}
+平均耗时: {average_latency}
 
 此邮件由自动登录系统发送
 """
@@ -182,12 +195,7 @@ class EmailService:
                     sent_count += 1
                     
                     # 记录邮件发送日志
-                    login_service = LoginService()
-                    login_service.save_log(
-                        account.id, 
-                        "INFO", 
-                        f"每日日志邮件已发送到 {receiver_email}"
-                    )
+                    save_log(account.id, "INFO", 'daily_email_sent', params={'email': receiver_email})
             
             return True, f"已发送 {sent_count} 封日志邮件"
             
@@ -0,0 +1,108 @@
+import threading
+from collections import OrderedDict
+
+import aiohttp
+from config import Config
+
+class HttpSessionPool:
+    """按账号划分的HTTP会话池
+
+    每个账号使用独立的 ClientSession（独立的Cookie），所有会话共享同一个
+    TCPConnector，从而跨账号、跨调用线程复用到 CMS 接口的 TLS 长连接。
+    会话池只能在登录引擎的事件循环线程中使用，统计信息可在任意线程读取。
+    """
+
+    def __init__(self, max_sessions=None, pool_size=None, pool_size_per_host=None,
+                 keepalive_timeout=None, request_timeout=None):
+        self.max_sessions = max_sessions or Config.HTTP_POOL_MAX_SESSIONS
+        self.pool_size = pool_size or Config.HTTP_POOL_CONNECTIONS
+        self.pool_size_per_host = pool_size_per_host or Config.HTTP_POOL_CONNECTIONS_PER_HOST
+        self.keepalive_timeout = keepalive_timeout or Config.HTTP_KEEPALIVE_TIMEOUT
+        self.request_timeout = request_timeout or Config.CMS_REQUEST_TIMEOUT
+
+        self._connector = None
+        self._sessions = OrderedDict()
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def _get_connector(self):
+        if self._connector is None or self._connector.closed:
+            self._connector = aiohttp.TCPConnector(
+                limit=self.pool_size,
+                limit_per_host=self.pool_size_per_host,
+                keepalive_timeout=self.keepalive_timeout,
+                ttl_dns_cache=300
+            )
+        return self._connector
+
+    async def get(self, key=None):
+        """获取指定账号的会话，key 为 None 时使用匿名共享会话"""
+        session = self._sessions.get(key)
+        if session is not None and not session.closed:
+            self._sessions.move_to_end(key)
+            with self._stats_lock:
+                self.hits += 1
+            return session
+
+        session = aiohttp.ClientSession(
+            connector=self._get_connector(),
+            connector_owner=False,
+            cookie_jar=aiohttp.CookieJar(),
+            timeout=aiohttp.ClientTimeout(total=self.request_timeout)
+        )
+        self._sessions[key] = session
+        with self._stats_lock:
+            self.misses += 1
+
+        # 超出上限时关闭最久未使用的会话（不会关闭共享连接）
+        while len(self._sessions) > self.max_sessions:
+            _, stale = self._sessions.popitem(last=False)
+            await stale.close()
+            with self._stats_lock:
+                self.evictions += 1
+
+        return session
+
+    async def transfer(self, source_key, key):
+        """把 source_key 的会话（连同其Cookie）改归 key 使用，替换 key 原有的会话；source_key 的会话已被淘汰时返回 False"""
+        session = self._sessions.pop(source_key, None)
+        if session is None or session.closed:
+            return False
+        previous = self._sessions.pop(key, None)
+        if previous is not None:
+            await previous.close()
+        self._sessions[key] = session
+        return True
+
+    async def discard(self, key):
+        """丢弃指定账号的会话（例如需要清空Cookie时）"""
+        session = self._sessions.pop(key, None)
+        if session is not None:
+            await session.close()
+
+    async def close(self):
+        """关闭所有会话及共享连接"""
+        while self._sessions:
+            _, session = self._sessions.popitem()
+            await session.close()
+        if self._connector is not None:
+            await self._connector.close()
+            self._connector = None
+
+    def get_stats(self):
+        """获取会话池统计信息"""
+        with self._stats_lock:
+            total = self.hits + self.misses
+            return {
+                'sessions': len(self._sessions),
+                'max_sessions': self.max_sessions,
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'hit_rate': round(self.hits / total, 4) if total else 0,
+                'pool_size': self.pool_size,
+                'pool_size_per_host': self.pool_size_per_host,
+                'keepalive_timeout': self.keepalive_timeout
+            }
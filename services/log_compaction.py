@@ -0,0 +1,145 @@
+import json
+import re
+import string
+import time
+from sqlalchemy import bindparam
+from config import Config
+from models import db, details_text, encode_details, LoginLog
+
+# 升级前“登录结果”日志把完整的接口返回写在消息里，迁移时移到 details
+LEGACY_LOGIN_RESULT_PREFIX = '登录结果: '
+INTEGER_PATTERN = re.compile(r'-?\d+')
+FLOAT_PATTERN = re.compile(r'-?\d+\.\d+')
+
+
+def _template_pattern(template):
+    """把模板文本转换为匹配渲染结果的正则表达式，每个参数对应一个命名分组"""
+    pattern = ''
+    for literal, field, _, _ in string.Formatter().parse(template):
+        pattern += re.escape(literal)
+        if field is not None:
+            pattern += f'(?P<{field}>.*?)'
+    return re.compile(pattern + '$', re.DOTALL)
+
+
+# 固定文字越长的模板越先匹配，避免被更宽泛的模板抢先匹配
+TEMPLATE_PATTERNS = sorted(
+    ((template_id, text, _template_pattern(text)) for template_id, text in LoginLog.TEMPLATE_TEXTS.items()),
+    key=lambda item: -len(item[2].pattern)
+)
+
+
+def _coerce(value):
+    """把从消息中截取的参数还原为数字（用于 {confidence:.2f} 等格式）"""
+    if INTEGER_PATTERN.fullmatch(value) and str(int(value)) == value:
+        return int(value)
+    if FLOAT_PATTERN.fullmatch(value):
+        return float(value)
+    return value
+
+
+def _encode_params(params):
+    return json.dumps(params, ensure_ascii=False, separators=(',', ':')) if params else None
+
+
+def match_template(message):
+    """把升级前的日志消息转换为 (模板编号, 参数JSON)，只有渲染结果与原消息完全一致时才转换，否则返回 None"""
+    for template_id, _, pattern in TEMPLATE_PATTERNS:
+        matched = pattern.match(message)
+        if not matched:
+            continue
+        raw = matched.groupdict()
+        for params in ({key: _coerce(value) for key, value in raw.items()}, raw):
+            encoded = _encode_params(params)
+            if LoginLog.render_message(template_id, encoded, '') == message:
+                return template_id, encoded
+    return None
+
+
+def _compact_details(text):
+    """重新序列化为紧凑 JSON（无法解析时保留原文）"""
+    try:
+        return json.dumps(json.loads(text), ensure_ascii=False, separators=(',', ':'))
+    except ValueError:
+        return text
+
+
+def convert_row(message, details):
+    """把一行升级前的日志转换为新的列值"""
+    stored_details, compressed_details = encode_details(_compact_details(details) if details else None)
+    values = {'template_id': None, 'params': None, 'message': message, 'details': stored_details,
+              'compressed_details': compressed_details}
+
+    if message.startswith(LEGACY_LOGIN_RESULT_PREFIX) and not details:
+        try:
+            result = json.loads(message[len(LEGACY_LOGIN_RESULT_PREFIX):])
+        except ValueError:
+            result = None
+        if isinstance(result, dict):
+            stored_details, compressed_details = encode_details(_encode_params(result))
+            values.update(template_id=LoginLog.TEMPLATES['login_result'][0], message='',
+                          params=_encode_params({'code': result.get('iErrCode')}),
+                          details=stored_details, compressed_details=compressed_details)
+            return values
+
+    matched = match_template(message)
+    if matched:
+        values.update(template_id=matched[0], params=matched[1], message='')
+    return values
+
+
+def compact_logs(search_index=None, chunk_size=None, pause_seconds=None):
+    """把升级前的日志行转换为模板编号 + 参数，并压缩 details，返回 (检查的行数, 转换为模板的行数)
+
+    按 id 分批处理，每批单独提交；同一事务中先用旧文本删除全文索引条目，更新后再用新文本写入。
+    可以重复执行，已转换的行会被跳过。
+    """
+    chunk_size = chunk_size or Config.LOG_PURGE_CHUNK_SIZE
+    pause_seconds = Config.LOG_PURGE_PAUSE_SECONDS if pause_seconds is None else pause_seconds
+    table = LoginLog.__table__
+    # executemany 时参数中与列同名的键组成 SET 子句
+    statement = table.update().where(table.c.id == bindparam('log_id'))
+
+    scanned = converted = 0
+    last_id = 0
+    while True:
+        rows = db.session.query(LoginLog.id, LoginLog.message, LoginLog.details).filter(
+            LoginLog.id > last_id, LoginLog.template_id.is_(None), LoginLog.compressed_details.is_(None)
+        ).order_by(LoginLog.id).limit(chunk_size).all()
+        if not rows:
+            break
+        last_id = rows[-1].id
+        scanned += len(rows)
+
+        updates = []
+        for row in rows:
+            values = convert_row(row.message, row.details)
+            if values['template_id'] is None and values['details'] == row.details:
+                continue
+            if values['template_id'] is not None:
+                converted += 1
+            updates.append(dict(values, log_id=row.id))
+
+        if updates:
+            try:
+                if search_index is not None:
+                    search_index.unindex([values['log_id'] for values in updates])
+                db.session.execute(statement, updates)
+                if search_index is not None:
+                    search_index.index_rows(
+                        (values['log_id'],
+                         LoginLog.render_message(values['template_id'], values['params'], values['message']),
+                         details_text(values['compressed_details'], values['details']))
+                        for values in updates
+                    )
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        if len(rows) < chunk_size:
+            break
+        time.sleep(pause_seconds)
+
+    if search_index is not None:
+        search_index.optimize()
+    return scanned, converted
@@ -0,0 +1,98 @@
+import csv
+import io
+import json
+from sqlalchemy import func, select, tuple_
+from models import db, details_text, Account, LoginLog
+
+EXPORT_FORMATS = {
+    'ndjson': 'application/x-ndjson; charset=utf-8',
+    'csv': 'text/csv; charset=utf-8'
+}
+CSV_COLUMNS = ['id', 'account_id', 'account_name', 'level', 'message', 'is_success', 'created_at', 'details']
+
+
+def export_statement(account_id=None, start=None, end=None, level=None):
+    """导出查询：只选取需要的列并关联账号名称，按 (created_at, id) 正序输出"""
+    stmt = (
+        select(LoginLog.id, LoginLog.account_id, Account.name.label('account_name'), LoginLog.level,
+               LoginLog.template_id, LoginLog.params, LoginLog.message, LoginLog.is_success, LoginLog.created_at,
+               LoginLog.details, LoginLog.compressed_details)
+        .outerjoin(Account, Account.id == LoginLog.account_id)
+    )
+    if account_id:
+        stmt = stmt.where(LoginLog.account_id == account_id)
+    if start is not None:
+        stmt = stmt.where(LoginLog.created_at >= start)
+    if end is not None:
+        stmt = stmt.where(LoginLog.created_at < end)
+    if level:
+        stmt = stmt.where(LoginLog.level == level.upper())
+    return stmt.order_by(LoginLog.created_at, LoginLog.id)
+
+
+def _iter_batches(stmt, batch_size):
+    """按 (created_at, id) 游标分页读取，每页是一次独立的短查询
+
+    每读完一页就关闭会话结束读事务再输出。不能在整个下载期间保持一个流式游标：
+    SQLite 上打开的读事务会让日志写入器和清理任务的提交一直等到锁超时，而下载速度取决于客户端。
+    只导出开始时已存在的日志，导出期间新写入的日志不会让导出无限延长。
+    """
+    max_id = db.session.query(func.max(LoginLog.id)).scalar() or 0
+    stmt = stmt.where(LoginLog.id <= max_id)
+    last = None
+    while True:
+        page = stmt if last is None else stmt.where(tuple_(LoginLog.created_at, LoginLog.id) > last)
+        try:
+            batch = db.session.execute(page.limit(batch_size)).all()
+        finally:
+            db.session.close()
+        if not batch:
+            return
+        yield batch
+        if len(batch) < batch_size:
+            return
+        last = (batch[-1].created_at, batch[-1].id)
+
+
+def _row_dict(row, include_details):
+    data = {
+        'id': row.id,
+        'account_id': row.account_id,
+        'account_name': row.account_name or '未知账号',
+        'level': row.level,
+        'message': LoginLog.render_message(row.template_id, row.params, row.message),
+        'is_success': bool(row.is_success),
+        'created_at': row.created_at.strftime('%Y-%m-%d %H:%M:%S')
+    }
+    if include_details:
+        text = details_text(row.compressed_details, row.details)
+        data['details'] = json.loads(text) if text else None
+    return data
+
+
+def iter_ndjson(stmt, include_details=False, batch_size=1000):
+    """逐批生成 NDJSON 文本块（每行一条日志）"""
+    for batch in _iter_batches(stmt, batch_size):
+        yield ''.join(json.dumps(_row_dict(row, include_details), ensure_ascii=False) + '\n' for row in batch)
+
+
+def iter_csv(stmt, include_details=False, batch_size=1000):
+    """逐批生成 CSV 文本块（首块包含表头和 UTF-8 BOM，便于 Excel 直接打开）"""
+    columns = CSV_COLUMNS if include_details else CSV_COLUMNS[:-1]
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+
+    buffer.write('\ufeff')
+    writer.writerow(columns)
+    for batch in _iter_batches(stmt, batch_size):
+        for row in batch:
+            data = _row_dict(row, False)
+            if include_details:
+                data['details'] = details_text(row.compressed_details, row.details) or ''
+            writer.writerow([data[column] for column in columns])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate()
+
+    if buffer.tell():
+        yield buffer.getvalue()
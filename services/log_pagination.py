@@ -0,0 +1,77 @@
+import base64
+import threading
+import time
+from datetime import datetime
+from sqlalchemy import tuple_
+from sqlalchemy.orm import joinedload, load_only
+from config import Config
+from models import Account, LoginLog
+
+class InvalidCursor(ValueError):
+    """游标格式错误"""
+
+
+def encode_cursor(log):
+    """根据一页中最后一条日志生成不透明的游标"""
+    raw = f"{log.created_at.isoformat()}|{log.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor):
+    """解析游标，返回 (created_at, id)"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, log_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(log_id)
+    except Exception:
+        raise InvalidCursor("无效的分页游标")
+
+
+def log_list_query():
+    """日志列表查询：在同一条 SQL 中关联加载账号名称，序列化时不再逐行查询账号"""
+    return LoginLog.query.options(joinedload(LoginLog.account).options(load_only(Account.id, Account.name)))
+
+
+def paginate_logs(query, per_page, cursor=None):
+    """按 (created_at, id) 倒序做游标分页，返回 (本页日志, 下一页游标或None)
+
+    每一页都是一次索引范围扫描，不执行 COUNT 和 OFFSET，翻到多深都保持相同耗时。
+    """
+    if cursor:
+        created_at, log_id = decode_cursor(cursor)
+        query = query.filter(tuple_(LoginLog.created_at, LoginLog.id) < tuple_(created_at, log_id))
+
+    logs = query.order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(per_page + 1).all()
+    if len(logs) > per_page:
+        logs = logs[:per_page]
+        return logs, encode_cursor(logs[-1])
+    return logs, None
+
+
+class CountCache:
+    """日志总数缓存：相同筛选条件的 COUNT 结果在 ttl 秒内复用"""
+
+    def __init__(self, ttl=None, max_entries=256):
+        self.ttl = ttl if ttl is not None else Config.LOG_COUNT_CACHE_SECONDS
+        self.max_entries = max_entries
+        self._entries = {}
+        self._lock = threading.Lock()
+
+    def get(self, key, query):
+        """返回 (总数, 是否来自缓存)"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry and now - entry[1] < self.ttl:
+                return entry[0], True
+
+        total = query.order_by(None).count()
+        with self._lock:
+            if len(self._entries) >= self.max_entries:
+                self._entries.clear()
+            self._entries[key] = (total, now)
+        return total, False
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
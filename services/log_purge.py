@@ -0,0 +1,235 @@
+import logging
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+from apscheduler.triggers.cron import CronTrigger
+from sqlalchemy import and_, func, or_
+from config import Config
+from models import db, LoginAttempt, LoginLog
+from .metrics import SCHEDULER_JOBS_IN_FLIGHT
+
+# 保留策略同时作用于逐步日志和登录尝试记录；每日统计表作为长期汇总保留
+RETENTION_MODELS = (LoginLog, LoginAttempt)
+
+
+class LogPurgeService:
+    """日志清理服务：在后台线程中分批删除日志并记录进度
+
+    每批最多删除 chunk_size 行并单独提交，批次之间暂停 pause_seconds 秒让出数据库写锁，
+    避免一次性大删除长时间锁住 SQLite 或拖垮请求线程。所有清理任务在同一个工作线程中排队执行。
+    """
+
+    def __init__(self, scheduler_service, on_purged=None, search_index=None, chunk_size=None, pause_seconds=None,
+                 max_jobs=20):
+        self.scheduler_service = scheduler_service
+        self.on_purged = on_purged
+        self.search_index = search_index
+        self.chunk_size = chunk_size or Config.LOG_PURGE_CHUNK_SIZE
+        self.pause_seconds = Config.LOG_PURGE_PAUSE_SECONDS if pause_seconds is None else pause_seconds
+        self.retention_days = Config.LOG_RETENTION_DAYS
+        self.max_rows_per_account = Config.LOG_RETENTION_MAX_ROWS_PER_ACCOUNT
+        self.max_jobs = max_jobs
+        self.executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix='log-purge')
+        self.jobs = OrderedDict()
+        self.lock = threading.Lock()
+        self.logger = logging.getLogger("LogPurgeService")
+        self.add_retention_job()
+
+    def retention_enabled(self):
+        return self.retention_days > 0 or self.max_rows_per_account > 0
+
+    def add_retention_job(self):
+        """添加每日保留策略清理任务（未配置保留策略时不添加）"""
+        if not self.retention_enabled():
+            return False, "未配置日志保留策略"
+        try:
+            self.scheduler_service.scheduler.add_job(
+                func=self.start_retention,
+                trigger=CronTrigger(hour=Config.LOG_RETENTION_HOUR, minute=30),
+                id='log_retention',
+                name='日志保留策略清理',
+                replace_existing=True,
+                max_instances=1
+            )
+            return True, "日志保留策略清理任务已添加"
+        except Exception as e:
+            return False, f"添加日志保留策略清理任务失败: {str(e)}"
+
+    def _create_job(self, kind, filters):
+        job_id = uuid.uuid4().hex[:12]
+        job = {
+            'job_id': job_id,
+            'kind': kind,
+            'status': 'pending',
+            'filters': filters,
+            'total': None,
+            'deleted': 0,
+            'chunks': 0,
+            'started_at': None,
+            'finished_at': None,
+            'message': None
+        }
+        with self.lock:
+            self.jobs[job_id] = job
+            # 只保留最近的任务记录
+            while len(self.jobs) > self.max_jobs:
+                self.jobs.popitem(last=False)
+        return job
+
+    def start_clear(self, account_id=None, date=None):
+        """启动手动清空日志任务，立即返回 (任务ID, 消息)"""
+        job = self._create_job('clear', {'account_id': account_id, 'date': date})
+        self.executor.submit(self._run, job, self._clear_steps(account_id, date))
+        return job['job_id'], "已开始在后台清空日志"
+
+    def start_retention(self):
+        """启动保留策略清理任务；已有保留策略任务在排队或执行时直接返回该任务"""
+        if not self.retention_enabled():
+            return None, "未配置日志保留策略"
+        with self.lock:
+            for job in self.jobs.values():
+                if job['kind'] == 'retention' and job['status'] in ('pending', 'running'):
+                    return job['job_id'], "保留策略清理任务已在执行"
+        job = self._create_job('retention', {
+            'retention_days': self.retention_days,
+            'max_rows_per_account': self.max_rows_per_account
+        })
+        self.executor.submit(self._run, job, self._retention_steps)
+        return job['job_id'], "已开始执行日志保留策略清理"
+
+    def _clear_steps(self, account_id, date):
+        def steps():
+            # 只删除任务开始时已存在的日志，清空期间新写入的日志不受影响
+            max_id = db.session.query(func.max(LoginLog.id)).scalar() or 0
+            conditions = [LoginLog.id <= max_id]
+            if account_id:
+                conditions.append(LoginLog.account_id == account_id)
+            if date:
+                conditions.append(LoginLog.created_on(date))
+            return [(LoginLog, conditions)]
+        return steps
+
+    def _retention_steps(self):
+        """按保留策略生成 (模型, 删除条件) 列表"""
+        steps = []
+        for model in RETENTION_MODELS:
+            if self.retention_days > 0:
+                cutoff = datetime.utcnow() - timedelta(days=self.retention_days)
+                steps.append((model, [model.created_at < cutoff]))
+            if self.max_rows_per_account > 0:
+                steps.extend((model, conditions) for conditions in self._over_limit_conditions(model))
+        return steps
+
+    def _over_limit_conditions(self, model):
+        """每个超出行数上限的账号：比第 N 新的记录更旧的记录"""
+        account_ids = [row[0] for row in db.session.query(model.account_id).distinct()]
+        for account_id in account_ids:
+            boundary = db.session.query(model.created_at, model.id) \
+                .filter(model.account_id == account_id) \
+                .order_by(model.created_at.desc(), model.id.desc()) \
+                .offset(self.max_rows_per_account).first()
+            if boundary is None:
+                continue
+            yield [
+                model.account_id == account_id,
+                or_(model.created_at < boundary.created_at,
+                    and_(model.created_at == boundary.created_at, model.id <= boundary.id))
+            ]
+
+    def _run(self, job, build_steps):
+        """在工作线程中执行清理任务"""
+        with self.lock:
+            job['status'] = 'running'
+            job['started_at'] = datetime.now()
+
+        app = self.scheduler_service.app
+        with SCHEDULER_JOBS_IN_FLIGHT.track_inprogress(job=f'log_{job["kind"]}'), app.app_context():
+            # 异常不能传出应用上下文：teardown_appcontext 收到异常时会关闭调度器
+            try:
+                steps = build_steps()
+                total = self._count(steps)
+                with self.lock:
+                    job['total'] = total
+                for model, conditions in steps:
+                    self._delete_in_chunks(job, model, conditions)
+                status, message = 'completed', f"已删除 {job['deleted']} 条记录"
+            except Exception as e:
+                db.session.rollback()
+                self.logger.error(f"清理日志失败: {str(e)}")
+                status, message = 'failed', f"清理日志失败（已删除 {job['deleted']} 条）: {str(e)}"
+
+        if job['deleted'] and self.on_purged:
+            self.on_purged()
+        with self.lock:
+            job['status'] = status
+            job['message'] = message
+            job['finished_at'] = datetime.now()
+
+    @staticmethod
+    def _count(steps):
+        """统计待删除的行数；同一模型的多个删除条件可能重叠，按条件的并集计数"""
+        by_model = OrderedDict()
+        for model, conditions in steps:
+            by_model.setdefault(model, []).append(and_(*conditions))
+        return sum(db.session.query(model.id).filter(or_(*clauses)).count() for model, clauses in by_model.items())
+
+    def _delete_in_chunks(self, job, model, conditions):
+        """每次删除最多 chunk_size 行并提交，两批之间暂停以便登录任务的写入插队"""
+        while True:
+            ids = [row[0] for row in db.session.query(model.id).filter(*conditions).limit(self.chunk_size)]
+            if not ids:
+                return
+            if self.search_index is not None:
+                # 全文索引条目与记录在同一事务中删除
+                if model is LoginLog:
+                    self.search_index.unindex(ids)
+                else:
+                    self.search_index.unindex_attempts(ids)
+            db.session.query(model).filter(model.id.in_(ids)).delete(synchronize_session=False)
+            db.session.commit()
+            with self.lock:
+                job['deleted'] += len(ids)
+                job['chunks'] += 1
+            if len(ids) < self.chunk_size:
+                return
+            time.sleep(self.pause_seconds)
+
+    def _job_status(self, job):
+        total = job['total']
+        return {
+            'job_id': job['job_id'],
+            'kind': job['kind'],
+            'status': job['status'],
+            'filters': job['filters'],
+            'total': total,
+            'deleted': job['deleted'],
+            'chunks': job['chunks'],
+            'progress': round(min(job['deleted'] / total, 1) * 100, 1) if total else (100.0 if job['status'] == 'completed' else 0.0),
+            'started_at': job['started_at'].strftime('%Y-%m-%d %H:%M:%S') if job['started_at'] else None,
+            'finished_at': job['finished_at'].strftime('%Y-%m-%d %H:%M:%S') if job['finished_at'] else None,
+            'message': job['message']
+        }
+
+    def get_job_status(self, job_id):
+        """获取清理任务进度"""
+        with self.lock:
+            job = self.jobs.get(job_id)
+            return self._job_status(job) if job else None
+
+    def get_retention_status(self):
+        """获取保留策略配置、下次执行时间和最近的清理任务"""
+        job = self.scheduler_service.scheduler.get_job('log_retention')
+        with self.lock:
+            recent = [self._job_status(item) for item in reversed(self.jobs.values())]
+        return {
+            'enabled': self.retention_enabled(),
+            'retention_days': self.retention_days,
+            'max_rows_per_account': self.max_rows_per_account,
+            'chunk_size': self.chunk_size,
+            'pause_seconds': self.pause_seconds,
+            'next_run_time': job.next_run_time.strftime('%Y-%m-%d %H:%M:%S') if job and job.next_run_time else None,
+            'jobs': recent
+        }
@@ -0,0 +1,359 @@
+import logging
+import sqlite3
+import threading
+import time
+from sqlalchemy import bindparam, column, func, literal_column, or_, table, text
+from sqlalchemy.exc import OperationalError
+from models import db, details_text, LoginAttempt, LoginLog
+from .log_pagination import log_list_query
+
+FTS_TABLE = 'login_log_fts'
+# 登录接口返回的错误信息（sErrMsg）保存在 LoginAttempt.error_message 中，单独建立索引
+ATTEMPT_FTS_TABLE = 'login_attempt_fts'
+# trigram 分词器按 3 个字符切分，中英文子串都能命中索引；短于 3 个字符的词无法使用索引
+TRIGRAM_MIN_LENGTH = 3
+REBUILD_BATCH_SIZE = 5000
+REBUILD_RETRY_SECONDS = 1
+REBUILD_MAX_RETRIES = 30
+
+# 日志行只保存模板编号和压缩后的 details，触发器无法得到文本，因此 FTS5 使用无内容表（content=''），
+# 由日志写入器插入、清理任务删除时同步维护。升级前由触发器维护的外部内容表在启动时删除并重建
+LEGACY_SQLITE_TRIGGERS = ('login_log_fts_ai', 'login_log_fts_ad', 'login_log_fts_au')
+
+# PostgreSQL：tsvector 列由日志写入器赋值（不再是根据 message/details 计算的生成列），GIN 索引支持 @@ 查询
+POSTGRES_DDL = (
+    "ALTER TABLE login_log ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "ALTER TABLE login_log ALTER COLUMN search_vector DROP EXPRESSION IF EXISTS",
+    "CREATE INDEX IF NOT EXISTS ix_login_log_search_vector ON login_log USING GIN (search_vector)",
+    "ALTER TABLE login_attempt ADD COLUMN IF NOT EXISTS search_vector tsvector",
+    "CREATE INDEX IF NOT EXISTS ix_login_attempt_search_vector ON login_attempt USING GIN (search_vector)",
+)
+
+
+def index_text(log):
+    """日志行在全文索引中的文本：(渲染后的消息, details 的 JSON 文本)"""
+    return (LoginLog.render_message(log.template_id, log.params, log.message),
+            details_text(log.compressed_details, log.details))
+
+
+def _document(message, details):
+    # 消息和 details 合并为一列建立索引，比分两列索引占用的空间更小
+    return f"{message}\n{details}" if details else message
+
+
+class LogSearch:
+    """登录日志全文检索
+
+    SQLite 使用 FTS5（trigram 分词）无内容表，PostgreSQL 使用 tsvector 列和 GIN 索引。日志和登录尝试的
+    错误信息各有一个索引，都由日志写入器在插入的同一事务中维护，清理任务删除记录前同步删除索引条目。
+    启动时只创建索引结构，已有记录在后台线程中补建索引，完成之前搜索使用 LIKE 查询；
+    其他数据库或 FTS5 不可用时始终使用 LIKE 查询。
+    """
+
+    def __init__(self):
+        self.mode = None
+        self.ready = False
+        self.backfilled = 0
+        self._backfill_thread = None
+        self.logger = logging.getLogger("LogSearch")
+
+    @property
+    def maintained(self):
+        """是否需要在写入、删除日志时维护索引"""
+        return self.mode in ('fts5', 'tsvector')
+
+    @property
+    def search_mode(self):
+        """搜索实际使用的方式：已有记录补建索引完成之前为 like"""
+        return self.mode if self.ready else 'like'
+
+    def ensure_index(self):
+        """创建全文索引结构（已存在时跳过），需要在应用上下文中调用；已有记录由 start_backfill 补建索引"""
+        dialect = db.engine.dialect.name
+        try:
+            if dialect == 'sqlite':
+                self._ensure_sqlite_index()
+                self.mode = 'fts5'
+            elif dialect == 'postgresql':
+                for statement in POSTGRES_DDL:
+                    db.session.execute(text(statement))
+                db.session.commit()
+                self.mode = 'tsvector'
+            else:
+                self.mode = 'like'
+        except Exception as e:
+            db.session.rollback()
+            self.mode = 'like'
+            self.logger.warning(f"创建日志全文索引失败，搜索将使用 LIKE 查询: {str(e)}")
+        self.ready = not self.maintained
+        return self.mode
+
+    def _ensure_sqlite_index(self):
+        definition = db.session.execute(
+            text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = :name"), {'name': FTS_TABLE}
+        ).scalar()
+        if definition and "content=''" not in definition:
+            # 升级前由触发器维护的外部内容表
+            for trigger in LEGACY_SQLITE_TRIGGERS:
+                db.session.execute(text(f"DROP TRIGGER IF EXISTS {trigger}"))
+            db.session.execute(text(f"DROP TABLE {FTS_TABLE}"))
+        tokenizer = 'trigram' if sqlite3.sqlite_version_info >= (3, 34, 0) else 'unicode61'
+        for name in (FTS_TABLE, ATTEMPT_FTS_TABLE):
+            db.session.execute(text(
+                f"CREATE VIRTUAL TABLE IF NOT EXISTS {name} USING fts5(body, content='', tokenize='{tokenizer}')"
+            ))
+        db.session.commit()
+
+    def start_backfill(self, app):
+        """在后台线程中为尚未建立索引的已有记录补建索引，完成后搜索改用索引
+
+        大表上补建索引需要较长时间，放在启动流程中会超过 gunicorn 的启动超时。
+        """
+        if not self.maintained or self._backfill_thread is not None:
+            return
+        self._backfill_thread = threading.Thread(
+            target=self._run_backfill, args=(app,), name='log-search-backfill', daemon=True
+        )
+        self._backfill_thread.start()
+
+    def _run_backfill(self, app):
+        with app.app_context():
+            # 异常不能传出应用上下文：teardown_appcontext 收到异常时会关闭调度器
+            try:
+                started = time.perf_counter()
+                count = self.backfill()
+                self.ready = True
+                self.logger.info(f"日志全文索引已就绪，补建 {count} 条，耗时 {time.perf_counter() - started:.1f} 秒")
+            except Exception as e:
+                db.session.rollback()
+                self.logger.error(f"补建日志全文索引失败，搜索将继续使用 LIKE 查询: {str(e)}")
+
+    def backfill(self):
+        """分批为尚未建立索引的日志和登录尝试记录建立索引，返回补建的行数
+
+        每批在同一事务中先找出没有索引条目的记录再写入，与日志写入器或其他进程同时执行也不会重复索引；
+        数据库被锁时稍后重试该批。
+        """
+        count = self._backfill_table(LoginLog, self._index_log_ids) \
+            + self._backfill_table(LoginAttempt, self._index_attempt_ids)
+        if count:
+            self.optimize()
+        return count
+
+    def _backfill_table(self, model, index_ids):
+        count = 0
+        last_id = 0
+        retries = 0
+        while True:
+            ids = [row[0] for row in db.session.query(model.id).filter(model.id > last_id)
+                   .order_by(model.id).limit(REBUILD_BATCH_SIZE)]
+            if not ids:
+                return count
+            try:
+                missing = self._missing_ids(model, ids)
+                if missing:
+                    index_ids(missing)
+                db.session.commit()
+            except OperationalError:
+                db.session.rollback()
+                retries += 1
+                if retries > REBUILD_MAX_RETRIES:
+                    raise
+                time.sleep(REBUILD_RETRY_SECONDS)
+                continue
+            retries = 0
+            count += len(missing)
+            self.backfilled += len(missing)
+            last_id = ids[-1]
+
+    def _missing_ids(self, model, ids):
+        """ids 中尚未建立索引的记录"""
+        if self.mode == 'fts5':
+            indexed = set(self._indexed_ids(ATTEMPT_FTS_TABLE if model is LoginAttempt else FTS_TABLE, ids))
+            return [record_id for record_id in ids if record_id not in indexed]
+        search_vector = literal_column(f'{model.__tablename__}.search_vector')
+        return [row[0] for row in db.session.query(model.id).filter(model.id.in_(ids), search_vector.is_(None))]
+
+    @staticmethod
+    def _indexed_ids(fts_table, ids):
+        return [row[0] for row in db.session.execute(
+            text(f"SELECT rowid FROM {fts_table} WHERE rowid IN :ids").bindparams(bindparam('ids', expanding=True)),
+            {'ids': list(ids)}
+        )]
+
+    def _index_log_ids(self, ids):
+        logs = db.session.query(
+            LoginLog.id, LoginLog.template_id, LoginLog.params, LoginLog.message,
+            LoginLog.details, LoginLog.compressed_details
+        ).filter(LoginLog.id.in_(ids)).all()
+        self.index_rows((log.id,) + index_text(log) for log in logs)
+
+    def _index_attempt_ids(self, ids):
+        self.index_attempts(
+            db.session.query(LoginAttempt.id, LoginAttempt.error_message).filter(LoginAttempt.id.in_(ids)).all()
+        )
+
+    def index_rows(self, entries):
+        """在当前事务中为新日志建立索引（不提交），entries 为 (id, 消息, details 文本) 序列"""
+        params = [{'id': log_id, 'body': _document(message, details)} for log_id, message, details in entries]
+        if not params or not self.maintained:
+            return
+        if self.mode == 'fts5':
+            db.session.execute(text(f"INSERT INTO {FTS_TABLE}(rowid, body) VALUES (:id, :body)"), params)
+        else:
+            db.session.execute(text(
+                "UPDATE login_log SET search_vector = to_tsvector('simple', :body) WHERE id = :id"
+            ), params)
+
+    def index_attempts(self, entries):
+        """在当前事务中为新的登录尝试记录建立索引（不提交），entries 为 (id, 错误信息) 序列
+
+        没有错误信息的记录也写入一个空条目，补建索引时据此判断记录已处理。
+        """
+        params = [{'id': attempt_id, 'body': error_message or ''} for attempt_id, error_message in entries]
+        if not params or not self.maintained:
+            return
+        if self.mode == 'fts5':
+            db.session.execute(text(f"INSERT INTO {ATTEMPT_FTS_TABLE}(rowid, body) VALUES (:id, :body)"), params)
+        else:
+            db.session.execute(text(
+                "UPDATE login_attempt SET search_vector = to_tsvector('simple', :body) WHERE id = :id"
+            ), params)
+
+    def unindex(self, ids):
+        """在当前事务中删除日志的索引（不提交），需要在删除日志行之前调用
+
+        无内容 FTS5 表删除条目时必须提供与写入时相同的文本，因此先读出日志行重新渲染。
+        tsvector 列随日志行一起删除，无需处理。
+        """
+        if self.mode != 'fts5' or not ids:
+            return
+        # 删除从未写入索引的 rowid 会破坏无内容 FTS5 表（例如绕过写入器直接插入的行），只处理已索引的行
+        indexed = self._indexed_ids(FTS_TABLE, ids)
+        if not indexed:
+            return
+        logs = db.session.query(
+            LoginLog.id, LoginLog.template_id, LoginLog.params, LoginLog.message,
+            LoginLog.details, LoginLog.compressed_details
+        ).filter(LoginLog.id.in_(indexed)).all()
+        params = [{'id': log.id, 'body': _document(*index_text(log))} for log in logs]
+        if params:
+            db.session.execute(text(
+                f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, body) VALUES ('delete', :id, :body)"
+            ), params)
+
+    def unindex_attempts(self, ids):
+        """在当前事务中删除登录尝试记录的索引（不提交），需要在删除记录之前调用"""
+        if self.mode != 'fts5' or not ids:
+            return
+        indexed = self._indexed_ids(ATTEMPT_FTS_TABLE, ids)
+        if not indexed:
+            return
+        params = [{'id': attempt_id, 'body': error_message or ''} for attempt_id, error_message in
+                  db.session.query(LoginAttempt.id, LoginAttempt.error_message).filter(LoginAttempt.id.in_(indexed))]
+        if params:
+            db.session.execute(text(
+                f"INSERT INTO {ATTEMPT_FTS_TABLE}({ATTEMPT_FTS_TABLE}, rowid, body) VALUES ('delete', :id, :body)"
+            ), params)
+
+    def optimize(self):
+        """合并 FTS5 索引段（大量删除、补建索引之后执行，回收删除标记占用的空间）"""
+        if self.mode == 'fts5':
+            for name in (FTS_TABLE, ATTEMPT_FTS_TABLE):
+                db.session.execute(text(f"INSERT INTO {name}({name}) VALUES ('optimize')"))
+        db.session.commit()
+
+    @staticmethod
+    def _like_filter(term):
+        """不使用索引的子串匹配：消息原文、模板文本和模板参数（压缩后的 details 无法匹配）"""
+        pattern = f"%{term}%"
+        conditions = [LoginLog.message.like(pattern), LoginLog.params.like(pattern), LoginLog.details.like(pattern)]
+        template_ids = [template_id for template_id, template in LoginLog.TEMPLATE_TEXTS.items() if term in template]
+        if template_ids:
+            conditions.append(LoginLog.template_id.in_(template_ids))
+        return or_(*conditions)
+
+    @staticmethod
+    def _fts_match(terms):
+        # 每个词作为短语匹配，避免用户输入被解析为 FTS 查询语法
+        return ' '.join('"' + term.replace('"', '""') + '"' for term in terms)
+
+    def search(self, q, account_id=None, date=None, level=None, page=1, per_page=50):
+        """按相关度检索日志，返回 (本页日志, 是否还有下一页)
+
+        q 按空白拆分为多个词，日志须包含全部词。可与账号、日期、级别筛选组合。
+        """
+        terms = q.split()
+        query = log_list_query()
+        mode = self.search_mode
+
+        if account_id:
+            query = query.filter(LoginLog.account_id == account_id)
+        if date:
+            query = query.filter(LoginLog.created_on(date))
+        if level:
+            query = query.filter(LoginLog.level == level.upper())
+
+        if mode == 'fts5':
+            indexed = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+            for term in terms:
+                if len(term) < TRIGRAM_MIN_LENGTH:
+                    query = query.filter(self._like_filter(term))
+            if indexed:
+                fts = table(FTS_TABLE, column('rowid'))
+                query = query.join(fts, fts.c.rowid == LoginLog.id).filter(
+                    text(f"{FTS_TABLE} MATCH :match").bindparams(match=self._fts_match(indexed))
+                ).order_by(func.bm25(literal_column(FTS_TABLE)))
+        elif mode == 'tsvector':
+            ts_query = func.plainto_tsquery('simple', ' '.join(terms))
+            search_vector = literal_column('login_log.search_vector')
+            query = query.filter(search_vector.op('@@')(ts_query)).order_by(
+                func.ts_rank(search_vector, ts_query).desc()
+            )
+        else:
+            for term in terms:
+                query = query.filter(self._like_filter(term))
+
+        logs = query.order_by(LoginLog.created_at.desc(), LoginLog.id.desc()) \
+            .offset((page - 1) * per_page).limit(per_page + 1).all()
+        return logs[:per_page], len(logs) > per_page
+
+    def search_attempts(self, q, account_id=None, date=None, level=None, page=1, per_page=50):
+        """按相关度检索登录尝试记录的错误信息（登录接口返回的 sErrMsg），返回 (本页记录, 是否还有下一页)
+
+        有错误信息的尝试都是失败的尝试，level 不为 ERROR 时没有结果。
+        """
+        if level and level.upper() != 'ERROR':
+            return [], False
+        terms = q.split()
+        query = LoginAttempt.query.filter(LoginAttempt.error_message.isnot(None))
+        mode = self.search_mode
+
+        if account_id:
+            query = query.filter(LoginAttempt.account_id == account_id)
+        if date:
+            query = query.filter(LoginAttempt.created_on(date))
+
+        if mode == 'fts5':
+            indexed = [term for term in terms if len(term) >= TRIGRAM_MIN_LENGTH]
+            for term in terms:
+                if len(term) < TRIGRAM_MIN_LENGTH:
+                    query = query.filter(LoginAttempt.error_message.like(f"%{term}%"))
+            if indexed:
+                fts = table(ATTEMPT_FTS_TABLE, column('rowid'))
+                query = query.join(fts, fts.c.rowid == LoginAttempt.id).filter(
+                    text(f"{ATTEMPT_FTS_TABLE} MATCH :match").bindparams(match=self._fts_match(indexed))
+                ).order_by(func.bm25(literal_column(ATTEMPT_FTS_TABLE)))
+        elif mode == 'tsvector':
+            ts_query = func.plainto_tsquery('simple', ' '.join(terms))
+            search_vector = literal_column('login_attempt.search_vector')
+            query = query.filter(search_vector.op('@@')(ts_query)).order_by(
+                func.ts_rank(search_vector, ts_query).desc()
+            )
+        else:
+            for term in terms:
+                query = query.filter(LoginAttempt.error_message.like(f"%{term}%"))
+
+        attempts = query.order_by(LoginAttempt.created_at.desc(), LoginAttempt.id.desc()) \
+            .offset((page - 1) * per_page).limit(per_page + 1).all()
+        return attempts[:per_page], len(attempts) > per_page
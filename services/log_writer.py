@@ -0,0 +1,318 @@
+import atexit
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+from sqlalchemy.exc import OperationalError
+from config import Config
+from models import db, details_text, encode_details, LoginAttempt, LoginLog
+from .daily_stats import apply_attempts
+from .metrics import Counter, Gauge, LOGIN_STAGE_SECONDS
+
+LOG_WRITER_ROWS = Counter('log_writer_rows_total', '批量写入的登录日志行数', ['result'])
+LOG_WRITER_QUEUE = Gauge('log_writer_queue_size', '等待写入的登录日志行数')
+WRITER_TABLES = {table.name: table for table in (LoginLog.__table__, LoginAttempt.__table__)}
+
+
+class LogWriter:
+    """登录日志批量写入器
+
+    save_log 只把日志行（以及登录尝试记录）放入队列，后台线程攒够 batch_size 行或等待 flush_interval 秒后
+    用一次 executemany 插入并提交，避免每条日志一次提交争抢 SQLite 写锁。队列满时写入方
+    阻塞等待（背压）；进程退出时自动写完队列中剩余的日志。绑定全文索引后在同一事务中为新日志建立索引。
+
+    数据库被锁等 OperationalError 按指数退避重试整批，重试 max_retries 次仍失败（或遇到其他错误）时，
+    把这批行追加到 failed_file（NDJSON），可用 replay_failed() 重新写入，不会静默丢弃。
+    """
+
+    def __init__(self, app=None, batch_size=None, flush_interval=None, max_queue=None, max_retries=None,
+                 retry_backoff=None, failed_file=None):
+        self.batch_size = batch_size or Config.LOG_WRITER_BATCH_SIZE
+        self.flush_interval = flush_interval or Config.LOG_WRITER_FLUSH_INTERVAL
+        self.max_queue = max_queue or Config.LOG_WRITER_QUEUE_SIZE
+        self.max_retries = max_retries or Config.LOG_WRITER_MAX_RETRIES
+        self.retry_backoff = Config.LOG_WRITER_RETRY_BACKOFF if retry_backoff is None else retry_backoff
+        self.failed_file = failed_file or Config.LOG_WRITER_FAILED_FILE
+        self.logger = logging.getLogger("LogWriter")
+
+        self.app = None
+        self.search_index = None
+        self._queue = queue.Queue(maxsize=self.max_queue)
+        self._thread = None
+        self._stopped = False
+        self._stats_lock = threading.Lock()
+        self._failed_file_lock = threading.Lock()
+        self.enqueued = 0
+        self.written = 0
+        self.failed = 0
+        self.retries = 0
+        self.commits = 0
+        self.blocked = 0
+
+        if app:
+            self.init_app(app)
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def init_app(self, app, search_index=None):
+        """绑定应用（以及日志全文索引）并启动后台写入线程"""
+        self.app = app
+        if search_index is not None:
+            self.search_index = search_index
+        if not self.running:
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+            self._thread.start()
+            atexit.register(self.close)
+
+    def write(self, account_id, level, message, details=None, is_success=False, params=None):
+        """将一条日志放入写入队列；写入线程未启动时直接写库
+
+        message 为 LoginLog.TEMPLATES 中的模板名时只保存模板编号和 params，否则原样保存消息。
+        """
+        template = LoginLog.TEMPLATES.get(message)
+        encoded_params = json.dumps(params, ensure_ascii=False, separators=(',', ':')) if params else None
+        encoded_details = json.dumps(details, ensure_ascii=False, separators=(',', ':')) if details else None
+        stored_details, compressed_details = encode_details(encoded_details)
+        row = {
+            'account_id': account_id,
+            'level': level,
+            'template_id': template[0] if template else None,
+            'params': encoded_params,
+            'message': '' if template else message,
+            'details': stored_details,
+            'compressed_details': compressed_details,
+            'is_success': is_success,
+            'created_at': datetime.utcnow()
+        }
+        # 全文索引使用渲染后的消息和未压缩的 details
+        search_text = (LoginLog.render_message(row['template_id'], encoded_params, message), encoded_details)
+        self._enqueue(LoginLog.__table__, row, search_text)
+
+    def write_attempt(self, record):
+        """将一条登录尝试记录（LoginAttempt 列名到值的字典）放入写入队列"""
+        self._enqueue(LoginAttempt.__table__, record)
+
+    def _enqueue(self, table, row, search_text=None):
+        item = (table, row, search_text)
+        if not self.running:
+            self._insert([item])
+            return
+
+        try:
+            self._queue.put_nowait(item)
+        except queue.Full:
+            with self._stats_lock:
+                self.blocked += 1
+            self._queue.put(item)
+
+        with self._stats_lock:
+            self.enqueued += 1
+
+    def flush(self, timeout=None):
+        """等待此前放入队列的日志全部写入数据库（用于写入后立即读取的场景）"""
+        if not self.running:
+            return True
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def close(self, timeout=10):
+        """写完剩余日志并停止写入线程"""
+        if not self.running:
+            return
+        self._stopped = True
+        self.flush(timeout)
+        self._thread.join(timeout)
+
+    def _run(self):
+        rows = []
+        deadline = None
+        while True:
+            timeout = None if deadline is None else max(0.0, deadline - time.monotonic())
+            try:
+                item = self._queue.get(timeout=timeout)
+            except queue.Empty:
+                item = None
+
+            if isinstance(item, threading.Event):
+                self._insert(rows)
+                rows, deadline = [], None
+                item.set()
+                if self._stopped and self._queue.empty():
+                    return
+                continue
+
+            if item is not None:
+                rows.append(item)
+                if deadline is None:
+                    deadline = time.monotonic() + self.flush_interval
+
+            if rows and (len(rows) >= self.batch_size or time.monotonic() >= deadline):
+                self._insert(rows)
+                rows, deadline = [], None
+
+            LOG_WRITER_QUEUE.set(self._queue.qsize())
+
+    def _insert(self, rows):
+        """一次提交批量插入日志行，rows 为 (表, 行, 索引文本) 列表"""
+        if not rows:
+            return
+        if self.app is not None:
+            # 异常不能传出应用上下文：teardown_appcontext 收到异常时会关闭调度器
+            with self.app.app_context():
+                self._insert_with_retry(rows)
+        else:
+            self._insert_with_retry(rows)
+
+    def _insert_with_retry(self, rows):
+        """OperationalError（数据库被锁等）按 retry_backoff 指数退避重试，期间队列继续积压并对写入方形成背压"""
+        attempt = 1
+        while True:
+            try:
+                with LOGIN_STAGE_SECONDS.time(stage='db_write'):
+                    self._execute(rows)
+                break
+            except OperationalError as e:
+                if attempt >= self.max_retries:
+                    self._write_failed(rows, e)
+                    return
+                delay = self.retry_backoff * 2 ** (attempt - 1)
+                self.logger.warning(f"批量写入日志失败（{len(rows)} 条），{delay:.1f} 秒后第 {attempt} 次重试: {str(e)}")
+                with self._stats_lock:
+                    self.retries += 1
+                attempt += 1
+                time.sleep(delay)
+            except Exception as e:
+                self._write_failed(rows, e)
+                return
+
+        LOG_WRITER_ROWS.inc(len(rows), result='written')
+        with self._stats_lock:
+            self.written += len(rows)
+            self.commits += 1
+
+    def _write_failed(self, rows, error):
+        """把写入失败的行追加到 failed_file，保留原始内容以便检查和重放"""
+        LOG_WRITER_ROWS.inc(len(rows), result='failed')
+        with self._stats_lock:
+            self.failed += len(rows)
+        self.logger.error(f"批量写入日志失败（{len(rows)} 条），已保存到 {self.failed_file}: {str(error)}")
+
+        failed_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        lines = []
+        for table, row, _ in rows:
+            row = dict(row, created_at=row['created_at'].isoformat())
+            if table is LoginLog.__table__:
+                # 压缩的 details 还原为文本，文件可以直接阅读
+                row['details'] = details_text(row.pop('compressed_details'), row['details'])
+            lines.append(json.dumps({'table': table.name, 'row': row, 'error': str(error), 'failed_at': failed_at},
+                                    ensure_ascii=False) + '\n')
+        try:
+            with self._failed_file_lock:
+                directory = os.path.dirname(self.failed_file)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.failed_file, 'a', encoding='utf-8') as f:
+                    f.writelines(lines)
+        except OSError as e:
+            self.logger.error(f"保存写入失败的日志失败，{len(rows)} 条日志已丢失: {str(e)}")
+
+    def replay_failed(self):
+        """重新写入 failed_file 中的行，返回重新放入队列的行数
+
+        文件先改名再读取，重放时再次失败的行会写入新的 failed_file；统计表按登录尝试记录重新累加。
+        """
+        with self._failed_file_lock:
+            if not os.path.exists(self.failed_file):
+                return 0
+            replaying = f"{self.failed_file}.{datetime.now().strftime('%Y%m%d%H%M%S')}.replayed"
+            os.replace(self.failed_file, replaying)
+
+        count = 0
+        with open(replaying, encoding='utf-8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                entry = json.loads(line)
+                table = WRITER_TABLES[entry['table']]
+                row = dict(entry['row'], created_at=datetime.fromisoformat(entry['row']['created_at']))
+                search_text = None
+                if table is LoginLog.__table__:
+                    search_text = (LoginLog.render_message(row['template_id'], row['params'], row['message']),
+                                   row['details'])
+                    row['details'], row['compressed_details'] = encode_details(row['details'])
+                self._enqueue(table, row, search_text)
+                count += 1
+        self.flush()
+        return count
+
+    def _execute(self, rows):
+        # 按表分组，每张表一次 executemany，整批一次提交
+        tables = {}
+        search_texts = []
+        for table, row, search_text in rows:
+            tables.setdefault(table, []).append(row)
+            if table is LoginLog.__table__:
+                search_texts.append(search_text)
+        try:
+            for table, table_rows in tables.items():
+                if self.search_index is not None and self.search_index.maintained:
+                    # 取回新记录的 id，在同一事务中写入全文索引
+                    ids = db.session.execute(
+                        table.insert().returning(table.c.id, sort_by_parameter_order=True), table_rows
+                    ).scalars().all()
+                    if table is LoginLog.__table__:
+                        self.search_index.index_rows(
+                            (log_id, message, details) for log_id, (message, details) in zip(ids, search_texts)
+                        )
+                    else:
+                        self.search_index.index_attempts(
+                            (attempt_id, row['error_message']) for attempt_id, row in zip(ids, table_rows)
+                        )
+                else:
+                    db.session.execute(table.insert(), table_rows)
+            # 在同一事务中累加账号每日统计
+            if LoginAttempt.__table__ in tables:
+                apply_attempts(tables[LoginAttempt.__table__])
+            db.session.commit()
+        except Exception:
+            db.session.rollback()
+            raise
+
+    def get_stats(self):
+        """获取写入器统计信息"""
+        with self._stats_lock:
+            return {
+                'running': self.running,
+                'queued': self._queue.qsize(),
+                'max_queue': self.max_queue,
+                'batch_size': self.batch_size,
+                'flush_interval': self.flush_interval,
+                'enqueued': self.enqueued,
+                'written': self.written,
+                'failed': self.failed,
+                'retries': self.retries,
+                'failed_file': self.failed_file,
+                'commits': self.commits,
+                'rows_per_commit': round(self.written / self.commits, 2) if self.commits else 0,
+                'blocked': self.blocked
+            }
+
+
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+
+def get_log_writer():
+    """获取进程内共享的日志写入器"""
+    global _log_writer
+    with _log_writer_lock:
+        if _log_writer is None:
+            _log_writer = LogWriter()
+        return _log_writer
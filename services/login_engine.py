@@ -0,0 +1,731 @@
+import asyncio
+import base64
+import contextvars
+import functools
+import logging
+import re
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime
+from urllib.parse import urlparse
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding
+from cryptography.hazmat.backends import default_backend
+from config import Config
+from .captcha_prefetcher import CaptchaPrefetcher
+from .http_session_pool import HttpSessionPool
+from .metrics import LOGIN_ATTEMPTS_PER_SUCCESS, LOGIN_DURATION_SECONDS, LOGIN_RESULTS, LOGIN_STAGE_SECONDS
+from .rate_limiter import CircuitBreaker, CircuitOpenError, TokenBucket
+from .ocr_service import CAPTCHA_LENGTH, CandidateStats, get_ocr_worker_pool, get_shared_ocr
+
+# 登录所需的账号信息（不依赖数据库会话，可在事件循环线程中安全使用）
+# session_token 为上次登录成功后保存的 token，登录前会先探测其是否仍然有效；
+# refresh_club 为 False 时（俱乐部信息缓存未过期）登录成功后不再请求俱乐部列表
+AccountCredentials = namedtuple('AccountCredentials',
+                                ['account_id', 'name', 'email', 'password', 'session_token', 'refresh_club'],
+                                defaults=(None, True))
+
+PKCS1_PADDING = padding.PKCS1v15()
+
+# 俱乐部列表接口的错误信息包含这些关键词时认为 token 已失效（错误码见 SESSION_EXPIRED_ERROR_CODES）
+SESSION_EXPIRED_KEYWORDS = ('token', '过期', '失效', '无效', '重新登录')
+# 提交候选验证码后登录接口返回这些关键词时，认为验证码（token）已在上一次提交后作废
+CAPTCHA_CONSUMED_KEYWORDS = ('token', '失效', '过期')
+
+# LoginAttempt 记录中单独计时的登录阶段（对应 <stage>_ms 列）
+ATTEMPT_STAGES = ('token', 'captcha', 'ocr', 'encrypt', 'login', 'club_list')
+
+# 当前登录尝试的 (任务, {阶段: 秒})；只累计发起该尝试的任务内的耗时，不含它触发的后台预取任务
+_attempt_timings = contextvars.ContextVar('attempt_timings', default=None)
+
+
+@contextmanager
+def timed_stage(stage):
+    """记录登录阶段耗时指标，并累加到当前登录尝试的耗时中"""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        elapsed = time.perf_counter() - started
+        LOGIN_STAGE_SECONDS.observe(elapsed, stage=stage)
+        current = _attempt_timings.get()
+        if current is not None and current[0] is asyncio.current_task():
+            current[1][stage] = current[1].get(stage, 0.0) + elapsed
+
+
+def new_attempt_record(account_id, attempt):
+    """创建一条 LoginAttempt 记录（所有列都有值，便于批量插入）"""
+    record = {
+        'account_id': account_id,
+        'attempt': attempt,
+        'outcome': None,
+        'is_success': False,
+        'error_code': None,
+        'error_message': None,
+        'ocr_text': None,
+        'ocr_confidence': None,
+        'candidates_tried': 0,
+        'prefetched': False,
+        'duration_ms': None,
+        'created_at': datetime.utcnow()
+    }
+    record.update({f"{stage}_ms": None for stage in ATTEMPT_STAGES})
+    return record
+
+
+@functools.lru_cache(maxsize=Config.RSA_KEY_CACHE_SIZE)
+def parse_public_key(key_str):
+    """解析PEM/Base64 DER/十六进制DER格式的公钥
+
+    固定公钥常驻缓存，token 公钥在其有效的登录尝试期间命中缓存；解析失败时抛出异常（不缓存）。
+    """
+    if "-----BEGIN" in key_str:
+        return serialization.load_pem_public_key(key_str.encode(), backend=default_backend())
+    try:
+        der_data = base64.b64decode(key_str)
+        return serialization.load_der_public_key(der_data, backend=default_backend())
+    except Exception:
+        hex_str = re.sub(r'\s+', '', key_str)
+        if len(hex_str) % 2 != 0:
+            hex_str = '0' + hex_str
+        der_data = bytes.fromhex(hex_str)
+        return serialization.load_der_public_key(der_data, backend=default_backend())
+
+
+class AsyncLoginEngine:
+    """异步登录引擎
+
+    在一个独立线程的事件循环上运行 token → 验证码 → OCR → RSA → 登录 流程，
+    多个账号的登录可以在同一个事件循环上并发执行，并按主机限制并发请求数。
+    """
+
+    def __init__(self, base_url=None, max_attempts=None, host_concurrency=None, request_timeout=None):
+        self.base_url = (base_url or Config.CMS_API_BASE_URL).rstrip('/')
+        self.max_attempts = max_attempts or Config.LOGIN_MAX_ATTEMPTS
+        self.host_concurrency = host_concurrency or Config.CMS_HOST_CONCURRENCY
+        self.request_timeout = request_timeout or Config.CMS_REQUEST_TIMEOUT
+        self.headers = {
+            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
+            "Accept": "application/json, text/javascript, */*; q=0.01",
+            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
+            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "sec-ch-ua": "\"Not)A;Brand\";v=\"8\", \"Chromium\";v=\"138\", \"Google Chrome\";v=\"138\"",
+            "sec-ch-ua-mobile": "?0",
+            "sec-ch-ua-platform": "\"Windows\"",
+            "Sec-Fetch-Dest": "empty",
+            "Sec-Fetch-Mode": "cors",
+            "Sec-Fetch-Site": "cross-site",
+            "Referer": "https://cms.ayybyyy.com/"
+        }
+
+        # 固定公钥（启动时解析一次并放入缓存）
+        self.first_public_key = "MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQDNR7I+SpqIZM5w3Aw4lrUlhrs7VurKbeViYXNhOfIgP/4acsWvJy5dPb/FejzUiv2cAiz5As2DJEQYEM10LvnmpnKx9Dq+QDo7WXnT6H2szRtX/8Q56Rlzp9bJMlZy7/i0xevlDrWZMWqx2IK3ZhO9+0nPu4z4SLXaoQGIrs7JxwIDAQAB"
+
+        # 共享OCR引擎（首次识别时加载模型）；进程池模式下立即拉起工作进程
+        self.ocr = get_shared_ocr()
+        self.ocr_pool = None
+        self.captcha_candidates = Config.CAPTCHA_CANDIDATES
+        self.captcha_min_confidence = Config.CAPTCHA_MIN_CONFIDENCE
+        self.captcha_max_refetch = Config.CAPTCHA_MAX_REFETCH
+        self.ocr_timeout = Config.OCR_TIMEOUT_SECONDS
+        self.candidate_stats = CandidateStats()
+        # 观察到验证码提交一次即作废后，不再尝试其余候选
+        self.captcha_single_use = False
+        if Config.OCR_MODE == 'process':
+            self.ocr_pool = get_ocr_worker_pool()
+            self.ocr_pool.start()
+        self.verbose_logs = Config.VERBOSE_LOGIN_LOGS
+        self.logger = logging.getLogger("LoginService")
+        self.load_public_key(self.first_public_key)
+
+        # 事件循环及其上的资源（仅在事件循环线程中访问）
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self._host_limits = {}
+        self.session_pool = HttpSessionPool(request_timeout=self.request_timeout)
+        self.rate_limiter = TokenBucket()
+        self.circuit_breaker = CircuitBreaker()
+        self.prefetcher = CaptchaPrefetcher(self)
+
+    # ------------------------------------------------------------------
+    # 事件循环管理
+    # ------------------------------------------------------------------
+    def _ensure_loop(self):
+        """启动（或复用）后台事件循环线程"""
+        with self._loop_lock:
+            if self._loop is None:
+                loop = asyncio.new_event_loop()
+                thread = threading.Thread(target=self._run_loop, args=(loop,), name='login-engine-loop', daemon=True)
+                thread.start()
+                self._loop = loop
+            return self._loop
+
+    @staticmethod
+    def _run_loop(loop):
+        asyncio.set_event_loop(loop)
+        loop.run_forever()
+
+    def submit(self, coro):
+        """把协程提交到引擎事件循环，返回 concurrent.futures.Future"""
+        return asyncio.run_coroutine_threadsafe(coro, self._ensure_loop())
+
+    def run_sync(self, coro, timeout=None):
+        """在引擎事件循环上执行协程，并在当前线程阻塞等待结果"""
+        return self.submit(coro).result(timeout)
+
+    def _host_limit(self, url):
+        """获取目标主机的并发信号量"""
+        host = urlparse(url).netloc
+        semaphore = self._host_limits.get(host)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.host_concurrency)
+            self._host_limits[host] = semaphore
+        return semaphore
+
+    async def _post_json(self, url, headers=None, data=None, session_key=None):
+        """使用账号对应的会话发送POST请求，状态码为200时返回JSON结果，否则返回None
+
+        请求先经过熔断器和全局限流器；网络异常和非200状态码计为上游失败。
+        """
+        if not self.circuit_breaker.allow():
+            raise CircuitOpenError(f"上游接口熔断中，{self.circuit_breaker.retry_after():.0f} 秒后恢复")
+        await self.rate_limiter.acquire()
+
+        session = await self.session_pool.get(session_key)
+        try:
+            async with self._host_limit(url):
+                async with session.post(url, headers=headers or self.headers, data=data) as response:
+                    if response.status != 200:
+                        self.circuit_breaker.record_failure()
+                        return None
+                    result = await response.json(content_type=None)
+        except asyncio.CancelledError:
+            raise
+        except Exception:
+            self.circuit_breaker.record_failure()
+            raise
+        self.circuit_breaker.record_success()
+        return result
+
+    async def _emit(self, log, account_id, level, message, details=None, is_success=False, params=None):
+        """在线程池中调用日志回调，避免数据库写入阻塞事件循环；message 为 LoginLog.TEMPLATES 中的模板名"""
+        if not log:
+            return
+        loop = asyncio.get_running_loop()
+        await loop.run_in_executor(
+            None,
+            functools.partial(log, account_id, level, message, details=details, is_success=is_success, params=params)
+        )
+
+    async def _emit_step(self, log, account_id, level, message, details=None, is_success=False, params=None):
+        """记录登录流程的逐步日志，仅在开启 VERBOSE_LOGIN_LOGS 时写入"""
+        if self.verbose_logs:
+            await self._emit(log, account_id, level, message, details=details, is_success=is_success, params=params)
+
+    @contextmanager
+    def _recording(self, account_id, attempt):
+        """在代码块执行期间收集本次尝试的各阶段耗时，结束时写入 LoginAttempt 记录"""
+        record = new_attempt_record(account_id, attempt)
+        timings = {}
+        context_token = _attempt_timings.set((asyncio.current_task(), timings))
+        started = time.perf_counter()
+        try:
+            yield record
+        finally:
+            _attempt_timings.reset(context_token)
+            for stage, seconds in timings.items():
+                record[f"{stage}_ms"] = int(round(seconds * 1000))
+            record['duration_ms'] = int(round((time.perf_counter() - started) * 1000))
+            record['is_success'] = record['outcome'] in ('success', 'reused')
+
+    # ------------------------------------------------------------------
+    # 登录流程各步骤
+    # ------------------------------------------------------------------
+    async def get_token(self, session_key=None):
+        """获取token"""
+        url = f"{self.base_url}/token/generateCaptchaToken"
+        try:
+            with timed_stage('token'):
+                result = await self._post_json(url, session_key=session_key)
+            if result and result.get("iErrCode") == 0:
+                return result.get("result")
+            return None
+        except Exception as e:
+            self.logger.error(f"获取token失败: {str(e)}")
+            return None
+
+    async def get_captcha(self, token, session_key=None):
+        """获取验证码图片"""
+        url = f"{self.base_url}/captcha"
+        try:
+            with timed_stage('captcha'):
+                result = await self._post_json(url, data={"token": token}, session_key=session_key)
+            if result and result.get("iErrCode") == 0:
+                return result.get("result")
+            return None
+        except Exception as e:
+            self.logger.error(f"获取验证码失败: {str(e)}")
+            return None
+
+    async def recognize_captcha_candidates(self, captcha_base64):
+        """识别验证码，返回按置信度排序的4位候选 [(验证码文本, 置信度)]
+
+        OCR为CPU密集操作，交给OCR进程池或线程池执行。进程池识别失败或超过 OCR_TIMEOUT_SECONDS
+        仍未返回时，改用进程内的OCR引擎识别，避免登录任务无限期等待。
+        """
+        try:
+            captcha_img = base64.b64decode(captcha_base64)
+            with timed_stage('ocr'):
+                candidates = None
+                if self.ocr_pool:
+                    try:
+                        candidates = await asyncio.wait_for(
+                            asyncio.wrap_future(self.ocr_pool.submit(captcha_img)), self.ocr_timeout
+                        )
+                    except Exception as e:
+                        self.logger.warning(f"OCR进程池识别失败，改用进程内识别: {str(e) or type(e).__name__}")
+                if candidates is None:
+                    loop = asyncio.get_running_loop()
+                    candidates = await loop.run_in_executor(
+                        None, self.ocr.classify_candidates, captcha_img, self.captcha_candidates
+                    )
+            return [candidate for candidate in candidates if len(candidate[0]) == CAPTCHA_LENGTH] or candidates[:1]
+        except Exception as e:
+            self.logger.error(f"识别验证码失败: {str(e)}")
+            return []
+
+    async def recognize_captcha(self, captcha_base64):
+        """识别验证码，返回置信度最高的结果"""
+        candidates = await self.recognize_captcha_candidates(captcha_base64)
+        return candidates[0][0] if candidates else None
+
+    async def solve_captcha(self, token, session_key=None, log=None, account_id=None):
+        """获取并识别验证码
+
+        最优候选置信度低于 CAPTCHA_MIN_CONFIDENCE 时直接丢弃并重新获取验证码，
+        不再为它付出一次RSA加密和登录请求。返回 (状态, 候选列表)，
+        状态为 ok / captcha_failed / ocr_failed。
+        """
+        candidates = []
+        for refetch in range(self.captcha_max_refetch + 1):
+            captcha_base64 = await self.get_captcha(token, session_key=session_key)
+            if not captcha_base64:
+                return 'captcha_failed', []
+            if refetch == 0:
+                await self._emit_step(log, account_id, "INFO", 'captcha_fetched')
+
+            candidates = await self.recognize_captcha_candidates(captcha_base64)
+            if not candidates or len(candidates[0][0]) != CAPTCHA_LENGTH:
+                return 'ocr_failed', candidates
+
+            confidence = candidates[0][1]
+            if confidence is None or confidence >= self.captcha_min_confidence:
+                # 其余候选同样需要达到置信度阈值
+                return 'ok', [candidates[0]] + [
+                    candidate for candidate in candidates[1:] if candidate[1] >= self.captcha_min_confidence
+                ]
+
+            self.candidate_stats.record_discard()
+            await self._emit_step(log, account_id, "INFO", 'captcha_low_confidence',
+                                  params={'captcha': candidates[0][0], 'confidence': confidence})
+
+        return 'ocr_failed', candidates
+
+    @staticmethod
+    def _format_candidates(candidates):
+        return ', '.join(
+            text if confidence is None else f"{text}({confidence:.2f})" for text, confidence in candidates
+        )
+
+    def load_public_key(self, key_str):
+        """加载公钥（解析结果缓存在 parse_public_key 的LRU缓存中）"""
+        try:
+            return parse_public_key(key_str)
+        except Exception as e:
+            self.logger.error(f"加载公钥失败: {str(e)}")
+            return None
+
+    def rsa_encrypt_long(self, text, public_key_str):
+        """RSA加密长文本"""
+        try:
+            public_key = self.load_public_key(public_key_str)
+            if not public_key:
+                return None
+
+            max_block_size = public_key.key_size // 8 - 11
+            data = text.encode('utf-8')
+            if len(data) != len(text):
+                # 含多字节字符时按字符分块，与原有分块方式保持一致
+                blocks = (text[i:i + max_block_size].encode('utf-8') for i in range(0, len(text), max_block_size))
+            else:
+                view = memoryview(data)
+                blocks = (view[i:i + max_block_size] for i in range(0, len(data), max_block_size))
+
+            encrypted_data = bytearray()
+            for block in blocks:
+                encrypted_data += public_key.encrypt(bytes(block), PKCS1_PADDING)
+            return base64.b64encode(encrypted_data).decode('utf-8')
+        except Exception as e:
+            self.logger.error(f"RSA加密失败: {str(e)}")
+            return None
+
+    async def login(self, account, password, captcha, token, session_key=None):
+        """登录"""
+        url = f"{self.base_url}/login"
+
+        # 双重加密
+        with timed_stage('encrypt'):
+            first_encrypted_password = self.rsa_encrypt_long(password, self.first_public_key)
+            second_encrypted_password = first_encrypted_password and self.rsa_encrypt_long(first_encrypted_password, token)
+            encrypted_account = second_encrypted_password and self.rsa_encrypt_long(account, token)
+        if not encrypted_account:
+            return None
+
+        data = {
+            "account": encrypted_account,
+            "data": second_encrypted_password,
+            "safeCode": captcha,
+            "token": token,
+            "locale": "zh"
+        }
+
+        try:
+            with timed_stage('login'):
+                return await self._post_json(url, data=data, session_key=session_key)
+        except Exception as e:
+            self.logger.error(f"登录请求失败: {str(e)}")
+            return None
+
+    @staticmethod
+    def is_session_expired(result):
+        """俱乐部列表接口的返回是否明确表示 token 已失效"""
+        if result.get("iErrCode") in Config.SESSION_EXPIRED_ERROR_CODES:
+            return True
+        message = str(result.get("sErrMsg") or '').lower()
+        return any(keyword in message for keyword in SESSION_EXPIRED_KEYWORDS)
+
+    @staticmethod
+    def is_captcha_consumed(result):
+        """登录接口的返回是否表示验证码已作废（需要重新获取验证码，而不是账号登录失败）"""
+        message = str(result.get("sErrMsg") or '').lower()
+        return any(keyword in message for keyword in CAPTCHA_CONSUMED_KEYWORDS)
+
+    async def probe_token(self, token, account_name="未知账号", session_key=None):
+        """调用俱乐部列表接口，返回 (token是否有效, 俱乐部信息)
+
+        只有接口明确返回 token 失效时才返回 False；网络异常、非200状态码、限流等其他错误
+        无法判断 token 状态，返回 None。
+        """
+        url = f"{self.base_url}/club/getClubList"
+
+        headers = {
+            "accept": "application/json, text/javascript",
+            "accept-language": "zh-CN,zh;q=0.9,en;q=0.8",
+            "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
+            "sec-ch-ua": "\"Not)A;Brand\";v=\"8\", \"Chromium\";v=\"138\", \"Google Chrome\";v=\"138\"",
+            "sec-ch-ua-mobile": "?0",
+            "token": token,
+            "referrer": "https://cms.ayybyyy.com/"
+        }
+
+        try:
+            with timed_stage('club_list'):
+                result = await self._post_json(url, headers=headers, session_key=session_key)
+        except Exception as e:
+            self.logger.error(f"获取俱乐部列表失败: {str(e)}")
+            return None, None
+
+        if not result:
+            return None, None
+        if result.get("iErrCode") != 0:
+            return (False if self.is_session_expired(result) else None), None
+
+        club_data = result.get("result")
+        if isinstance(club_data, list) and len(club_data) > 0:
+            club_info = club_data[0]
+            club_id = club_info.get("lClubID")
+            club_name = club_info.get("sClubName")
+            create_user = club_info.get("lCreateUser")
+            credit_league_id = club_info.get("iCreditLeagueId")
+
+            self.logger.info(f"[{account_name}] 俱乐部信息: lClubID={club_id}, sClubName={club_name}, lCreateUser={create_user}, iCreditLeagueId={credit_league_id}")
+            return True, club_info
+        elif isinstance(club_data, dict):
+            return True, club_data
+        return True, None
+
+    async def get_club_list(self, token, account_name="未知账号", session_key=None):
+        """获取俱乐部列表"""
+        _, club_info = await self.probe_token(token, account_name, session_key=session_key)
+        return club_info
+
+    # ------------------------------------------------------------------
+    # 完整登录流程
+    # ------------------------------------------------------------------
+    async def login_attempt(self, account, attempt, log=None, record=None):
+        """执行一次登录尝试
+
+        返回字典：status 为 success / retry；retry_delay 为建议的重试等待秒数，
+        为 None 时表示按尝试次数指数退避。传入 record 时把结果代码、验证码和错误信息写入其中。
+        """
+        account_id = account.account_id
+        if record is None:
+            record = new_attempt_record(account_id, attempt)
+        await self._emit_step(log, account_id, "INFO", 'attempt_started', params={'attempt': attempt, 'name': account.name})
+
+        # 优先使用预取的 token 和验证码
+        prefetched = await self.prefetcher.acquire(session_key=account_id)
+        if prefetched:
+            token, candidates = prefetched
+            record['prefetched'] = True
+            await self._emit_step(log, account_id, "INFO", 'prefetched_captcha',
+                                  params={'captcha': candidates[0][0]})
+        else:
+            # 获取token
+            token = await self.get_token(session_key=account_id)
+            if not token:
+                await self._emit_step(log, account_id, "ERROR", 'token_failed')
+                record['outcome'] = 'token_failed'
+                return {'status': 'retry', 'message': "获取token失败", 'retry_delay': 2}
+
+            await self._emit_step(log, account_id, "INFO", 'token_fetched', params={'token': token[:20]})
+
+            # 获取并识别验证码
+            status, candidates = await self.solve_captcha(token, session_key=account_id, log=log, account_id=account_id)
+            if status == 'captcha_failed':
+                await self._emit_step(log, account_id, "ERROR", 'captcha_fetch_failed')
+                record['outcome'] = 'captcha_failed'
+                return {'status': 'retry', 'message': "获取验证码失败", 'retry_delay': 2}
+            if status != 'ok':
+                shown = candidates[0][0] if candidates else None
+                await self._emit_step(log, account_id, "ERROR", 'ocr_failed', params={'captcha': shown})
+                record['outcome'] = 'ocr_failed'
+                record['ocr_text'] = shown
+                return {'status': 'retry', 'message': "验证码识别失败", 'retry_delay': 2}
+
+            await self._emit_step(log, account_id, "INFO", 'ocr_result',
+                                  params={'candidates': self._format_candidates(candidates)})
+
+        # 登录：验证码错误时依次尝试其余候选，无需重新获取 token 和验证码
+        if self.captcha_single_use:
+            candidates = candidates[:1]
+        error_msg = "未知错误"
+        for rank, (captcha_text, confidence) in enumerate(candidates):
+            if rank > 0:
+                await self._emit_step(log, account_id, "INFO", 'captcha_next_candidate',
+                                      params={'rank': rank + 1, 'captcha': captcha_text})
+            record['ocr_text'], record['ocr_confidence'] = captcha_text, confidence
+            record['candidates_tried'] = rank + 1
+
+            login_result = await self.login(account.email, account.password, captcha_text, token,
+                                            session_key=account_id)
+
+            if not login_result:
+                await self._emit_step(log, account_id, "ERROR", 'request_failed')
+                record['outcome'] = 'request_failed'
+                return {'status': 'retry', 'message': "登录请求失败", 'retry_delay': None}
+
+            # 完整的登录接口返回放在 details 中压缩保存
+            await self._emit_step(log, account_id, "INFO", 'login_result', details=login_result,
+                                  params={'code': login_result.get("iErrCode")})
+
+            record['error_code'] = login_result.get("iErrCode")
+            if login_result.get("iErrCode") == 0:
+                self.candidate_stats.record_result(rank, True)
+                record['outcome'] = 'success'
+                await self._emit(log, account_id, "INFO", 'login_succeeded', is_success=True)
+                await self._emit_step(log, account_id, "ERROR", 'login_succeeded', is_success=True)  # 同时记录到错误级别
+
+                # 获取俱乐部列表（缓存未过期时跳过）
+                club_info = None
+                if account.refresh_club:
+                    club_info = await self.get_club_list(token, account.name, session_key=account_id)
+                    if club_info:
+                        await self._emit_step(log, account_id, "INFO", 'club_list_fetched')
+                    else:
+                        await self._emit(log, account_id, "ERROR", 'club_list_failed')
+
+                return {'status': 'success', 'message': "登录成功", 'token': token, 'club_info': club_info}
+
+            error_msg = str(login_result.get("sErrMsg") or "未知错误")
+            record['error_message'] = error_msg[:255]
+            await self._emit_step(log, account_id, "ERROR", 'login_failed', params={'error': error_msg})
+
+            if "验证码" not in error_msg:
+                if rank > 0 and self.is_captcha_consumed(login_result):
+                    # 上一个候选提交后服务端已作废验证码，剩余候选无法再校验，按验证码错误重新获取
+                    await self._emit_step(log, account_id, "INFO", 'captcha_expired')
+                    self.candidate_stats.record_consumed()
+                    if not self.captcha_single_use:
+                        self.captcha_single_use = True
+                        self.logger.warning("验证码提交一次即作废，之后每个验证码只尝试首选候选")
+                    break
+                record['outcome'] = 'login_failed'
+                return {'status': 'retry', 'message': f"登录失败: {error_msg}", 'retry_delay': None}
+            self.candidate_stats.record_result(rank, False)
+
+        await self._emit_step(log, account_id, "INFO", 'captcha_rejected')
+        record['outcome'] = 'captcha_rejected'
+        # 预取队列开启时下一次尝试可直接取用新的验证码，无需等待
+        retry_delay = 0 if self.prefetcher.enabled else 1
+        return {'status': 'retry', 'message': f"登录失败: {error_msg}", 'retry_delay': retry_delay}
+
+    async def resume_session(self, account, log=None):
+        """探测已保存的 token 是否仍然有效，返回 (有效时的登录结果或None, token是否明确已失效)"""
+        if not account.session_token:
+            return None, False
+
+        valid, club_info = await self.probe_token(account.session_token, account.name, session_key=account.account_id)
+        if valid is None:
+            self.logger.info(f"[{account.name}] 无法验证已保存的登录会话，执行完整登录流程")
+            return None, False
+        if not valid:
+            self.logger.info(f"[{account.name}] 已保存的登录会话已失效，执行完整登录流程")
+            return None, True
+
+        await self._emit(log, account.account_id, "INFO", 'session_reused', is_success=True)
+        return {
+            'success': True,
+            'message': "登录会话仍然有效",
+            'attempts': 0,
+            'token': account.session_token,
+            'club_info': club_info,
+            'reused': True
+        }, False
+
+    async def login_step(self, account, attempt, log=None):
+        """执行第 attempt 次登录尝试，不在内部等待重试
+
+        第 1 次尝试前先探测已保存的登录会话。返回 {'success', 'message', 'attempts', 'token',
+        'club_info', 'reused', 'session_expired', 'retry_delay', 'attempt_records'}，其中 retry_delay 为失败且
+        仍可重试时建议的等待秒数，成功或已达到最大尝试次数时为 None；attempt_records 为本次尝试的
+        LoginAttempt 记录列表。
+        """
+        with self._recording(account.account_id, attempt) as record:
+            summary = await self._login_step(account, attempt, record, log)
+        summary['attempt_records'] = [record]
+        return summary
+
+    async def _login_step(self, account, attempt, record, log=None):
+        account_id = account.account_id
+        retry_after = self.circuit_breaker.retry_after()
+        if retry_after > 0:
+            # 上游熔断期间不发起请求，直接推迟到熔断器恢复之后
+            await self._emit(log, account_id, "ERROR", 'circuit_open', params={'attempt': attempt})
+            record['outcome'] = 'circuit_open'
+            if attempt >= self.max_attempts:
+                LOGIN_RESULTS.inc(result='failed')
+            return {
+                'success': False,
+                'message': "上游接口熔断中",
+                'attempts': attempt,
+                'token': None,
+                'club_info': None,
+                'reused': False,
+                'session_expired': False,
+                'retry_delay': max(retry_after, 2 ** attempt) if attempt < self.max_attempts else None
+            }
+
+        session_expired = False
+        if attempt == 1:
+            resumed, session_expired = await self.resume_session(account, log=log)
+            if resumed:
+                LOGIN_RESULTS.inc(result='reused')
+                record['outcome'] = 'reused'
+                resumed['retry_delay'] = None
+                return resumed
+
+            await self._emit_step(log, account_id, "INFO", 'login_started', params={'name': account.name})
+
+        result = await self.login_attempt(account, attempt, log=log, record=record)
+        success = result['status'] == 'success'
+        summary = {
+            'success': success,
+            'message': result['message'],
+            'attempts': attempt,
+            'token': result.get('token'),
+            'club_info': result.get('club_info'),
+            'reused': False,
+            'session_expired': session_expired,
+            'retry_delay': None
+        }
+
+        if success:
+            LOGIN_RESULTS.inc(result='success')
+            LOGIN_ATTEMPTS_PER_SUCCESS.observe(attempt)
+        else:
+            if attempt >= self.max_attempts:
+                LOGIN_RESULTS.inc(result='failed')
+                await self._emit(log, account_id, "ERROR", 'max_attempts_reached',
+                                 params={'max_attempts': self.max_attempts})
+                summary['message'] = "登录失败"
+            elif result['retry_delay'] is None:
+                summary['retry_delay'] = 2 ** attempt
+            else:
+                summary['retry_delay'] = result['retry_delay']
+        return summary
+
+    async def login_account(self, account, log=None):
+        """登录指定账号（包含重试），返回 {'success', 'message', 'attempts', 'token', 'club_info', 'reused',
+        'session_expired', 'attempt_records'}"""
+        started = time.perf_counter()
+        records = []
+        for attempt in range(1, self.max_attempts + 1):
+            result = await self.login_step(account, attempt, log=log)
+            records.extend(result.pop('attempt_records'))
+            wait_time = result.pop('retry_delay')
+            if wait_time is None:
+                LOGIN_DURATION_SECONDS.observe(time.perf_counter() - started,
+                                               result='success' if result['success'] else 'failed')
+                result['attempt_records'] = records
+                return result
+
+            if wait_time >= 2:
+                await self._emit_step(log, account.account_id, "INFO", 'retry_wait',
+                                      params={'seconds': wait_time})
+            await asyncio.sleep(wait_time)
+
+    async def login_many(self, accounts, log=None, concurrency=None, on_start=None, on_result=None):
+        """在同一事件循环上并发登录多个账号，返回 {account_id: 结果}
+
+        concurrency 限制同时登录的账号数（None 表示不限，HTTP 请求仍受主机并发数和限流约束）；
+        on_start(account_id) 和 on_result(account_id, 结果) 在事件循环线程中于每个账号开始和结束时调用。
+        """
+        limit = asyncio.Semaphore(concurrency) if concurrency else None
+
+        async def login_one(account):
+            if on_start:
+                on_start(account.account_id)
+            try:
+                result = await self.login_account(account, log=log)
+            except Exception as e:
+                result = {'success': False, 'message': f"登录异常: {str(e)}", 'attempts': 0,
+                          'token': None, 'club_info': None, 'reused': False, 'attempt_records': []}
+            if on_result:
+                on_result(account.account_id, result)
+            return result
+
+        async def run(account):
+            if limit is None:
+                return await login_one(account)
+            async with limit:
+                return await login_one(account)
+
+        results = await asyncio.gather(*(run(account) for account in accounts))
+        return {account.account_id: result for account, result in zip(accounts, results)}
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_login_engine():
+    """获取进程内共享的登录引擎"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = AsyncLoginEngine()
+        return _engine
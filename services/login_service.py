@@ -1,42 +1,34 @@
-import requests
-import base64
-import ddddocr
-import json
-import time
-import re
-from cryptography.hazmat.primitives import serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.primitives import hashes
-from cryptography.hazmat.backends import default_backend
-from urllib.parse import quote
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import os
-from models import db, Account, LoginLog
+import queue
+from flask import current_app
+from config import Config
+from models import db, Account, AccountSession, ClubInfo
+from .log_writer import get_log_writer
+from .login_engine import AccountCredentials, get_login_engine
+from .metrics import LOGIN_STAGE_SECONDS
+
+logger = logging.getLogger("LoginService")
+
+def save_log(account_id, level, message, details=None, is_success=False, params=None):
+    """保存日志（无需创建 LoginService 实例）：放入批量写入队列，由后台线程统一提交
+
+    message 可以是 LoginLog.TEMPLATES 中的模板名，此时 params 为模板参数。
+    """
+    try:
+        get_log_writer().write(account_id, level, message, details=details, is_success=is_success, params=params)
+    except Exception as e:
+        logger.error(f"保存日志失败: {str(e)}")
 
 class LoginService:
+    """同步登录服务：对异步登录引擎的轻量封装，供调度器和接口调用"""
+
     def __init__(self):
-        self.session = requests.Session()
-        self.headers = {
-            "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/138.0.0.0 Safari/537.36",
-            "Accept": "application/json, text/javascript, */*; q=0.01",
-            "Accept-Language": "zh-CN,zh;q=0.9,en;q=0.8",
-            "Content-Type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "sec-ch-ua": "\"Not)A;Brand\";v=\"8\", \"Chromium\";v=\"138\", \"Google Chrome\";v=\"138\"",
-            "sec-ch-ua-mobile": "?0",
-            "sec-ch-ua-platform": "\"Windows\"",
-            "Sec-Fetch-Dest": "empty",
-            "Sec-Fetch-Mode": "cors",
-            "Sec-Fetch-Site": "cross-site",
-            "Referer": "https://cms.ayybyyy.com/"
-        }
-        
-        # 固定公钥
-        self.first_public_key = "MIGfMA0GCSqGSIb3DQEBAQUAA4GNADCBiQKBgQDNR7I+SpqIZM5w3Aw4lrUlhrs7VurKbeViYXNhOfIgP/4acsWvJy5dPb/FejzUiv2cAiz5As2DJEQYEM10LvnmpnKx9Dq+QDo7WXnT6H2szRtX/8Q56Rlzp9bJMlZy7/i0xevlDrWZMWqx2IK3ZhO9+0nPu4z4SLXaoQGIrs7JxwIDAQAB"
-        
-        # 初始化OCR
-        self.ocr = ddddocr.DdddOcr()
-        self.max_attempts = 5
+        self.engine = get_login_engine()
+        self.headers = self.engine.headers
+        self.first_public_key = self.engine.first_public_key
+        self.max_attempts = self.engine.max_attempts
         
         # 设置日志
         self.setup_logging()
@@ -58,248 +50,207 @@ class LoginService:
         )
         self.logger = logging.getLogger("LoginService")
     
-    def save_log(self, account_id, level, message, details=None, is_success=False):
+    def save_log(self, account_id, level, message, details=None, is_success=False, params=None):
         """保存日志到数据库"""
-        try:
-            log = LoginLog(
-                account_id=account_id,
-                level=level,
-                message=message,
-                details=json.dumps(details) if details else None,
-                is_success=is_success
-            )
-            db.session.add(log)
-            db.session.commit()
-        except Exception as e:
-            self.logger.error(f"保存日志失败: {str(e)}")
+        save_log(account_id, level, message, details=details, is_success=is_success, params=params)
     
+    def _log_sink(self):
+        """返回可在引擎线程池中调用的日志回调（自动推入应用上下文）"""
+        app = current_app._get_current_object()
+
+        def sink(account_id, level, message, details=None, is_success=False, params=None):
+            with app.app_context():
+                self.save_log(account_id, level, message, details=details, is_success=is_success, params=params)
+
+        return sink
+
     def get_token(self):
         """获取token"""
-        url = "https://cmsapi3.qiucheng-wangluo.com/cms-api/token/generateCaptchaToken"
-        try:
-            response = self.session.post(url, headers=self.headers)
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("iErrCode") == 0:
-                    return result.get("result")
-            return None
-        except Exception as e:
-            self.logger.error(f"获取token失败: {str(e)}")
-            return None
+        return self.engine.run_sync(self.engine.get_token())
     
     def get_captcha(self, token):
         """获取验证码图片"""
-        url = "https://cmsapi3.qiucheng-wangluo.com/cms-api/captcha"
-        data = {"token": token}
-        try:
-            response = self.session.post(url, headers=self.headers, data=data)
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("iErrCode") == 0:
-                    return result.get("result")
-            return None
-        except Exception as e:
-            self.logger.error(f"获取验证码失败: {str(e)}")
-            return None
+        return self.engine.run_sync(self.engine.get_captcha(token))
     
     def recognize_captcha(self, captcha_base64):
         """识别验证码"""
-        try:
-            captcha_img = base64.b64decode(captcha_base64)
-            captcha_text = self.ocr.classification(captcha_img)
-            captcha_text = re.sub(r'[^a-zA-Z0-9]', '', captcha_text)
-            if len(captcha_text) > 4:
-                captcha_text = captcha_text[:4]
-            return captcha_text.upper()
-        except Exception as e:
-            self.logger.error(f"识别验证码失败: {str(e)}")
-            return None
+        return self.engine.run_sync(self.engine.recognize_captcha(captcha_base64))
+    
+    def recognize_captcha_candidates(self, captcha_base64):
+        """识别验证码，返回按置信度排序的候选"""
+        return self.engine.run_sync(self.engine.recognize_captcha_candidates(captcha_base64))
     
     def load_public_key(self, key_str):
         """加载公钥"""
-        try:
-            if "-----BEGIN" in key_str:
-                return serialization.load_pem_public_key(key_str.encode(), backend=default_backend())
-            else:
-                try:
-                    der_data = base64.b64decode(key_str)
-                    return serialization.load_der_public_key(der_data, backend=default_backend())
-                except:
-                    hex_str = re.sub(r'\s+', '', key_str)
-                    if len(hex_str) % 2 != 0:
-                        hex_str = '0' + hex_str
-                    der_data = bytes.fromhex(hex_str)
-                    return serialization.load_der_public_key(der_data, backend=default_backend())
-        except Exception as e:
-            self.logger.error(f"加载公钥失败: {str(e)}")
-            return None
+        return self.engine.load_public_key(key_str)
     
     def rsa_encrypt_long(self, text, public_key_str):
         """RSA加密长文本"""
-        try:
-            public_key = self.load_public_key(public_key_str)
-            if not public_key:
-                return None
-            
-            key_size = public_key.key_size // 8
-            max_block_size = key_size - 11
-            
-            encrypted_blocks = []
-            for i in range(0, len(text), max_block_size):
-                block = text[i:i + max_block_size]
-                encrypted_block = public_key.encrypt(
-                    block.encode('utf-8'),
-                    padding.PKCS1v15()
-                )
-                encrypted_blocks.append(encrypted_block)
-            
-            encrypted_data = b''.join(encrypted_blocks)
-            return base64.b64encode(encrypted_data).decode('utf-8')
-        except Exception as e:
-            self.logger.error(f"RSA加密失败: {str(e)}")
-            return None
+        return self.engine.rsa_encrypt_long(text, public_key_str)
     
     def login(self, account, password, captcha, token):
         """登录"""
-        url = "https://cmsapi3.qiucheng-wangluo.com/cms-api/login"
-        
-        # 双重加密
-        first_encrypted_password = self.rsa_encrypt_long(password, self.first_public_key)
-        if not first_encrypted_password:
-            return None
+        return self.engine.run_sync(self.engine.login(account, password, captcha, token))
+    
+    def login_account(self, account_id):
+        """登录指定账号"""
+        account = Account.query.get(account_id)
+        if not account:
+            return False, "账号不存在"
         
-        second_encrypted_password = self.rsa_encrypt_long(first_encrypted_password, token)
-        if not second_encrypted_password:
-            return None
+        result = self.engine.run_sync(self.engine.login_account(self._credentials(account), log=self._log_sink()))
+        self._save_login_result(account.id, result)
+        return result['success'], result['message']
+    
+    def login_attempt(self, account_id, attempt):
+        """只执行一次登录尝试，返回 (是否成功, 消息, 建议的重试等待秒数或None)"""
+        account = Account.query.get(account_id)
+        if not account:
+            return False, "账号不存在", None
         
-        encrypted_account = self.rsa_encrypt_long(account, token)
-        if not encrypted_account:
-            return None
+        result = self.engine.run_sync(self.engine.login_step(self._credentials(account), attempt, log=self._log_sink()))
+        self._save_login_result(account.id, result)
+        return result['success'], result['message'], result['retry_delay']
+    
+    def login_accounts(self, account_ids, concurrency=None, on_start=None, on_result=None):
+        """在同一事件循环上并发登录多个账号（包含重试），返回 {account_id: (是否成功, 消息)}
+
+        每个账号登录结束后立即在当前线程保存结果并调用 on_result(account_id, 是否成功, 消息)；
+        on_start(account_id) 在事件循环线程中调用。concurrency 为同时登录的账号数上限。
+        """
+        accounts = Account.query.filter(Account.id.in_(account_ids)).all()
+        credentials = [self._credentials(a) for a in accounts]
+        finished = queue.Queue()
+        future = self.engine.submit(self.engine.login_many(
+            credentials, log=self._log_sink(), concurrency=concurrency, on_start=on_start,
+            on_result=lambda account_id, result: finished.put((account_id, result))
+        ))
+        # 事件循环中的批次异常结束时唤醒等待，随后由 future.result() 抛出异常
+        future.add_done_callback(lambda f: (f.cancelled() or f.exception() is not None) and finished.put((None, None)))
         
-        data = {
-            "account": encrypted_account,
-            "data": second_encrypted_password,
-            "safeCode": captcha,
-            "token": token,
-            "locale": "zh"
-        }
+        summary = {account_id: (False, "账号不存在") for account_id in account_ids}
+        for _ in credentials:
+            account_id, result = finished.get()
+            if account_id is None:
+                break
+            self._save_login_result(account_id, result)
+            summary[account_id] = (result['success'], result['message'])
+            if on_result:
+                on_result(account_id, result['success'], result['message'])
+        future.result()
+        return summary
+    
+    def _credentials(self, account):
+        """构造登录凭据，附带仍在预计有效期内的已保存 token 以及是否需要刷新俱乐部信息"""
+        session_token = None
+        session = account.login_session
+        if Config.SESSION_REUSE_ENABLED and session and session.is_worth_probing():
+            session_token = session.token
+        club = account.club_info
+        refresh_club = club is None or not club.is_fresh(Config.CLUB_INFO_TTL_MINUTES)
+        return AccountCredentials(account.id, account.name, account.email, account.password,
+                                  session_token, refresh_club)
+    
+    def _save_login_result(self, account_id, result):
+        """保存登录结果中的尝试记录、会话和俱乐部信息"""
+        log_writer = get_log_writer()
+        for record in result.get('attempt_records', ()):
+            log_writer.write_attempt(record)
         
+        with LOGIN_STAGE_SECONDS.time(stage='db_write'):
+            self._update_session(account_id, result)
+            if result.get('club_info'):
+                self._update_club_info(account_id, result['club_info'])
+    
+    def _update_club_info(self, account_id, club_data):
+        """写入俱乐部信息缓存"""
         try:
-            response = self.session.post(url, headers=self.headers, data=data)
-            if response.status_code == 200:
-                return response.json()
-            return None
+            club = ClubInfo.query.filter_by(account_id=account_id).first()
+            if club is None:
+                club = ClubInfo(account_id=account_id)
+                db.session.add(club)
+            club.update_from(club_data)
+            db.session.commit()
+            return club
         except Exception as e:
-            self.logger.error(f"登录请求失败: {str(e)}")
+            db.session.rollback()
+            self.logger.error(f"保存俱乐部信息失败: {str(e)}")
             return None
     
-    def login_account(self, account_id):
-        """登录指定账号"""
+    def get_club_info(self, account_id, refresh=False):
+        """获取账号的俱乐部信息：缓存未过期时直接返回，过期或 refresh=True 时使用已保存的 token 重新获取
+        
+        返回 (俱乐部信息模型或None, 消息)
+        """
         account = Account.query.get(account_id)
         if not account:
-            return False, "账号不存在"
+            return None, "账号不存在"
         
-        self.save_log(account_id, "INFO", f"开始为账号 [{account.name}] 执行自动登录流程...")
+        club = account.club_info
+        if club and not refresh and club.is_fresh(Config.CLUB_INFO_TTL_MINUTES):
+            return club, "获取俱乐部信息成功"
         
-        for attempt in range(1, self.max_attempts + 1):
-            self.save_log(account_id, "INFO", f"尝试第 {attempt} 次登录 [{account.name}]...")
-            
-            # 获取token
-            token = self.get_token()
-            if not token:
-                self.save_log(account_id, "ERROR", "获取token失败，等待重试...")
-                time.sleep(2)
-                continue
-            
-            self.save_log(account_id, "INFO", f"获取token成功: {token[:20]}...")
-            
-            # 获取验证码
-            captcha_base64 = self.get_captcha(token)
-            if not captcha_base64:
-                self.save_log(account_id, "ERROR", "获取验证码失败，等待重试...")
-                time.sleep(2)
-                continue
-            
-            self.save_log(account_id, "INFO", "获取验证码成功")
-            
-            # 识别验证码
-            captcha_text = self.recognize_captcha(captcha_base64)
-            if not captcha_text or len(captcha_text) != 4:
-                self.save_log(account_id, "ERROR", f"验证码识别失败或格式不正确: {captcha_text}，等待重试...")
-                time.sleep(2)
-                continue
+        session = account.login_session
+        if not session or not session.is_worth_probing():
+            if club:
+                return club, "没有有效的登录会话，返回缓存的俱乐部信息"
+            return None, "没有有效的登录会话，请先登录账号"
+        
+        valid, club_data = self.engine.run_sync(
+            self.engine.probe_token(session.token, account.name, session_key=account.id)
+        )
+        if valid is None:
+            if club:
+                return club, "暂时无法验证登录会话，返回缓存的俱乐部信息"
+            return None, "暂时无法验证登录会话，请稍后重试"
+        if not valid:
+            self._update_session(account.id, {'success': False, 'session_expired': True})
+            if club:
+                return club, "登录会话已失效，返回缓存的俱乐部信息"
+            return None, "登录会话已失效，请重新登录账号"
+        
+        session.mark_validated()
+        db.session.commit()
+        if not club_data:
+            return club, "俱乐部列表为空"
+        return self._update_club_info(account.id, club_data), "俱乐部信息已刷新"
+    
+    def _update_session(self, account_id, result):
+        """根据登录结果更新账号的登录会话"""
+        if not Config.SESSION_REUSE_ENABLED:
+            return
+        
+        try:
+            now = datetime.utcnow()
+            session = AccountSession.query.filter_by(account_id=account_id).first()
             
-            self.save_log(account_id, "INFO", f"识别验证码结果: {captcha_text}")
+            if result.get('reused'):
+                session.mark_validated(now)
+                db.session.commit()
+                return
             
-            # 登录
-            login_result = self.login(account.email, account.password, captcha_text, token)
+            if session is None:
+                if not (result['success'] and result.get('token')):
+                    return
+                session = AccountSession(account_id=account_id)
+                db.session.add(session)
             
-            if login_result:
-                self.save_log(account_id, "INFO", f"登录结果: {json.dumps(login_result, ensure_ascii=False, indent=2)}")
-                
-                if login_result.get("iErrCode") == 0:
-                    self.save_log(account_id, "INFO", "登录成功!", is_success=True)
-                    self.save_log(account_id, "ERROR", "登录成功!", is_success=True)  # 同时记录到错误级别
-                    
-                    # 获取俱乐部列表
-                    club_info = self.get_club_list(token, account.name)
-                    if club_info:
-                        self.save_log(account_id, "INFO", "获取俱乐部列表成功")
-                    else:
-                        self.save_log(account_id, "ERROR", "获取俱乐部列表失败")
-                    
-                    return True, "登录成功"
-                else:
-                    error_msg = login_result.get("sErrMsg", "未知错误")
-                    self.save_log(account_id, "ERROR", f"登录失败: {error_msg}")
-                    
-                    if "验证码" in error_msg:
-                        self.save_log(account_id, "INFO", "验证码错误，立即重试...")
-                        time.sleep(1)
-                        continue
-            else:
-                self.save_log(account_id, "ERROR", "登录请求失败")
+            if result['success'] and result.get('token'):
+                lifetime = session.observed_lifetime_seconds or Config.SESSION_TOKEN_TTL_MINUTES * 60
+                session.token = result['token']
+                session.obtained_at = now
+                session.last_validated_at = now
+                session.expires_at = now + timedelta(seconds=lifetime)
+            elif result.get('session_expired'):
+                session.token = None
+                session.expires_at = None
+            # 其他失败（网络异常、限流等）无法判断已保存的 token 是否失效，保留原会话
             
-            if attempt < self.max_attempts:
-                wait_time = 2 ** attempt
-                self.save_log(account_id, "INFO", f"等待 {wait_time} 秒后重试...")
-                time.sleep(wait_time)
-        
-        self.save_log(account_id, "ERROR", f"已达到最大尝试次数 {self.max_attempts}，登录失败")
-        return False, "登录失败"
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            self.logger.error(f"保存登录会话失败: {str(e)}")
     
     def get_club_list(self, token, account_name="未知账号"):
         """获取俱乐部列表"""
-        url = "https://cmsapi3.qiucheng-wangluo.com/cms-api/club/getClubList"
-        
-        headers = {
-            "accept": "application/json, text/javascript",
-            "accept-language": "zh-CN,zh;q=0.9,en;q=0.8",
-            "content-type": "application/x-www-form-urlencoded; charset=UTF-8",
-            "sec-ch-ua": "\"Not)A;Brand\";v=\"8\", \"Chromium\";v=\"138\", \"Google Chrome\";v=\"138\"",
-            "sec-ch-ua-mobile": "?0",
-            "token": token,
-            "referrer": "https://cms.ayybyyy.com/"
-        }
-        
-        try:
-            response = requests.post(url, headers=headers)
-            if response.status_code == 200:
-                result = response.json()
-                if result.get("iErrCode") == 0:
-                    club_data = result.get("result")
-                    if isinstance(club_data, list) and len(club_data) > 0:
-                        club_info = club_data[0]
-                        club_id = club_info.get("lClubID")
-                        club_name = club_info.get("sClubName")
-                        create_user = club_info.get("lCreateUser")
-                        credit_league_id = club_info.get("iCreditLeagueId")
-                        
-                        self.logger.info(f"[{account_name}] 俱乐部信息: lClubID={club_id}, sClubName={club_name}, lCreateUser={create_user}, iCreditLeagueId={credit_league_id}")
-                        return club_info
-                    elif isinstance(club_data, dict):
-                        return club_data
-            return None
-        except Exception as e:
-            self.logger.error(f"获取俱乐部列表失败: {str(e)}")
-            return None
\ No newline at end of file
+        return self.engine.run_sync(self.engine.get_club_list(token, account_name))
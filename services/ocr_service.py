@@ -0,0 +1,484 @@
+import logging
+import multiprocessing
+import os
+import queue
+import re
+import threading
+import time
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import ddddocr
+import numpy as np
+from config import Config
+
+# ddddocr 字符范围：大小写字母+数字（用于概率输出）
+ALNUM_RANGE = 6
+CAPTCHA_LENGTH = 4
+
+
+def create_ocr():
+    """创建 ddddocr 实例，并把概率输出限制在字母和数字范围内"""
+    ocr = ddddocr.DdddOcr(show_ad=False)
+    if hasattr(ocr, 'set_ranges'):
+        ocr.set_ranges(ALNUM_RANGE)
+    return ocr
+
+
+def normalize_captcha(captcha_text, length=CAPTCHA_LENGTH):
+    """去掉非字母数字字符，截取前 length 位并转为大写"""
+    captcha_text = re.sub(r'[^a-zA-Z0-9]', '', captcha_text or '')
+    if len(captcha_text) > length:
+        captcha_text = captcha_text[:length]
+    return captcha_text.upper()
+
+
+def decode_candidates(result, length=CAPTCHA_LENGTH, top_n=3):
+    """从 ddddocr 的逐帧概率输出中解码出按置信度排序的候选验证码
+
+    大小写合并计算（验证码不区分大小写），先按 CTC 贪心路径得到最优结果，
+    再把各位置替换为该帧的次优字符生成备选；置信度为各字符概率之积。
+    返回 [(验证码文本, 置信度)]。
+    """
+    charsets = result['charsets']
+    probability = np.asarray(result['probability'], dtype=np.float64)
+    if probability.ndim == 1:
+        probability = probability[np.newaxis, :]
+
+    # 合并大小写，第0列为空白符
+    labels = ['']
+    columns = {'': 0}
+    mapping = []
+    for char in charsets:
+        label = char.upper() if char and char.isascii() and char.isalnum() else ''
+        if label not in columns:
+            columns[label] = len(labels)
+            labels.append(label)
+        mapping.append(columns[label])
+    merged = np.zeros((probability.shape[0], len(labels)))
+    for index, column in enumerate(mapping):
+        merged[:, column] += np.clip(probability[:, index], 0, None)
+
+    # CTC 贪心解码：合并连续重复字符并去掉空白符
+    best = merged.argmax(axis=1)
+    chars = []
+    previous = 0
+    for frame, column in enumerate(best):
+        if column != previous and column != 0:
+            chars.append({'frame': frame, 'column': column, 'prob': merged[frame, column]})
+        elif column == previous and column != 0 and merged[frame, column] > chars[-1]['prob']:
+            chars[-1].update(frame=frame, prob=merged[frame, column])
+        previous = column
+
+    # 字符过多时去掉置信度最低的字符
+    while len(chars) > length:
+        chars.remove(min(chars, key=lambda item: item['prob']))
+    if len(chars) != length:
+        text = ''.join(labels[item['column']] for item in chars)
+        return [(text, 0.0)] if text else []
+
+    base_text = [labels[item['column']] for item in chars]
+    base_score = float(np.prod([max(item['prob'], 1e-9) for item in chars]))
+    candidates = [(''.join(base_text), base_score)]
+
+    for position, item in enumerate(chars):
+        row = merged[item['frame']].copy()
+        row[0] = 0
+        row[item['column']] = 0
+        alternative = int(row.argmax())
+        if row[alternative] <= 0:
+            continue
+        text = list(base_text)
+        text[position] = labels[alternative]
+        candidates.append((''.join(text), base_score / max(item['prob'], 1e-9) * row[alternative]))
+
+    candidates.sort(key=lambda candidate: candidate[1], reverse=True)
+    return [(text, round(float(score), 4)) for text, score in candidates[:top_n]]
+
+
+def recognize_candidates(ocr, img_bytes, top_n=3):
+    """识别验证码并返回候选列表；ddddocr 不支持概率输出时仅返回最优结果（置信度为 None）"""
+    try:
+        result = ocr.classification(img_bytes, probability=True)
+    except TypeError:
+        result = None
+    if isinstance(result, dict):
+        return decode_candidates(result, top_n=top_n)
+
+    text = normalize_captcha(ocr.classification(img_bytes))
+    return [(text, None)] if text else []
+
+class SharedOcr:
+    """进程内共享的OCR引擎
+
+    第一次识别时才加载 ddddocr 模型，之后所有服务共用同一组模型实例；
+    实例数量由 OCR_POOL_SIZE 控制，多个线程可同时识别。
+    """
+
+    def __init__(self, pool_size=None):
+        self.pool_size = pool_size or Config.OCR_POOL_SIZE
+        self.logger = logging.getLogger("LoginService")
+
+        self._instances = queue.Queue()
+        self._load_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+        self._loaded = False
+
+        self.load_time = None
+        self.inferences = 0
+        self.errors = 0
+        self.total_inference_time = 0.0
+        self.max_inference_time = 0.0
+        self.last_inference_time = None
+
+    def _ensure_loaded(self):
+        """延迟加载模型（只加载一次）"""
+        if self._loaded:
+            return
+        with self._load_lock:
+            if self._loaded:
+                return
+            start = time.perf_counter()
+            for _ in range(self.pool_size):
+                self._instances.put(create_ocr())
+            self.load_time = time.perf_counter() - start
+            self._loaded = True
+            self.logger.info(f"OCR模型加载完成，实例数 {self.pool_size}，耗时 {self.load_time:.3f} 秒")
+
+    def _run(self, func, img_bytes):
+        """取出一个模型实例执行识别，并记录耗时"""
+        self._ensure_loaded()
+        ocr = self._instances.get()
+        start = time.perf_counter()
+        try:
+            result = func(ocr, img_bytes)
+        except Exception:
+            with self._stats_lock:
+                self.errors += 1
+            raise
+        finally:
+            self._instances.put(ocr)
+
+        elapsed = time.perf_counter() - start
+        with self._stats_lock:
+            self.inferences += 1
+            self.total_inference_time += elapsed
+            self.last_inference_time = elapsed
+            if elapsed > self.max_inference_time:
+                self.max_inference_time = elapsed
+        return result
+
+    def classification(self, img_bytes):
+        """识别验证码图片，返回原始识别文本"""
+        return self._run(lambda ocr, img: ocr.classification(img), img_bytes)
+
+    def classify_candidates(self, img_bytes, top_n=3):
+        """识别验证码图片，返回按置信度排序的候选 [(验证码文本, 置信度)]"""
+        return self._run(lambda ocr, img: recognize_candidates(ocr, img, top_n), img_bytes)
+
+    def get_stats(self):
+        """获取模型加载时间及识别耗时统计（毫秒）"""
+        with self._stats_lock:
+            return {
+                'loaded': self._loaded,
+                'pool_size': self.pool_size,
+                'load_time_ms': round(self.load_time * 1000, 2) if self.load_time is not None else None,
+                'inferences': self.inferences,
+                'errors': self.errors,
+                'avg_inference_ms': round(self.total_inference_time / self.inferences * 1000, 2) if self.inferences else None,
+                'max_inference_ms': round(self.max_inference_time * 1000, 2) if self.inferences else None,
+                'last_inference_ms': round(self.last_inference_time * 1000, 2) if self.last_inference_time is not None else None
+            }
+
+
+class CandidateStats:
+    """候选验证码命中统计
+
+    记录每个候选名次的尝试与命中次数。以下两种情况计为节省的网络往返（估算）：
+    低置信度验证码在登录前被丢弃，省下一次登录请求；非首选候选登录成功，
+    省下重新获取 token 和验证码的两次请求。提交非首选候选时验证码已被作废，
+    则这次登录请求计为浪费的网络往返。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.tried = {}
+        self.hits = {}
+        self.discarded = 0
+        self.successes = 0
+        self.saved_round_trips = 0
+        self.wasted_round_trips = 0
+
+    def record_discard(self):
+        """记录一次因置信度过低而丢弃的验证码"""
+        with self._lock:
+            self.discarded += 1
+            self.saved_round_trips += 1
+
+    def record_consumed(self):
+        """记录一次提交到已作废验证码上的候选（登录请求不可能成功）"""
+        with self._lock:
+            self.wasted_round_trips += 1
+
+    def record_result(self, rank, success):
+        """记录第 rank 个候选（从0开始）的登录结果"""
+        with self._lock:
+            self.tried[rank] = self.tried.get(rank, 0) + 1
+            if success:
+                self.hits[rank] = self.hits.get(rank, 0) + 1
+                self.successes += 1
+                if rank > 0:
+                    self.saved_round_trips += 2
+
+    def get_stats(self):
+        with self._lock:
+            ranks = []
+            for rank in sorted(self.tried):
+                tried = self.tried[rank]
+                hits = self.hits.get(rank, 0)
+                ranks.append({'rank': rank + 1, 'tried': tried, 'hits': hits, 'hit_rate': round(hits / tried, 4)})
+            return {
+                'ranks': ranks,
+                'discarded_low_confidence': self.discarded,
+                'successes': self.successes,
+                'saved_round_trips': self.saved_round_trips,
+                'wasted_round_trips': self.wasted_round_trips,
+                'saved_round_trips_per_success': round(
+                    (self.saved_round_trips - self.wasted_round_trips) / self.successes, 2
+                ) if self.successes else None
+            }
+
+
+# 工作进程内的OCR实例（由 _init_worker 在每个工作进程中创建）
+_worker_ocr = None
+
+
+def _init_worker():
+    global _worker_ocr
+    _worker_ocr = create_ocr()
+
+
+def _classify_batch(images, top_n):
+    """在工作进程中识别一批图片，返回 [(候选列表, 错误信息)]"""
+    results = []
+    for img in images:
+        try:
+            results.append((recognize_candidates(_worker_ocr, img, top_n), None))
+        except Exception as e:
+            results.append((None, str(e)))
+    return results
+
+
+class OcrWorkerPool:
+    """进程池OCR服务
+
+    调用方（调度线程或事件循环）提交验证码图片并得到候选列表的 Future；后台分发线程把
+    短时间内到达的图片合并为微批次，再交给工作进程识别，以摊薄进程间通信开销，
+    识别过程也不再占用主进程的GIL。
+
+    工作进程以 fork 方式创建，并在 start() 时立即拉起，因此应在启动调度器等
+    后台线程之前创建进程池。工作进程意外退出（OOM、被杀）后进程池不可再用，
+    分发线程会让受影响批次的 Future 以异常结束，并重新创建进程池。
+    """
+
+    def __init__(self, workers=None, batch_size=None, batch_wait_ms=None, top_n=None):
+        self.workers = workers or Config.OCR_WORKERS or os.cpu_count() or 1
+        self.top_n = top_n or Config.CAPTCHA_CANDIDATES
+        self.batch_size = batch_size or Config.OCR_BATCH_SIZE
+        self.batch_wait = (batch_wait_ms if batch_wait_ms is not None else Config.OCR_BATCH_WAIT_MS) / 1000.0
+        self.logger = logging.getLogger("LoginService")
+
+        self._queue = queue.Queue()
+        self._executor = None
+        self._dispatcher = None
+        self._start_lock = threading.Lock()
+        self._executor_lock = threading.Lock()
+        self._stats_lock = threading.Lock()
+
+        self.load_time = None
+        self.submitted = 0
+        self.completed = 0
+        self.errors = 0
+        self.batches = 0
+        self.restarts = 0
+        self.total_inference_time = 0.0
+
+    def _create_executor(self):
+        return ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('fork'),
+            initializer=_init_worker
+        )
+
+    def start(self):
+        """启动工作进程和分发线程（重复调用无副作用）"""
+        with self._start_lock:
+            if self._executor is not None:
+                return
+            start = time.perf_counter()
+            self._executor = self._create_executor()
+            # 预热：确保所有工作进程已创建并加载模型
+            warmups = [self._executor.submit(_classify_batch, [], self.top_n) for _ in range(self.workers)]
+            for future in warmups:
+                future.result()
+            self.load_time = time.perf_counter() - start
+
+            self._dispatcher = threading.Thread(target=self._dispatch_loop, name='ocr-dispatcher', daemon=True)
+            self._dispatcher.start()
+            self.logger.info(f"OCR进程池已启动，进程数 {self.workers}，耗时 {self.load_time:.3f} 秒")
+
+    def submit(self, img_bytes):
+        """提交一张验证码图片，返回候选列表 [(验证码文本, 置信度)] 的 Future"""
+        self.start()
+        future = Future()
+        with self._stats_lock:
+            self.submitted += 1
+        self._queue.put((img_bytes, future))
+        return future
+
+    def _dispatch_loop(self):
+        """把排队的图片合并为微批次并提交给工作进程"""
+        while True:
+            item = self._queue.get()
+            if item is None:
+                return
+
+            batch = [item]
+            stopping = False
+            deadline = time.monotonic() + self.batch_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self._queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is None:
+                    stopping = True
+                    break
+                batch.append(item)
+
+            try:
+                self._submit_batch(batch)
+            except Exception as e:
+                # 分发线程退出后所有排队和后续的识别请求都不会再完成，因此这里不能抛出异常
+                self.logger.error(f"提交OCR批次失败: {str(e)}")
+                self._fail_batch(batch, e)
+            if stopping:
+                return
+
+    def _fail_batch(self, batch, error):
+        """让整个批次的 Future 以异常结束"""
+        for _, future in batch:
+            if not future.done():
+                future.set_exception(error)
+        with self._stats_lock:
+            self.errors += len(batch)
+
+    def _restart_executor(self, broken):
+        """替换已损坏的进程池（只替换一次，其他批次的回调可能已经替换过）"""
+        with self._executor_lock:
+            if broken is None or self._executor is not broken:
+                return
+            self._executor = self._create_executor()
+            with self._stats_lock:
+                self.restarts += 1
+        broken.shutdown(wait=False, cancel_futures=True)
+        self.logger.warning("OCR工作进程异常退出，已重新创建进程池")
+
+    def _submit_batch(self, batch):
+        images = [img for img, _ in batch]
+        futures = [future for _, future in batch]
+        started = time.perf_counter()
+
+        def resolve(done):
+            elapsed = time.perf_counter() - started
+            try:
+                results = done.result()
+            except BrokenProcessPool as e:
+                # 执行中的工作进程退出：重建进程池，后续批次不受影响
+                self._restart_executor(executor)
+                results = [(None, str(e) or '工作进程异常退出')] * len(futures)
+            except Exception as e:
+                results = [(None, str(e))] * len(futures)
+
+            errors = 0
+            for future, (candidates, error) in zip(futures, results):
+                if future.done():
+                    # 调用方等待超时后已取消
+                    continue
+                if error is None:
+                    future.set_result(candidates)
+                else:
+                    errors += 1
+                    future.set_exception(RuntimeError(error))
+
+            with self._stats_lock:
+                self.batches += 1
+                self.completed += len(futures) - errors
+                self.errors += errors
+                self.total_inference_time += elapsed
+
+        executor = self._executor
+        try:
+            future = executor.submit(_classify_batch, images, self.top_n)
+        except BrokenProcessPool as e:
+            self._restart_executor(executor)
+            self._fail_batch(batch, e)
+            return
+        future.add_done_callback(resolve)
+
+    def shutdown(self):
+        """停止分发线程并关闭工作进程"""
+        with self._start_lock:
+            if self._executor is None:
+                return
+            self._queue.put(None)
+            self._dispatcher.join()
+            with self._executor_lock:
+                executor, self._executor = self._executor, None
+            executor.shutdown(wait=True)
+            self._dispatcher = None
+
+    def get_stats(self):
+        """获取进程池统计信息"""
+        with self._stats_lock:
+            return {
+                'workers': self.workers,
+                'batch_size': self.batch_size,
+                'batch_wait_ms': round(self.batch_wait * 1000, 2),
+                'load_time_ms': round(self.load_time * 1000, 2) if self.load_time is not None else None,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'errors': self.errors,
+                'pending': self._queue.qsize(),
+                'batches': self.batches,
+                'restarts': self.restarts,
+                'avg_batch_size': round((self.completed + self.errors) / self.batches, 2) if self.batches else None,
+                'avg_batch_ms': round(self.total_inference_time / self.batches * 1000, 2) if self.batches else None
+            }
+
+
+_shared_ocr = None
+_shared_ocr_lock = threading.Lock()
+_worker_pool = None
+_worker_pool_lock = threading.Lock()
+
+
+def get_shared_ocr():
+    """获取进程内共享的OCR引擎"""
+    global _shared_ocr
+    with _shared_ocr_lock:
+        if _shared_ocr is None:
+            _shared_ocr = SharedOcr()
+        return _shared_ocr
+
+
+def get_ocr_worker_pool():
+    """获取进程内共享的OCR进程池"""
+    global _worker_pool
+    with _worker_pool_lock:
+        if _worker_pool is None:
+            _worker_pool = OcrWorkerPool()
+        return _worker_pool
@@ -0,0 +1,194 @@
+import asyncio
+import threading
+import time
+from config import Config
+
+try:
+    import fcntl
+except ImportError:  # Windows 下不支持文件锁，退化为进程内限流
+    fcntl = None
+
+class CircuitOpenError(Exception):
+    """熔断器处于打开状态，请求被直接拒绝"""
+
+
+class TokenBucket:
+    """令牌桶限流器
+
+    进程内所有线程共享同一个令牌桶；配置了状态文件时，令牌数保存在文件中并通过
+    文件锁同步，多个进程（例如多个 gunicorn worker）共用同一个速率上限。
+    rate 为每秒补充的令牌数，为 0 时不限流。
+    """
+
+    def __init__(self, rate=None, capacity=None, state_file=None):
+        self.rate = Config.CMS_RATE_LIMIT if rate is None else rate
+        self.capacity = capacity or Config.CMS_RATE_BURST or max(1, self.rate)
+        self.state_file = state_file if state_file is not None else Config.CMS_RATE_LIMIT_STATE_FILE
+        if fcntl is None:
+            self.state_file = None
+
+        self._tokens = float(self.capacity)
+        self._updated = time.time()
+        self._lock = threading.Lock()
+        self.acquired = 0
+        self.throttled = 0
+        self.total_wait = 0.0
+
+    @property
+    def enabled(self):
+        return self.rate > 0
+
+    def _refill_and_take(self, tokens, updated, now):
+        """补充令牌并尝试取出一个，返回 (剩余令牌数, 需要等待的秒数)"""
+        tokens = min(self.capacity, tokens + max(0.0, now - updated) * self.rate)
+        if tokens >= 1:
+            return tokens - 1, 0.0
+        return tokens, (1 - tokens) / self.rate
+
+    def _take_shared(self, now):
+        """在文件锁保护下读写共享的令牌状态"""
+        with open(self.state_file, 'a+') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                f.seek(0)
+                parts = f.read().split()
+                if len(parts) == 2:
+                    tokens, updated = float(parts[0]), float(parts[1])
+                else:
+                    tokens, updated = float(self.capacity), now
+                tokens, wait = self._refill_and_take(tokens, updated, now)
+                f.seek(0)
+                f.truncate()
+                f.write(f"{tokens} {now}")
+                f.flush()
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+        return wait
+
+    def _take(self):
+        """尝试取出一个令牌，返回需要等待的秒数（0 表示已取得）"""
+        now = time.time()
+        with self._lock:
+            if self.state_file:
+                return self._take_shared(now)
+            self._tokens, wait = self._refill_and_take(self._tokens, self._updated, now)
+            self._updated = now
+            return wait
+
+    async def acquire(self):
+        """等待直到取得一个令牌，返回累计等待的秒数"""
+        if not self.enabled:
+            return 0.0
+
+        waited = 0.0
+        while True:
+            wait = self._take()
+            if wait <= 0:
+                break
+            waited += wait
+            await asyncio.sleep(wait)
+
+        with self._lock:
+            self.acquired += 1
+            if waited > 0:
+                self.throttled += 1
+                self.total_wait += waited
+        return waited
+
+    def get_stats(self):
+        """获取限流器统计信息"""
+        with self._lock:
+            return {
+                'enabled': self.enabled,
+                'rate_per_second': self.rate,
+                'capacity': self.capacity,
+                'shared_state_file': self.state_file,
+                'tokens': round(self._tokens, 2) if not self.state_file else None,
+                'acquired': self.acquired,
+                'throttled': self.throttled,
+                'total_wait_seconds': round(self.total_wait, 3)
+            }
+
+
+class CircuitBreaker:
+    """熔断器
+
+    连续失败次数达到阈值后打开，打开期间直接拒绝请求；经过恢复时间后进入半开状态，
+    只放行一个探测请求：成功则关闭，失败则重新打开。
+    """
+
+    CLOSED = 'closed'
+    OPEN = 'open'
+    HALF_OPEN = 'half_open'
+
+    def __init__(self, failure_threshold=None, recovery_timeout=None):
+        self.failure_threshold = failure_threshold or Config.CIRCUIT_FAILURE_THRESHOLD
+        self.recovery_timeout = recovery_timeout or Config.CIRCUIT_RECOVERY_SECONDS
+
+        self.state = self.CLOSED
+        self.consecutive_failures = 0
+        self.opened_at = None
+        self._probe_in_flight = False
+        self._lock = threading.Lock()
+        self.trips = 0
+        self.rejected = 0
+        self.successes = 0
+        self.failures = 0
+
+    def allow(self):
+        """判断是否放行本次请求"""
+        with self._lock:
+            if self.state == self.OPEN:
+                if time.monotonic() - self.opened_at < self.recovery_timeout:
+                    self.rejected += 1
+                    return False
+                self.state = self.HALF_OPEN
+                self._probe_in_flight = False
+
+            if self.state == self.HALF_OPEN:
+                if self._probe_in_flight:
+                    self.rejected += 1
+                    return False
+                self._probe_in_flight = True
+            return True
+
+    def record_success(self):
+        with self._lock:
+            self.successes += 1
+            self.consecutive_failures = 0
+            self._probe_in_flight = False
+            self.state = self.CLOSED
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            self.consecutive_failures += 1
+            self._probe_in_flight = False
+            if self.state == self.HALF_OPEN or self.consecutive_failures >= self.failure_threshold:
+                if self.state != self.OPEN:
+                    self.trips += 1
+                self.state = self.OPEN
+                self.opened_at = time.monotonic()
+
+    def retry_after(self):
+        """距离进入半开状态还需等待的秒数"""
+        with self._lock:
+            if self.state != self.OPEN:
+                return 0.0
+            return max(0.0, self.recovery_timeout - (time.monotonic() - self.opened_at))
+
+    def get_stats(self):
+        """获取熔断器统计信息"""
+        retry_after = self.retry_after()
+        with self._lock:
+            return {
+                'state': self.state,
+                'consecutive_failures': self.consecutive_failures,
+                'failure_threshold': self.failure_threshold,
+                'recovery_timeout': self.recovery_timeout,
+                'retry_after_seconds': round(retry_after, 1),
+                'trips': self.trips,
+                'rejected': self.rejected,
+                'successes': self.successes,
+                'failures': self.failures
+            }
@@ -1,17 +1,27 @@
 from apscheduler.schedulers.background import BackgroundScheduler
 from apscheduler.triggers.interval import IntervalTrigger
 from apscheduler.triggers.cron import CronTrigger
+from apscheduler.triggers.date import DateTrigger
+from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_MAX_INSTANCES, EVENT_JOB_MISSED
 from datetime import datetime, timedelta
 import logging
+import random
+import threading
+import time
+from config import Config
 from models import db, Account, Schedule
 from .login_service import LoginService
 from .email_service import EmailService
+from .metrics import LOGIN_DURATION_SECONDS, SCHEDULER_JOBS_IN_FLIGHT
 
 class SchedulerService:
     def __init__(self, app=None):
         self.scheduler = BackgroundScheduler()
         self.login_service = LoginService()
         self.app = app
+        # 正在等待延迟重试的账号 → 重试任务ID，定时任务触发时跳过这些账号
+        self.pending_retries = {}
+        self.retry_lock = threading.Lock()
         if app:
             self.init_app(app)
     
@@ -20,6 +30,10 @@ class SchedulerService:
         self.app = app
         self.scheduler.configure(job_defaults={'max_instances': 3})
         
+        # 重试任务错过执行时间、因实例数上限被丢弃或执行出错时释放账号，避免定时任务一直被跳过
+        self.scheduler.add_listener(self._on_retry_job_dropped,
+                                    EVENT_JOB_MISSED | EVENT_JOB_MAX_INSTANCES | EVENT_JOB_ERROR)
+        
         # 启动调度器
         self.scheduler.start()
         
@@ -50,7 +64,7 @@ class SchedulerService:
             trigger = IntervalTrigger(minutes=interval_minutes)
             
             self.scheduler.add_job(
-                func=self._execute_login_task,
+                func=self._execute_scheduled_login,
                 trigger=trigger,
                 id=job_id,
                 args=[account_id],
@@ -93,6 +107,7 @@ class SchedulerService:
             # 停止任务
             if self.scheduler.get_job(job_id):
                 self.scheduler.remove_job(job_id)
+            self._cancel_retry(account_id)
             
             # 更新数据库中的任务状态
             schedule = Schedule.query.filter_by(account_id=account_id).first()
@@ -117,6 +132,7 @@ class SchedulerService:
             if job:
                 # 任务存在，暂停任务
                 self.scheduler.pause_job(job_id)
+                self._cancel_retry(account_id)
                 
                 # 更新数据库
                 schedule = Schedule.query.filter_by(account_id=account_id).first()
@@ -147,9 +163,9 @@ class SchedulerService:
             return False, f"执行登录任务失败: {str(e)}"
     
     def _execute_login_task(self, account_id):
-        """执行登录任务（内部方法）"""
+        """执行完整的登录流程（包含重试），用于手动登录和批量登录（内部方法）"""
         try:
-            with self.app.app_context():
+            with SCHEDULER_JOBS_IN_FLIGHT.track_inprogress(job='manual_login'), self.app.app_context():
                 account = Account.query.get(account_id)
                 if not account:
                     return False, "账号不存在"
@@ -170,6 +186,90 @@ class SchedulerService:
         except Exception as e:
             return False, f"执行登录任务时发生错误: {str(e)}"
     
+    def _execute_scheduled_login(self, account_id):
+        """定时任务入口：上一次登录仍在等待重试时跳过本次运行（内部方法）"""
+        with self.retry_lock:
+            if account_id in self.pending_retries:
+                return False, "上一次登录仍在等待重试，跳过本次运行"
+        return self._execute_login_attempt(account_id, 1, time.monotonic())
+    
+    def _execute_login_attempt(self, account_id, attempt, started=None):
+        """执行一次登录尝试，失败时安排延迟重试任务，不在工作线程中等待（内部方法）
+
+        started 为第 1 次尝试开始的时刻（time.monotonic()），随重试任务传递，登录结束时据此记录完整登录耗时。
+        """
+        if started is None:
+            started = time.monotonic()
+        retry_scheduled = False
+        try:
+            with SCHEDULER_JOBS_IN_FLIGHT.track_inprogress(job='login'), self.app.app_context():
+                account = Account.query.get(account_id)
+                if not account or not account.is_active:
+                    self._finish_retry(account_id)
+                    return False, "账号不存在" if not account else "账号已禁用"
+                
+                success, message, retry_delay = self.login_service.login_attempt(account_id, attempt)
+                
+                if retry_delay is not None:
+                    self._schedule_retry(account_id, attempt + 1, retry_delay, started)
+                    retry_scheduled = True
+                else:
+                    self._finish_retry(account_id)
+                    LOGIN_DURATION_SECONDS.observe(time.monotonic() - started,
+                                                   result='success' if success else 'failed')
+                
+                # 如果登录成功且启用了邮件通知，发送邮件
+                if success and account.email_notification:
+                    email_service = EmailService()
+                    email_service.send_login_success_email(account_id)
+                
+                return success, message
+                
+        except Exception as e:
+            # 已安排的重试任务仍会执行，此时不能释放账号
+            if not retry_scheduled:
+                self._finish_retry(account_id)
+                LOGIN_DURATION_SECONDS.observe(time.monotonic() - started, result='failed')
+            return False, f"执行登录任务时发生错误: {str(e)}"
+    
+    def _schedule_retry(self, account_id, attempt, delay, started=None):
+        """以一次性任务的形式安排第 attempt 次登录尝试（指数退避 + 随机抖动）"""
+        delay += random.uniform(0, Config.LOGIN_RETRY_JITTER_SECONDS)
+        # 每次尝试使用不同的任务ID：重试任务在运行中安排下一次尝试时，不会因 max_instances 被调度器丢弃
+        job_id = f"account_{account_id}_retry_{attempt}"
+        with self.retry_lock:
+            self.pending_retries[account_id] = job_id
+        
+        self.scheduler.add_job(
+            func=self._execute_login_attempt,
+            trigger=DateTrigger(run_date=datetime.now() + timedelta(seconds=delay)),
+            id=job_id,
+            kwargs={'account_id': account_id, 'attempt': attempt, 'started': started},
+            name=f"账号{account_id}_第{attempt}次重试",
+            replace_existing=True,
+            max_instances=1,
+            misfire_grace_time=60
+        )
+        if Config.VERBOSE_LOGIN_LOGS:
+            self.login_service.save_log(account_id, "INFO", 'retry_scheduled',
+                                        params={'delay': round(delay, 1), 'attempt': attempt})
+    
+    def _finish_retry(self, account_id, job_id=None):
+        """释放等待重试的账号；指定 job_id 时仅当账号等待的正是该任务才释放"""
+        with self.retry_lock:
+            if job_id is None or self.pending_retries.get(account_id) == job_id:
+                return self.pending_retries.pop(account_id, None)
+    
+    def _on_retry_job_dropped(self, event):
+        if '_retry_' in event.job_id:
+            self._finish_retry(int(event.job_id.split('_')[1]), event.job_id)
+    
+    def _cancel_retry(self, account_id):
+        """取消账号尚未执行的重试任务"""
+        job_id = self._finish_retry(account_id)
+        if job_id and self.scheduler.get_job(job_id):
+            self.scheduler.remove_job(job_id)
+    
     def add_daily_log_job(self):
         """添加每日日志邮件任务"""
         try:
@@ -191,7 +291,7 @@ class SchedulerService:
     def _execute_daily_log_task(self):
         """执行每日日志邮件任务（内部方法）"""
         try:
-            with self.app.app_context():
+            with SCHEDULER_JOBS_IN_FLIGHT.track_inprogress(job='daily_log'), self.app.app_context():
                 email_service = EmailService()
                 success, message = email_service.send_daily_log_email()
                 return success, message
@@ -213,8 +313,18 @@ class SchedulerService:
     def get_account_job_status(self, account_id):
         """获取账号任务状态"""
         job_id = f"account_{account_id}_login"
-        job = self.scheduler.get_job(job_id)
-        
+        return self._job_status(self.scheduler.get_job(job_id))
+    
+    def get_account_job_statuses(self, account_ids):
+        """一次读取调度器中的全部任务，返回 {账号ID: 任务状态}"""
+        jobs = {job.id: job for job in self.scheduler.get_jobs()}
+        return {
+            account_id: self._job_status(jobs.get(f"account_{account_id}_login"))
+            for account_id in account_ids
+        }
+    
+    @staticmethod
+    def _job_status(job):
         if job:
             return {
                 'active': True,
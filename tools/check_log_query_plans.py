@@ -0,0 +1,241 @@
+"""登录日志查询计划检查
+
+在临时 SQLite 数据库中写入大量日志（默认 100 万行）、登录尝试记录和由它们重建的每日统计，
+对 /api/accounts、/api/logs、/api/logs/clear 和邮件中使用的查询执行 EXPLAIN QUERY PLAN，确认每个查询
+都命中索引、没有全表扫描或临时排序，并输出各查询的实际耗时；同时检查序列化一页 /api/logs 只执行
+一条 SQL（没有逐行加载账号的 N+1 查询），以及补建全文索引后能按 sErrMsg 检索到登录尝试记录。任一检查失败时以非零状态码退出：
+
+    python -m tools.check_log_query_plans --rows 1000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+from flask import Flask
+from sqlalchemy import delete, event, func, select, text, tuple_
+from sqlalchemy.dialects import sqlite
+
+from models import db, Account, DailyAccountStats, LoginAttempt, LoginLog, ensure_indexes
+from services.daily_stats import rebuild_daily_stats
+from services.log_pagination import log_list_query, paginate_logs
+from services.log_search import LogSearch
+
+LEVELS = ('INFO', 'INFO', 'INFO', 'ERROR', 'WARNING')
+ERROR_MESSAGES = ('验证码错误', '验证码错误', '验证码错误', '账号或密码错误', '账号已被冻结')
+# 允许按主键顺序扫描的表：/api/accounts 按账号 id 分页，LIMIT 之后即停止
+PRIMARY_KEY_SCANS = ('account',)
+# 每条登录尝试记录对应的日志行数（默认配置下每次尝试只写入少量日志）
+LOGS_PER_ATTEMPT = 4
+
+
+def create_app(db_file):
+    app = Flask(__name__)
+    app.config['SQLALCHEMY_DATABASE_URI'] = f"sqlite:///{db_file}"
+    app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+    db.init_app(app)
+    return app
+
+
+def populate(rows, accounts, days, chunk=50000):
+    """按时间顺序写入模拟日志和登录尝试记录，并由登录尝试记录重建每日统计"""
+    db.session.add_all([Account(name=f"acc{i}", email=f"acc{i}@example.com", password='x') for i in range(accounts)])
+    db.session.commit()
+
+    rng = random.Random(0)
+    start = datetime.utcnow() - timedelta(days=days)
+    step = timedelta(days=days) / rows
+    table = LoginLog.__table__
+    for offset in range(0, rows, chunk):
+        batch = []
+        for i in range(offset, min(rows, offset + chunk)):
+            batch.append({
+                'account_id': rng.randint(1, accounts),
+                'level': rng.choice(LEVELS),
+                'message': '登录成功!' if i % 20 == 0 else f"尝试第 {i % 5 + 1} 次登录...",
+                'details': None,
+                'is_success': i % 20 == 0,
+                'created_at': start + step * i
+            })
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+
+    attempts = rows // LOGS_PER_ATTEMPT
+    step = timedelta(days=days) / max(attempts, 1)
+    table = LoginAttempt.__table__
+    for offset in range(0, attempts, chunk):
+        batch = []
+        for i in range(offset, min(attempts, offset + chunk)):
+            success = i % 5 == 0
+            batch.append({
+                'account_id': rng.randint(1, accounts),
+                'attempt': i % 5 + 1,
+                'outcome': 'success' if success else 'captcha_rejected',
+                'is_success': success,
+                'error_code': 0 if success else 1,
+                'error_message': None if success else rng.choice(ERROR_MESSAGES),
+                'candidates_tried': 1,
+                'prefetched': False,
+                'duration_ms': rng.randint(200, 2000),
+                'created_at': start + step * i
+            })
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+    return rebuild_daily_stats()
+
+
+def account_listing(today, page=1, per_page=20):
+    """与 /api/accounts 一致的账号列表：账号关联今日统计，按 id 分页"""
+    return select(Account, DailyAccountStats).outerjoin(
+        DailyAccountStats, (DailyAccountStats.account_id == Account.id) & (DailyAccountStats.day == today)
+    ).order_by(Account.id).offset((page - 1) * per_page).limit(per_page)
+
+
+def hot_queries(today, account_id):
+    """与业务代码一致的日志查询"""
+    return {
+        '账号列表及今日统计 (/api/accounts)': account_listing(today),
+        '账号列表翻页 (/api/accounts?page)': account_listing(today, page=5),
+        '账号今日统计 (每日日志邮件)': select(DailyAccountStats).where(
+            DailyAccountStats.day == today, DailyAccountStats.account_id.in_(range(1, 21))),
+        '按账号分页 (/api/logs?account_id)': select(LoginLog).where(
+            LoginLog.account_id == account_id).order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(50),
+        '按账号+日期分页 (/api/logs?account_id&date)': select(LoginLog).where(
+            LoginLog.account_id == account_id, LoginLog.created_on(today)).order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(50),
+        '按级别分页 (/api/logs?level)': select(LoginLog).where(
+            LoginLog.level == 'ERROR').order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(50),
+        '按日期分页 (/api/logs?date)': select(LoginLog).where(
+            LoginLog.created_on(today)).order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(50),
+        '最新日志 (/api/logs)': select(LoginLog).order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(50),
+        '游标翻页 (/api/logs?cursor)': select(LoginLog).where(
+            tuple_(LoginLog.created_at, LoginLog.id) < tuple_(datetime.combine(today, datetime.min.time()) - timedelta(days=60), 1)
+        ).order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(50),
+        '按账号游标翻页 (/api/logs?account_id&cursor)': select(LoginLog).where(
+            LoginLog.account_id == account_id,
+            tuple_(LoginLog.created_at, LoginLog.id) < tuple_(datetime.combine(today, datetime.min.time()) - timedelta(days=60), 1)
+        ).order_by(LoginLog.created_at.desc(), LoginLog.id.desc()).limit(50),
+        '今日成功尝试 (登录成功邮件)': select(LoginAttempt).where(
+            LoginAttempt.account_id == account_id, LoginAttempt.created_on(today),
+            LoginAttempt.is_success == True).order_by(LoginAttempt.created_at.desc()),
+        '今日登录尝试 (每日日志邮件)': select(LoginAttempt).where(
+            LoginAttempt.account_id == account_id, LoginAttempt.created_on(today)).order_by(LoginAttempt.created_at.desc()),
+        '今日成功登录 (is_success)': select(func.count()).select_from(LoginLog).where(
+            LoginLog.is_success == True, LoginLog.created_on(today)),
+        '按日期清空 (/api/logs/clear)': delete(LoginLog).where(LoginLog.created_on(today - timedelta(days=365))),
+    }
+
+
+def explain(stmt):
+    compiled = stmt.compile(dialect=sqlite.dialect(paramstyle='named'), compile_kwargs={'render_postcompile': True})
+    rows = db.session.execute(text(f"EXPLAIN QUERY PLAN {compiled}"), compiled.params).fetchall()
+    return [row[-1] for row in rows], compiled
+
+
+def plan_problems(details):
+    """全表扫描或临时排序视为未命中索引（账号表按主键顺序分页扫描除外，账号数远小于日志行数）"""
+    problems = []
+    for detail in details:
+        if detail.startswith('SCAN') and 'USING' not in detail and detail.split()[1] not in PRIMARY_KEY_SCANS:
+            problems.append(detail)
+        if 'TEMP B-TREE' in detail:
+            problems.append(detail)
+    return problems
+
+
+def count_statements(fn):
+    """执行 fn 并返回期间发出的 SQL 语句"""
+    statements = []
+
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        statements.append(statement)
+
+    event.listen(db.engine, 'before_cursor_execute', before_cursor_execute)
+    try:
+        fn()
+    finally:
+        event.remove(db.engine, 'before_cursor_execute', before_cursor_execute)
+    return statements
+
+
+def check_page_serialization(per_page=50):
+    """序列化一页日志（与 /api/logs 相同的查询和 to_dict 参数）应只执行一条 SQL"""
+    def serialize():
+        logs, _ = paginate_logs(log_list_query(), per_page)
+        return [log.to_dict(include_details=False) for log in logs]
+
+    db.session.expunge_all()
+    statements = count_statements(serialize)
+    status = '通过' if len(statements) == 1 else '失败'
+    print(f"[{status}] 序列化一页 {per_page} 条日志执行 {len(statements)} 条 SQL（期望 1 条）")
+    return len(statements) == 1
+
+
+def check_error_message_search(keyword='账号已被冻结'):
+    """补建全文索引后，按登录接口返回的 sErrMsg 检索应能找到对应的登录尝试记录"""
+    search = LogSearch()
+    search.ensure_index()
+    started = time.perf_counter()
+    search.backfill()
+    search.ready = True
+    elapsed = time.perf_counter() - started
+
+    attempts, _ = search.search_attempts(keyword)
+    found = bool(attempts) and all(keyword in attempt.error_message for attempt in attempts)
+    status = '通过' if found else '失败'
+    print(f"[{status}] 补建全文索引（{search.mode}）耗时 {elapsed:.1f} 秒，"
+          f"检索错误信息“{keyword}”找到 {len(attempts)} 条登录尝试记录")
+    return found
+
+
+def main():
+    parser = argparse.ArgumentParser(description='登录日志查询计划检查')
+    parser.add_argument('--rows', type=int, default=1000000, help='模拟日志行数')
+    parser.add_argument('--accounts', type=int, default=200, help='模拟账号数')
+    parser.add_argument('--days', type=int, default=90, help='日志覆盖的天数')
+    args = parser.parse_args()
+
+    db_file = os.path.join(tempfile.mkdtemp(prefix='log-plans-'), 'plans.db')
+    app = create_app(db_file)
+    failed = False
+    with app.app_context():
+        db.create_all()
+        ensure_indexes()
+
+        started = time.perf_counter()
+        stats_rows = populate(args.rows, args.accounts, args.days)
+        db.session.execute(text('ANALYZE'))
+        print(f"写入 {args.rows} 行日志、{args.rows // LOGS_PER_ATTEMPT} 条登录尝试记录和 {stats_rows} 行每日统计，"
+              f"耗时 {time.perf_counter() - started:.1f} 秒，数据库 {os.path.getsize(db_file) / 1024 / 1024:.0f} MB\n")
+
+        today = datetime.utcnow().date()
+        for name, stmt in hot_queries(today, account_id=1).items():
+            details, compiled = explain(stmt)
+            problems = plan_problems(details)
+
+            started = time.perf_counter()
+            if stmt.is_select:
+                db.session.execute(stmt).fetchall()
+            else:
+                db.session.execute(stmt)
+                db.session.rollback()
+            elapsed = (time.perf_counter() - started) * 1000
+
+            status = '失败' if problems else '通过'
+            failed = failed or bool(problems)
+            print(f"[{status}] {name}  {elapsed:.1f} ms")
+            for detail in details:
+                print(f"        {detail}")
+
+        print()
+        failed = not check_page_serialization() or failed
+        failed = not check_error_message_search() or failed
+
+    print('\n存在未通过的检查' if failed else '\n所有检查均通过')
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,161 @@
+"""登录负载测试
+
+创建 N 个测试账号，通过真实的 SchedulerService（定时任务入口、延迟重试任务）并发执行登录，
+统计每秒登录数、单账号登录耗时的 p50/p95/p99 以及数据库增长。默认在进程内启动本地模拟服务
+（tools.mock_cms）并使用独立的临时 SQLite 数据库：
+
+    python -m tools.loadtest --accounts 200 --rounds 2 --latency-ms 50 --captcha-reject-rate 0.1
+
+指定 --base-url 时连接已有的模拟服务（或其他测试环境），不再启动内置模拟服务。
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+
+
+def percentile(values, pct):
+    """最近秩法计算百分位数"""
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='登录负载测试')
+    parser.add_argument('--accounts', type=int, default=100, help='测试账号数量')
+    parser.add_argument('--rounds', type=int, default=1, help='登录轮数（第二轮起可观察会话复用效果）')
+    parser.add_argument('--base-url', default=None, help='CMS 接口地址，未指定时启动内置模拟服务')
+    parser.add_argument('--port', type=int, default=18080, help='内置模拟服务端口')
+    parser.add_argument('--latency-ms', type=float, default=50, help='内置模拟服务的接口延迟（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='内置模拟服务返回 HTTP 500 的比例')
+    parser.add_argument('--captcha-reject-rate', type=float, default=0.0, help='内置模拟服务的验证码误拒率')
+    parser.add_argument('--captcha-uses', type=int, default=1,
+                        help='内置模拟服务中每个验证码可提交的登录次数，0 表示不限')
+    parser.add_argument('--database-url', default=None, help='数据库地址，默认使用临时 SQLite 文件')
+    parser.add_argument('--rate-limit', type=float, default=None,
+                        help='上游限流（每秒请求数，0 表示不限流），默认沿用 CMS_RATE_LIMIT 配置')
+    parser.add_argument('--no-session-reuse', action='store_true', help='关闭登录会话复用，每轮都走完整登录流程')
+    parser.add_argument('--timeout', type=int, default=600, help='每轮最长等待时间（秒）')
+    return parser.parse_args()
+
+
+def main():
+    args = parse_args()
+
+    # 配置在导入应用前通过环境变量生效
+    if args.base_url is None:
+        from tools.mock_cms import MockCms, start_in_thread
+        mock = MockCms(args.latency_ms, args.error_rate, args.captcha_reject_rate, captcha_uses=args.captcha_uses)
+        args.base_url = start_in_thread(mock, port=args.port)
+        print(f"已启动内置模拟服务: {args.base_url}")
+    os.environ['CMS_API_BASE_URL'] = args.base_url
+
+    db_file = None
+    if args.database_url is None:
+        db_file = os.path.join(tempfile.mkdtemp(prefix='loadtest-'), 'loadtest.db')
+        args.database_url = f"sqlite:///{db_file}"
+    os.environ['DATABASE_URL'] = args.database_url
+    if args.no_session_reuse:
+        os.environ['SESSION_REUSE_ENABLED'] = 'false'
+    if args.rate_limit is not None:
+        os.environ['CMS_RATE_LIMIT'] = str(args.rate_limit)
+
+    from apscheduler.events import EVENT_JOB_ERROR, EVENT_JOB_EXECUTED
+    from apscheduler.triggers.date import DateTrigger
+    from app import app, log_writer, scheduler_service
+    from config import Config
+    from models import db, Account, LoginLog
+
+    print(f"上游限流: {Config.CMS_RATE_LIMIT or '不限'} 次/秒, 会话复用: {'开启' if Config.SESSION_REUSE_ENABLED else '关闭'}")
+
+    def table_counts():
+        return {table.name: db.session.query(table).count() for table in db.metadata.sorted_tables}
+
+    with app.app_context():
+        accounts = [Account(name=f"loadtest_{i}", email=f"loadtest_{i}@example.com", password='password',
+                            email_notification=False) for i in range(args.accounts)]
+        db.session.add_all(accounts)
+        db.session.commit()
+        account_ids = [account.id for account in accounts]
+        before = table_counts()
+    db_size_before = os.path.getsize(db_file) if db_file else None
+
+    lock = threading.Lock()
+    state = {}
+
+    def on_job_event(event):
+        """定时任务或重试任务执行完毕：账号不再等待重试即视为本轮完成"""
+        if not (event.job_id.startswith('loadtest_') or '_retry_' in event.job_id):
+            return
+        account_id = int(event.job_id.split('_')[1])
+        with lock:
+            entry = state.get(account_id)
+            if entry is None or entry['finished'] is not None:
+                return
+            with scheduler_service.retry_lock:
+                pending = account_id in scheduler_service.pending_retries
+            if pending and event.exception is None:
+                return
+            success = bool(event.exception is None and event.retval and event.retval[0])
+            entry['finished'] = time.perf_counter()
+            entry['success'] = success
+            if len([e for e in state.values() if e['finished'] is None]) == 0:
+                round_done.set()
+
+    scheduler_service.scheduler.add_listener(on_job_event, EVENT_JOB_EXECUTED | EVENT_JOB_ERROR)
+
+    for round_no in range(1, args.rounds + 1):
+        round_done = threading.Event()
+        started = time.perf_counter()
+        with lock:
+            state.clear()
+            for account_id in account_ids:
+                state[account_id] = {'started': started, 'finished': None, 'success': False}
+        for account_id in account_ids:
+            scheduler_service.scheduler.add_job(
+                func=scheduler_service._execute_scheduled_login,
+                trigger=DateTrigger(),
+                id=f"loadtest_{account_id}",
+                args=[account_id],
+                replace_existing=True,
+                misfire_grace_time=None
+            )
+
+        round_done.wait(args.timeout)
+        elapsed = time.perf_counter() - started
+        with lock:
+            latencies = [e['finished'] - e['started'] for e in state.values() if e['finished'] is not None]
+            succeeded = len([e for e in state.values() if e['success']])
+        completed = len(latencies)
+
+        print(f"\n第 {round_no} 轮: 账号 {args.accounts}, 完成 {completed}, 成功 {succeeded}, 耗时 {elapsed:.2f} 秒")
+        print(f"  吞吐量 : {succeeded / elapsed:.2f} 次成功登录/秒")
+        print(f"  延迟   : p50 {percentile(latencies, 50):.3f}s  p95 {percentile(latencies, 95):.3f}s  "
+              f"p99 {percentile(latencies, 99):.3f}s  max {max(latencies or [0]):.3f}s")
+
+    log_writer.flush()
+    with app.app_context():
+        after = table_counts()
+        log_rows = LoginLog.query.count()
+    print("\n数据库增长:")
+    for table, count in after.items():
+        print(f"  {table:<20} {before.get(table, 0):>8} -> {count:>8}  (+{count - before.get(table, 0)})")
+    print(f"  每次登录平均日志行数: {log_rows / max(1, args.accounts * args.rounds):.1f}")
+    writer_stats = log_writer.get_stats()
+    print(f"  日志提交次数: {writer_stats['commits']}（每次提交 {writer_stats['rows_per_commit']} 行，"
+          f"每次登录 {writer_stats['commits'] / max(1, args.accounts * args.rounds):.2f} 次提交）")
+    if db_file:
+        size_after = os.path.getsize(db_file)
+        print(f"  数据库文件: {db_size_before / 1024:.0f} KB -> {size_after / 1024:.0f} KB")
+
+    scheduler_service.shutdown()
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,219 @@
+"""本地 CMS 接口模拟服务
+
+实现 token/generateCaptchaToken、captcha、login、club/getClubList 四个接口：
+token 即一把真实 RSA 公钥（Base64 DER），验证码为真实渲染的4位图片，登录时用 token
+对应的私钥解密账号并校验验证码。可配置接口延迟、错误率（HTTP 500）、验证码误拒率，以及一个验证码
+可提交几次登录（默认 1 次，提交后即作废，再次提交返回 token无效；0 表示重新获取前一直有效）：
+
+    python -m tools.mock_cms --port 18080 --latency-ms 50 --error-rate 0.02 --captcha-reject-rate 0.1 --captcha-uses 1
+
+启动后设置 CMS_API_BASE_URL=http://127.0.0.1:18080/cms-api 即可让登录服务连接该模拟服务。
+"""
+import argparse
+import asyncio
+import base64
+import io
+import random
+import threading
+import time
+from collections import deque
+
+from aiohttp import web
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+from PIL import Image, ImageDraw, ImageFont
+
+# 去掉容易混淆的字符（0/O、1/I）
+CAPTCHA_CHARS = 'ABCDEFGHJKLMNPQRSTUVWXYZ23456789'
+RSA_BLOCK_SIZE = 128
+
+
+class MockCms:
+    """模拟服务状态：token → 私钥/验证码，以及登录成功后的会话有效期"""
+
+    def __init__(self, latency_ms=50, error_rate=0.0, captcha_reject_rate=0.0, token_ttl=600, captcha_uses=1,
+                 key_pool_size=32, seed=None):
+        self.latency = latency_ms / 1000
+        self.error_rate = error_rate
+        self.captcha_reject_rate = captcha_reject_rate
+        self.token_ttl = token_ttl
+        self.captcha_uses = captcha_uses
+        self.rng = random.Random(seed)
+
+        # 每个 token 使用一把新密钥；生成RSA密钥较慢，预先生成一批并在后台补充
+        self.key_pool_size = key_pool_size
+        self.fresh_keys = deque(self._new_key() for _ in range(key_pool_size))
+        self._refill_task = None
+        self.tokens = {}
+        self.sessions = {}
+        self.font = self._load_font()
+        self.stats = {'token': 0, 'captcha': 0, 'login': 0, 'login_success': 0, 'club_list': 0, 'errors': 0}
+
+    @staticmethod
+    def _new_key():
+        return rsa.generate_private_key(public_exponent=65537, key_size=1024)
+
+    async def _take_key(self):
+        loop = asyncio.get_running_loop()
+        if self._refill_task is None or self._refill_task.done():
+            self._refill_task = asyncio.ensure_future(self._refill_keys())
+        if self.fresh_keys:
+            return self.fresh_keys.popleft()
+        return await loop.run_in_executor(None, self._new_key)
+
+    async def _refill_keys(self):
+        loop = asyncio.get_running_loop()
+        while len(self.fresh_keys) < self.key_pool_size:
+            self.fresh_keys.append(await loop.run_in_executor(None, self._new_key))
+
+    @staticmethod
+    def _load_font():
+        try:
+            return ImageFont.load_default(size=30)
+        except TypeError:  # Pillow < 10.1
+            return ImageFont.load_default()
+
+    async def _delay(self):
+        """模拟网络延迟（±50% 抖动），并按错误率返回 True 表示本次请求失败"""
+        if self.latency:
+            await asyncio.sleep(self.latency * self.rng.uniform(0.5, 1.5))
+        if self.rng.random() < self.error_rate:
+            self.stats['errors'] += 1
+            return True
+        return False
+
+    def _render_captcha(self, text):
+        image = Image.new('RGB', (120, 44), 'white')
+        draw = ImageDraw.Draw(image)
+        draw.text((12, 4), text, fill='black', font=self.font)
+        for _ in range(3):
+            draw.line([(self.rng.randint(0, 120), self.rng.randint(0, 44)),
+                       (self.rng.randint(0, 120), self.rng.randint(0, 44))], fill='lightgray')
+        buffer = io.BytesIO()
+        image.save(buffer, 'PNG')
+        return base64.b64encode(buffer.getvalue()).decode()
+
+    def _decrypt(self, token, ciphertext):
+        """用 token 对应的私钥按128字节分块解密"""
+        private_key = self.tokens[token]['key']
+        data = base64.b64decode(ciphertext)
+        return b''.join(
+            private_key.decrypt(data[i:i + RSA_BLOCK_SIZE], padding.PKCS1v15())
+            for i in range(0, len(data), RSA_BLOCK_SIZE)
+        ).decode()
+
+    async def generate_token(self, request):
+        if await self._delay():
+            return web.Response(status=500)
+        self.stats['token'] += 1
+
+        key = await self._take_key()
+        public_der = key.public_key().public_bytes(serialization.Encoding.DER,
+                                                    serialization.PublicFormat.SubjectPublicKeyInfo)
+        token = base64.b64encode(public_der).decode()
+        self.tokens[token] = {'key': key, 'captcha': None, 'captcha_uses': 0}
+        return web.json_response({'iErrCode': 0, 'result': token})
+
+    async def captcha(self, request):
+        if await self._delay():
+            return web.Response(status=500)
+        self.stats['captcha'] += 1
+
+        data = await request.post()
+        entry = self.tokens.get(data.get('token'))
+        if entry is None:
+            return web.json_response({'iErrCode': 1, 'sErrMsg': 'token无效'})
+        entry['captcha'] = ''.join(self.rng.choice(CAPTCHA_CHARS) for _ in range(4))
+        entry['captcha_uses'] = self.captcha_uses
+        return web.json_response({'iErrCode': 0, 'result': self._render_captcha(entry['captcha'])})
+
+    async def login(self, request):
+        if await self._delay():
+            return web.Response(status=500)
+        self.stats['login'] += 1
+
+        data = await request.post()
+        token = data.get('token')
+        entry = self.tokens.get(token)
+        if entry is None or not entry['captcha']:
+            return web.json_response({'iErrCode': 1, 'sErrMsg': 'token无效'})
+
+        # 提交次数用完后验证码作废（captcha_uses 为 0 时不限次数）
+        expected = entry['captcha']
+        entry['captcha_uses'] -= 1
+        if entry['captcha_uses'] == 0:
+            entry['captcha'] = None
+        if (data.get('safeCode') or '').upper() != expected or self.rng.random() < self.captcha_reject_rate:
+            return web.json_response({'iErrCode': 1, 'sErrMsg': '验证码错误'})
+
+        try:
+            account = self._decrypt(token, data.get('account', ''))
+            self._decrypt(token, data.get('data', ''))
+        except Exception:
+            return web.json_response({'iErrCode': 2, 'sErrMsg': '参数错误'})
+
+        self.sessions[token] = {'account': account, 'expires_at': time.monotonic() + self.token_ttl}
+        self.stats['login_success'] += 1
+        return web.json_response({'iErrCode': 0, 'result': {'account': account}})
+
+    async def club_list(self, request):
+        if await self._delay():
+            return web.Response(status=500)
+        self.stats['club_list'] += 1
+
+        session = self.sessions.get(request.headers.get('token'))
+        if session is None or session['expires_at'] < time.monotonic():
+            return web.json_response({'iErrCode': 401, 'sErrMsg': '登录已过期'})
+        club_id = abs(hash(session['account'])) % 1000000
+        return web.json_response({'iErrCode': 0, 'result': [{
+            'lClubID': club_id,
+            'sClubName': f"俱乐部{club_id}",
+            'lCreateUser': club_id + 1,
+            'iCreditLeagueId': club_id % 100
+        }]})
+
+    def create_app(self):
+        app = web.Application()
+        app.router.add_post('/cms-api/token/generateCaptchaToken', self.generate_token)
+        app.router.add_post('/cms-api/captcha', self.captcha)
+        app.router.add_post('/cms-api/login', self.login)
+        app.router.add_post('/cms-api/club/getClubList', self.club_list)
+        return app
+
+
+def start_in_thread(mock, host='127.0.0.1', port=18080):
+    """在后台线程中启动模拟服务，返回 base_url"""
+    started = threading.Event()
+
+    def run():
+        loop = asyncio.new_event_loop()
+        asyncio.set_event_loop(loop)
+        runner = web.AppRunner(mock.create_app())
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, host, port).start())
+        started.set()
+        loop.run_forever()
+
+    threading.Thread(target=run, name='mock-cms', daemon=True).start()
+    started.wait()
+    return f"http://{host}:{port}/cms-api"
+
+
+def main():
+    parser = argparse.ArgumentParser(description='本地 CMS 接口模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=18080)
+    parser.add_argument('--latency-ms', type=float, default=50, help='每个接口的平均延迟（毫秒）')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='返回 HTTP 500 的比例')
+    parser.add_argument('--captcha-reject-rate', type=float, default=0.0, help='验证码正确时仍判为错误的比例')
+    parser.add_argument('--token-ttl', type=int, default=600, help='登录会话有效期（秒）')
+    parser.add_argument('--captcha-uses', type=int, default=1, help='每个验证码可提交的登录次数，0 表示不限')
+    args = parser.parse_args()
+
+    mock = MockCms(args.latency_ms, args.error_rate, args.captcha_reject_rate, args.token_ttl, args.captcha_uses)
+    print(f"模拟服务已启动: http://{args.host}:{args.port}/cms-api")
+    web.run_app(mock.create_app(), host=args.host, port=args.port, print=None)
+
+
+if __name__ == '__main__':
+    main()
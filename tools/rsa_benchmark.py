@@ -0,0 +1,86 @@
+"""RSA加密基准测试
+
+对比优化前（每次加密都重新解析公钥、逐块构建列表）与当前 rsa_encrypt_long
+（公钥LRU缓存、无中间列表）在一次登录中的加密耗时。一次登录包含三次加密：
+固定公钥加密密码、token 公钥二次加密密码、token 公钥加密账号。
+
+    python -m tools.rsa_benchmark --logins 500
+"""
+import argparse
+import base64
+import re
+import time
+
+from cryptography.hazmat.backends import default_backend
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import padding, rsa
+
+from services.login_engine import AsyncLoginEngine, parse_public_key
+
+
+def legacy_load_public_key(key_str):
+    """优化前的公钥加载方式（每次调用都重新解析）"""
+    if "-----BEGIN" in key_str:
+        return serialization.load_pem_public_key(key_str.encode(), backend=default_backend())
+    try:
+        der_data = base64.b64decode(key_str)
+        return serialization.load_der_public_key(der_data, backend=default_backend())
+    except Exception:
+        hex_str = re.sub(r'\s+', '', key_str)
+        if len(hex_str) % 2 != 0:
+            hex_str = '0' + hex_str
+        return serialization.load_der_public_key(bytes.fromhex(hex_str), backend=default_backend())
+
+
+def legacy_rsa_encrypt_long(text, public_key_str):
+    """优化前的分块加密实现"""
+    public_key = legacy_load_public_key(public_key_str)
+    max_block_size = public_key.key_size // 8 - 11
+    encrypted_blocks = []
+    for i in range(0, len(text), max_block_size):
+        block = text[i:i + max_block_size]
+        encrypted_blocks.append(public_key.encrypt(block.encode('utf-8'), padding.PKCS1v15()))
+    return base64.b64encode(b''.join(encrypted_blocks)).decode('utf-8')
+
+
+def make_token(key_bits):
+    """生成与接口返回格式一致的 token（Base64 DER 公钥）"""
+    private_key = rsa.generate_private_key(public_exponent=65537, key_size=key_bits)
+    der = private_key.public_key().public_bytes(
+        serialization.Encoding.DER, serialization.PublicFormat.SubjectPublicKeyInfo
+    )
+    return base64.b64encode(der).decode('utf-8')
+
+
+def run(encrypt, first_public_key, tokens, account, password):
+    start = time.perf_counter()
+    for token in tokens:
+        first = encrypt(password, first_public_key)
+        encrypt(first, token)
+        encrypt(account, token)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description='RSA加密基准测试')
+    parser.add_argument('--logins', type=int, default=200, help='模拟登录次数')
+    parser.add_argument('--tokens', type=int, default=0, help='不同 token 公钥的数量（0 表示每次登录使用新 token）')
+    parser.add_argument('--key-bits', type=int, default=1024, help='token 公钥长度')
+    args = parser.parse_args()
+
+    engine = AsyncLoginEngine()
+    token_pool = [make_token(args.key_bits) for _ in range(args.tokens or args.logins)]
+    tokens = [token_pool[i % len(token_pool)] for i in range(args.logins)]
+    account, password = 'benchmark@example.com', 'benchmark-password'
+
+    before = run(legacy_rsa_encrypt_long, engine.first_public_key, tokens, account, password)
+    after = run(engine.rsa_encrypt_long, engine.first_public_key, tokens, account, password)
+
+    print(f"优化前: 每次登录加密耗时 {before / args.logins * 1000:.3f} 毫秒")
+    print(f"优化后: 每次登录加密耗时 {after / args.logins * 1000:.3f} 毫秒")
+    print(f"加速比: {before / after:.2f}x")
+    print(f"公钥缓存: {parse_public_key.cache_info()}")
+
+
+if __name__ == '__main__':
+    main()